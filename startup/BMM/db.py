@@ -1,5 +1,5 @@
-import os
-import numpy
+import os, json
+import numpy, pandas
 import matplotlib.pyplot as plt
 
 from BMM import user_ns as user_ns_module
@@ -61,3 +61,125 @@ def show_snapshot(uid):
         key = 'anacam_image'
     plt.imshow(numpy.array(this[key])[0])
     plt.grid(False)
+
+
+
+def search_uids(catalog, query):
+    '''Return the list of UIDs of the records in catalog which match
+    query, a dict like {'XDI._kind': 'xafs', 'XDI.Facility.SAF': 312345}.
+
+    catalog is either Databroker (v1 or v2) or a FileCatalog.
+    '''
+    if hasattr(catalog, 'v2'):
+        catalog = catalog.v2
+    return list(catalog.search(query).keys())
+
+
+class FileRun():
+    '''One record in a FileCatalog.  This presents the parts of a
+    Databroker v1 header used by the BMM data export and analysis
+    tools: the start and stop documents and the tables of the primary
+    and baseline streams.
+
+    FileRun.from_header(header) makes a FileRun by reading everything
+    from a Databroker header.  This is handy for holding onto a record
+    so that it only gets read from Databroker once.
+    '''
+    def __init__(self, start=None, stop=None, tables=None):
+        self.start  = start or dict()
+        self.stop   = stop or dict()
+        self.tables = tables or dict()
+
+    @classmethod
+    def from_header(cls, header, streams=('primary', 'baseline')):
+        tables = dict()
+        for s in streams:
+            try:
+                tables[s] = header.table(s)
+            except:
+                tables[s] = pandas.DataFrame()
+        return cls(dict(header.start), dict(header.stop or {}), tables)
+
+    @property
+    def metadata(self):
+        return {'start': self.start, 'stop': self.stop}
+
+    def table(self, stream_name='primary'):
+        if stream_name not in self.tables:
+            return pandas.DataFrame()
+        return self.tables[stream_name].copy()
+
+
+class FileCatalog():
+    '''A local, file-backed stand-in for Databroker.
+
+    Each record is stored in folder as {uid}.json, holding the start
+    and stop documents, and {uid}.{stream}.pkl, holding the table for
+    each stream.  Records are added from Databroker with
+
+      fc = FileCatalog('/path/to/folder')
+      fc.add(db[uid])
+
+    then fc can be used in place of db by tools like db2xdi_batch:
+    fc[uid] returns a FileRun and fc.search({'XDI._kind': 'xafs'})
+    returns the FileCatalog of matching records.
+    '''
+    def __init__(self, folder, uids=None):
+        self.folder = folder
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self._uids = uids
+
+    def keys(self):
+        if self._uids is not None:
+            return list(self._uids)
+        return sorted(f[:-5] for f in os.listdir(self.folder) if f.endswith('.json'))
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, uid):
+        return uid in self.keys()
+
+    def __getitem__(self, uid):
+        fname = os.path.join(self.folder, f'{uid}.json')
+        if not os.path.isfile(fname):
+            raise KeyError(uid)
+        with open(fname, 'r') as fh:
+            docs = json.load(fh)
+        tables = dict()
+        for s in docs['streams']:
+            tables[s] = pandas.read_pickle(os.path.join(self.folder, f'{uid}.{s}.pkl'))
+        return FileRun(docs['start'], docs['stop'], tables)
+
+    def add(self, header, streams=('primary', 'baseline')):
+        '''Store a Databroker header (or a FileRun) in this catalog.'''
+        if not isinstance(header, FileRun):
+            header = FileRun.from_header(header, streams)
+        uid = header.start['uid']
+        for s, t in header.tables.items():
+            t.to_pickle(os.path.join(self.folder, f'{uid}.{s}.pkl'))
+        with open(os.path.join(self.folder, f'{uid}.json'), 'w') as fh:
+            json.dump({'start': header.start, 'stop': header.stop, 'streams': list(header.tables.keys())},
+                      fh, default=str)
+        return uid
+
+    def search(self, query):
+        '''Return a FileCatalog with the records whose start documents
+        match every item in query.  Keys in query are dotted paths into
+        the start document, e.g. 'XDI.Element.symbol'.'''
+        found = []
+        for uid in self.keys():
+            with open(os.path.join(self.folder, f'{uid}.json'), 'r') as fh:
+                start = json.load(fh)['start']
+            if all(_dotted(start, k) == v for k, v in query.items()):
+                found.append(uid)
+        return FileCatalog(self.folder, found)
+
+
+def _dotted(doc, key):
+    for k in key.split('.'):
+        if not isinstance(doc, dict) or k not in doc:
+            return None
+        doc = doc[k]
+    return doc
@@ -5,7 +5,7 @@ from cycler import cycler
 import numpy as np
 import warnings
 from numpy import log
-import threading
+import threading, time
 
 #from bluesky.callbacks import CallbackBase
 from bluesky.callbacks.mpl_plotting import QtAwareCallback, initialize_qt_teleporter
@@ -62,10 +62,35 @@ def close_all_plots():
     BMMuser.ax       = None
 
 
+class GrowingBuffer():
+    '''A preallocated NumPy array which doubles its capacity when it
+    fills, so appending a point costs constant time on average.'''
+    def __init__(self, capacity=512):
+        self.data = np.empty(capacity)
+        self.n    = 0
+
+    def __len__(self):
+        return self.n
+
+    def append(self, value):
+        if self.n == len(self.data):
+            grown = np.empty(2*len(self.data))
+            grown[:self.n] = self.data[:self.n]
+            self.data = grown
+        self.data[self.n] = value
+        self.n += 1
+
+    @property
+    def values(self):
+        return self.data[:self.n]
+
+
 initialize_qt_teleporter()
 #class DerivedPlot(CallbackBase):
 class DerivedPlot(QtAwareCallback):
-    def __init__(self, func, ax=None, xlabel=None, ylabel=None, title=None, legend_keys=None, stream_name='primary', **kwargs):
+    headroom = 0.25    # fraction of the x range left ahead of the data while the scan is underway
+
+    def __init__(self, func, ax=None, xlabel=None, ylabel=None, title=None, legend_keys=None, stream_name='primary', max_fps=10, **kwargs):
         """
         func expects an Event document which looks like this:
         {'time': <UNIX epoch>,
@@ -75,6 +100,16 @@ class DerivedPlot(QtAwareCallback):
          'filled': {}  # only important if you have big array data
         }
         and should return (x, y)
+
+        Every event is added to the plot, but the plot is redrawn at
+        most max_fps times per second.  Events which arrive in between
+        are drawn together at the next redraw.  When all the new points
+        are inside the current axis limits, only the current line is
+        redrawn (by blitting, if the canvas supports it).  Otherwise the
+        axes are rescaled, with some room left ahead of the data, and
+        the whole figure is redrawn.  The axes are fit to the data at
+        the end of the scan.  max_fps=None redraws the whole figure at
+        every event.
         """
         super().__init__()
         self.__setup_lock = threading.Lock()
@@ -116,17 +151,26 @@ class DerivedPlot(QtAwareCallback):
             self.legend_title = " :: ".join([name for name in self.legend_keys])
             self.stream_name = stream_name
             self.descriptors = {}
+            self.max_fps = max_fps
+            self.canvas = self.ax.figure.canvas
+            self.blit = max_fps is not None and getattr(self.canvas, 'supports_blit', False)
+            self.background = None
+            self.redraws = {'full': 0, 'blit': 0}
+            self.timer = None
+            if self.blit:
+                self.canvas.mpl_connect('draw_event', self.on_draw)
         self.__setup = setup
 
     def start(self, doc):
         self.__setup()
         # The doc is not used; we just use the signal that a new run began.
-        self.x_data, self.y_data = [], []
+        self.x_data, self.y_data = GrowingBuffer(), GrowingBuffer()
+        self.drawn, self.pending, self.last_draw = 0, False, 0
         self.descriptors.clear()
         label = " :: ".join(
             [str(doc.get(name, name)) for name in self.legend_keys])
         kwargs = ChainMap(self.kwargs, {'label': label})
-        self.current_line, = self.ax.plot([], [], **kwargs)
+        self.current_line, = self.ax.plot([], [], animated=self.blit, **kwargs)
         self.lines.append(self.current_line)
         self.legend = self.ax.legend(
             loc=0, title=self.legend_title).set_draggable(True)
@@ -143,11 +187,76 @@ class DerivedPlot(QtAwareCallback):
         x, y = self.func(doc)
         self.y_data.append(y)
         self.x_data.append(x)
-        self.current_line.set_data(self.x_data, self.y_data)
-        # Rescale and redraw.
-        self.ax.relim(visible_only=True)
-        self.ax.autoscale_view(tight=True)
-        self.ax.figure.canvas.draw_idle()
+        self.pending = True
+        if self.max_fps is None:
+            self.redraw(full=True)
+            return
+        wait = self.last_draw + 1.0/self.max_fps - time.monotonic()
+        if wait <= 0:
+            self.redraw()
+        elif self.timer is None:
+            ## redraw the last events even if no more arrive for a while
+            self.timer = self.canvas.new_timer(interval=int(1000*wait)+1)
+            self.timer.single_shot = True
+            self.timer.add_callback(self.deferred)
+            self.timer.start()
+
+    def deferred(self):
+        self.timer = None
+        self.redraw()
+
+    def inside_view(self):
+        '''True if the points added since the last redraw are inside the current axis limits.'''
+        x, y = self.x_data.values[self.drawn:], self.y_data.values[self.drawn:]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)   # all-NaN slices
+            for data, limits in ((x, self.ax.get_xlim()), (y, self.ax.get_ylim())):
+                low, high = np.nanmin(data), np.nanmax(data)
+                if not np.isnan(low) and (low < min(limits) or high > max(limits)):
+                    return False
+        return True
+
+    def redraw(self, full=False):
+        if not self.pending:
+            return
+        self.pending, self.last_draw = False, time.monotonic()
+        self.current_line.set_data(self.x_data.values, self.y_data.values)
+        if not full and self.blit and self.background is not None and self.inside_view():
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.current_line)
+            self.canvas.blit(self.ax.figure.bbox)
+            self.redraws['blit'] += 1
+        else:
+            # Rescale and redraw.
+            self.ax.relim(visible_only=True)
+            self.ax.autoscale_view(tight=True)
+            if not full and len(self.x_data) > 1:
+                ## leave room ahead of the data in the direction of the scan so the next points can be blitted
+                low, high = self.ax.get_xlim()
+                room = self.headroom * (high - low)
+                if self.x_data.values[-1] >= self.x_data.values[0]:
+                    self.ax.set_xlim(low, high + room, auto=None)
+                else:
+                    self.ax.set_xlim(low - room, high, auto=None)
+            self.background = None
+            self.canvas.draw_idle()
+            self.redraws['full'] += 1
+        self.drawn = len(self.x_data)
+
+    def on_draw(self, event):
+        '''After a full redraw, keep the background for blitting and draw the current line on it.'''
+        if event is not None and event.canvas is not self.canvas:
+            return
+        self.background = self.canvas.copy_from_bbox(self.ax.figure.bbox)
+        if hasattr(self, 'current_line'):
+            self.ax.draw_artist(self.current_line)
 
     def stop(self, doc):
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        ## leave a finished line which is drawn like any other
+        self.current_line.set_animated(False)
+        self.pending = True
+        self.redraw(full=True)
         super().stop(doc)
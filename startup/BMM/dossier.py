@@ -1,4 +1,5 @@
 import os, re
+from concurrent.futures import ThreadPoolExecutor
 from pygments import highlight
 from pygments.lexers import PythonLexer, IniLexer
 from pygments.formatters import HtmlFormatter
@@ -267,6 +268,8 @@ class BMMDossier():
 
     def __init__(self):
         self.scanlist      = ''
+        self.snapshot_pool = None
+        self.snapshot_jobs = []
         #self.motors        = motor_sidebar()
         self.manifest_file = os.path.join(user_ns['BMMuser'].folder, 'dossier', 'MANIFEST')
 
@@ -324,11 +327,40 @@ class BMMDossier():
         ### --- capture metadata for dossier -----------------------------------------------
         self.xrf_md = {'xrf_uid': self.xrfuid, 'xrf_image': xrfimage,}
 
+    def save_snapshot(self, uid, field, filename, post=False):
+        '''Export a camera image from the catalog as a JPEG file and
+        optionally post it to Slack.  This runs on a worker thread.
+        '''
+        im = Image.fromarray(numpy.array(bmm_catalog[uid].primary.read()[field])[0])
+        im.save(filename, 'JPEG')
+        if post:
+            img_to_slack(filename)
+
+    def wait_for_snapshots(self):
+        '''Wait for the JPEG files started by cameras() to be written.  A
+        failed export is reported, it does not stop the scan sequence.'''
+        if self.snapshot_pool is None:
+            return
+        try:
+            for job, message in self.snapshot_jobs:
+                if job.exception() is not None:
+                    print(error_msg(f'{message} ({type(job.exception()).__name__}: {job.exception()})'))
+        finally:
+            self.snapshot_pool.shutdown()
+            self.snapshot_pool, self.snapshot_jobs = None, []
+
     def cameras(self, folder, stub, md):
         '''For each camera in use at the beamline, capture and image and record relevant
         metadata (UID, filename) for dossier creation
+
+        The cameras are counted one after another, but the images are
+        exported from the catalog on worker threads so that each count
+        starts as soon as the previous one finishes.  Call
+        wait_for_snapshots() before using the JPEG files.
         '''
         ahora = now()
+        self.wait_for_snapshots()
+        self.snapshot_pool, self.snapshot_jobs = ThreadPoolExecutor(max_workers=4), []
         BMMuser, xascam, anacam, usbcam1, usbcam2 = user_ns['BMMuser'], user_ns['xascam'], user_ns['anacam'], user_ns['usbcam1'], user_ns['usbcam2']
 
         ### --- XAS webcam ---------------------------------------------------------------
@@ -339,10 +371,8 @@ class BMMDossier():
         xascam._annotation_string = annotation
         print(bold_msg('XAS webcam snapshot'))
         self.webuid = yield from count([xascam], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-        im = Image.fromarray(numpy.array(bmm_catalog[self.webuid].primary.read()['xascam_image'])[0])
-        im.save(image_web, 'JPEG')
-        if BMMuser.post_webcam:
-            img_to_slack(image_web)
+        self.snapshot_jobs.append((self.snapshot_pool.submit(self.save_snapshot, self.webuid, 'xascam_image', image_web, BMMuser.post_webcam),
+                                   'Could not copy XAS webcam snapshot.'))
 
         ### --- analog camera using redgo dongle ------------------------------------------
         ###     this can only be read by a client on xf06bm-ws3, so... not QS on srv1
@@ -353,15 +383,8 @@ class BMMDossier():
             anacam._annotation_string = stub
             print(bold_msg('analog camera snapshot'))
             self.anauid = yield from count([anacam], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-            try:
-                im = Image.fromarray(numpy.array(bmm_catalog[self.anauid].primary.read()['anacam_image'])[0])
-                im.save(image_ana, 'JPEG')
-                if BMMuser.post_anacam:
-                    img_to_slack(image_ana)
-            except:
-                print(error_msg('Could not copy analog snapshot, probably because it\'s capture failed.'))
-                anacam_uid = False
-                pass
+            self.snapshot_jobs.append((self.snapshot_pool.submit(self.save_snapshot, self.anauid, 'anacam_image', image_ana, BMMuser.post_anacam),
+                                       'Could not copy analog snapshot, probably because it\'s capture failed.'))
 
         ### --- USB camera #1 --------------------------------------------------------------
         self.usb1snap = "%s_usb1_%s.jpg" % (stub, ahora)
@@ -370,10 +393,8 @@ class BMMDossier():
         usbcam1._annotation_string = stub
         print(bold_msg('USB camera #1 snapshot'))
         self.usb1uid = yield from count([usbcam1], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-        im = Image.fromarray(numpy.array(bmm_catalog[self.usb1uid].primary.read()['usbcam1_image'])[0])
-        im.save(image_usb1, 'JPEG')
-        if BMMuser.post_usbcam1:
-            img_to_slack(image_usb1)
+        self.snapshot_jobs.append((self.snapshot_pool.submit(self.save_snapshot, self.usb1uid, 'usbcam1_image', image_usb1, BMMuser.post_usbcam1),
+                                   'Could not copy USB camera #1 snapshot.'))
 
         ### --- USB camera #2 --------------------------------------------------------------
         self.usb2snap = "%s_usb2_%s.jpg" % (stub, ahora)
@@ -382,10 +403,8 @@ class BMMDossier():
         usbcam2._annotation_string = stub
         print(bold_msg('USB camera #2 snapshot'))
         self.usb2uid = yield from count([usbcam2], 1, md = {'XDI':md, 'plan_name' : 'count xafs_metadata snapshot'})
-        im = Image.fromarray(numpy.array(bmm_catalog[self.usb2uid].primary.read()['usbcam2_image'])[0])
-        im.save(image_usb2, 'JPEG')
-        if BMMuser.post_usbcam2:
-            img_to_slack(image_usb2)
+        self.snapshot_jobs.append((self.snapshot_pool.submit(self.save_snapshot, self.usb2uid, 'usbcam2_image', image_usb2, BMMuser.post_usbcam2),
+                                   'Could not copy USB camera #2 snapshot.'))
         
         ### --- capture metadata for dossier -----------------------------------------------
         self.cameras_md = {'webcam_file': image_web,  'webcam_uid': self.webuid,
@@ -425,6 +444,7 @@ class BMMDossier():
         
     def write_dossier(self):
         BMMuser, dcm, ga, xafs_ref = user_ns['BMMuser'], user_ns['dcm'], user_ns['ga'], user_ns['xafs_ref']
+        self.wait_for_snapshots()
         if self.filename is None or self.start is None:
             print(error_msg('Filename and/or start number not given.  (xafs_dossier).'))
             return None
@@ -37,30 +37,17 @@ from BMM.user_ns.dwelltime import with_quadem, with_struck, with_xspress3 #with_
 from BMM.user_ns.dwelltime import with_ic0, with_ic1, with_ic2
 
 
-class LockedDwellTimes(PseudoPositioner):
-    '''Sync QuadEM, Struck, DualEM, and Xspress3 dwell times to one
-    pseudo-axis dwell time.  These signal chains are enabled/disabled
-    in BMM/user_ns/dwelltime.py.  Those global parameters are imported
-    just above and used to set attributes of the class.  in this way,
-    only the enabled signal chains will be set, but ALL of the enabled
-    signal chains will be set.
+class DwellTimes(PseudoPositioner):
+    '''The dwell time pseudo-axis and the arithmetic which relates it to
+    the dwell times of the signal chains.  The signal chains are the
+    components of the subclasses, LockedDwellTimes for the beamline
+    and SimulatedDwellTimes (in benchmarks/dwelltime.py) for testing.
+    The signal chains are set concurrently, and within a step scan
+    bluesky's per-step position cache skips points at which the dwell
+    time does not change.
     '''
     dwell_time = Cpt(PseudoSingle, kind='hinted')
-    if with_quadem is True:
-        quadem_dwell_time = Cpt(QuadEMDwellTime, 'XF:06BM-BI{EM:2}EM180:', egu='seconds') # main ion chambers
-    if with_struck is True:
-        struck_dwell_time = Cpt(StruckDwellTime, 'XF:06BM-ES:1{Sclr:1}.',  egu='seconds') # analog detector readout
-    #if with_dualem is True:
-    #    dualem_dwell_time = Cpt(DualEMDwellTime, 'XF:06BM-BI{EM:3}EM180:', egu='seconds') # new I0 chamber
-    if with_ic0 is True:
-        ic0_dwell_time = Cpt(IC0DwellTime, 'XF:06BM-BI{IC:0}EM180:', egu='seconds') # new I0 chamber
-    if with_ic1 is True:
-        ic1_dwell_time = Cpt(IC1DwellTime, 'XF:06BM-BI{IC:1}EM180:', egu='seconds') # new It chamber
-    if with_ic2 is True:
-        ic2_dwell_time = Cpt(IC2DwellTime, 'XF:06BM-BI{IC:2}EM180:', egu='seconds') # new Ir chamber
-    if with_xspress3 is True:
-        xspress3_dwell_time = Cpt(Xspress3DwellTime, 'XF:06BM-ES{Xsp:1}:', egu='seconds') # Xspress3
-    
+
     @property
     def settle_time(self):
         return self.quadem_dwell_time.settle_time
@@ -122,3 +109,27 @@ class LockedDwellTimes(PseudoPositioner):
     def inverse(self, real_pos):
         #real_pos = self.RealPosition(*real_pos)
         return self.PseudoPosition(dwell_time=real_pos.quadem_dwell_time)
+
+
+class LockedDwellTimes(DwellTimes):
+    '''Sync QuadEM, Struck, DualEM, and Xspress3 dwell times to one
+    pseudo-axis dwell time.  These signal chains are enabled/disabled
+    in BMM/user_ns/dwelltime.py.  Those global parameters are imported
+    just above and used to set attributes of the class.  in this way,
+    only the enabled signal chains will be set, but ALL of the enabled
+    signal chains will be set.
+    '''
+    if with_quadem is True:
+        quadem_dwell_time = Cpt(QuadEMDwellTime, 'XF:06BM-BI{EM:2}EM180:', egu='seconds') # main ion chambers
+    if with_struck is True:
+        struck_dwell_time = Cpt(StruckDwellTime, 'XF:06BM-ES:1{Sclr:1}.',  egu='seconds') # analog detector readout
+    #if with_dualem is True:
+    #    dualem_dwell_time = Cpt(DualEMDwellTime, 'XF:06BM-BI{EM:3}EM180:', egu='seconds') # new I0 chamber
+    if with_ic0 is True:
+        ic0_dwell_time = Cpt(IC0DwellTime, 'XF:06BM-BI{IC:0}EM180:', egu='seconds') # new I0 chamber
+    if with_ic1 is True:
+        ic1_dwell_time = Cpt(IC1DwellTime, 'XF:06BM-BI{IC:1}EM180:', egu='seconds') # new It chamber
+    if with_ic2 is True:
+        ic2_dwell_time = Cpt(IC2DwellTime, 'XF:06BM-BI{IC:2}EM180:', egu='seconds') # new Ir chamber
+    if with_xspress3 is True:
+        xspress3_dwell_time = Cpt(Xspress3DwellTime, 'XF:06BM-ES{Xsp:1}:', egu='seconds') # Xspress3
@@ -0,0 +1,274 @@
+'''Tools toward continuous (on-the-fly) energy scans.
+
+In a fly scan, the mono Bragg axis sweeps through the angular range of
+an energy grid while the detectors are read at a fixed period.  Each
+reading is time-stamped along with the Bragg angle, and the readings
+are then binned onto the energy grid.
+
+This module provides the recording and binning half of that:
+FlyRecorder polls a Bragg axis and a list of detectors on a background
+thread and bin_frames averages its readings onto an energy grid, with
+the same data keys as a step scan.  The beamline detectors are
+configured for step scanning and would need to be free-running for
+polling to work, so xafs() does not yet offer a fly mode.
+
+SimulatedBragg, SimulatedIonChambers, and SimulatedXspress3 stand in
+for the mono and detectors so that the recorder and the binning can be
+developed without the beamline:
+
+   from BMM.flyscan import FlyRecorder, bin_frames, simulated_devices
+   from BMM.functions import e2bragg
+   from BMM.xafs_functions import conventional_grid
+   bragg, qem, xs = simulated_devices(e0=7112)
+   grid, times, _, _ = conventional_grid(e0=7112)
+   recorder = FlyRecorder(bragg, [qem, xs])
+   recorder.start()
+   bragg.set(e2bragg(grid[-1], 3.1356)).wait()
+   recorder.stop()
+   table = bin_frames(recorder.frames(), grid, 3.1356)
+
+'''
+
+import threading, time
+import numpy
+
+from ophyd import Signal
+from ophyd.status import Status
+
+from BMM.functions import e2bragg, bragg2e, etok
+
+
+def synthetic_mu(energy, e0=7112, step=1.0):
+    '''An absorption spectrum with an arctangent edge, a white line, and
+    a single damped EXAFS oscillation.'''
+    energy = numpy.asarray(energy, dtype=float)
+    k = etok(numpy.clip(energy - e0, 0, None))
+    edge = step * (0.5 + numpy.arctan((energy - e0) / 2) / numpy.pi)
+    white = 0.3 * step * numpy.exp(-((energy - e0 - 8) / 6)**2)
+    exafs = 0.1 * step * numpy.sin(2 * 2.2 * k) * numpy.exp(-0.01 * k**2 * 2.2**2) / numpy.maximum(k, 1)
+    return 0.5 + edge + white + exafs
+
+
+class SimulatedBragg():
+    '''A Bragg axis which moves at its velocity setting, so that its
+    position changes with time during a move.  Like dcm_bragg, it has
+    velocity and acceleration signals, set() returns a status which
+    finishes when the move is done, and position is the current
+    angle.'''
+    def __init__(self, name='dcm_bragg', position=15.0, velocity=0.4, acceleration=0.2):
+        self.name         = name
+        self.parent       = None
+        self.velocity     = Signal(name=f'{name}_velocity', value=velocity)
+        self.acceleration = Signal(name=f'{name}_acceleration', value=acceleration)
+        self._lock        = threading.Lock()
+        self._move        = (position, position, time.time(), velocity)   # from, to, start time, speed
+
+    @property
+    def position(self):
+        with self._lock:
+            start, target, t0, speed = self._move
+        travel = speed * (time.time() - t0)
+        if travel >= abs(target - start):
+            return target
+        return start + numpy.sign(target - start) * travel
+
+    def set(self, value):
+        status = Status(obj=self)
+        here, speed = self.position, float(self.velocity.get())
+        with self._lock:
+            self._move = (here, float(value), time.time(), speed)
+        threading.Timer(abs(float(value) - here) / speed, status.set_finished).start()
+        return status
+
+    def stop(self, *, success=False):
+        here = self.position
+        with self._lock:
+            self._move = (here, here, time.time(), self._move[3])
+
+    def read(self):
+        return {self.name: {'value': self.position, 'timestamp': time.time()}}
+
+    def describe(self):
+        return {self.name: {'source': f'SIM:{self.name}', 'dtype': 'number', 'shape': []}}
+
+    def read_configuration(self):
+        return {}
+
+    def describe_configuration(self):
+        return {}
+
+    @property
+    def hints(self):
+        return {'fields': [self.name]}
+
+
+class SimulatedDetector():
+    '''Base class of the simulated detectors, readings follow
+    synthetic_mu at the energy of the Bragg axis.'''
+    keys = ()
+
+    def __init__(self, bragg, name, d_spacing=3.1356, e0=7112, flux=1e5, noise=0.001):
+        self.bragg, self.name, self.parent = bragg, name, None
+        self.d_spacing, self.e0, self.flux, self.noise = d_spacing, e0, flux, noise
+        self.rng = numpy.random.default_rng()
+
+    def values(self, energy):
+        '''Return a dict of the reading of each key at energy, zero
+        here, subclasses compute a spectrum.'''
+        return {k: 0.0 for k in self.keys}
+
+    def read(self):
+        now = time.time()
+        values = self.values(bragg2e(self.bragg.position, self.d_spacing))
+        return {k: {'value': float(v), 'timestamp': now} for k, v in values.items()}
+
+    def describe(self):
+        return {k: {'source': f'SIM:{self.name}:{k}', 'dtype': 'number', 'shape': []} for k in self.keys}
+
+    def trigger(self):
+        status = Status(obj=self)
+        status.set_finished()
+        return status
+
+    def read_configuration(self):
+        return {}
+
+    def describe_configuration(self):
+        return {}
+
+    @property
+    def hints(self):
+        return {'fields': list(self.keys)}
+
+
+class SimulatedIonChambers(SimulatedDetector):
+    '''I0, It, and Ir of a transmission measurement of the sample and a
+    reference foil.'''
+    keys = ('I0', 'It', 'Ir')
+
+    def values(self, energy):
+        i0 = self.flux * (1 + self.noise * self.rng.standard_normal())
+        it = i0 * numpy.exp(-synthetic_mu(energy, self.e0)) * (1 + self.noise * self.rng.standard_normal())
+        ir = it * numpy.exp(-synthetic_mu(energy, self.e0)) * (1 + self.noise * self.rng.standard_normal())
+        return {'I0': i0, 'It': it, 'Ir': ir}
+
+
+class SimulatedXspress3(SimulatedDetector):
+    '''Dead-time corrected counts of a fluorescence detector, one key
+    for each channel.'''
+    def __init__(self, bragg, name, channels=('xs1', 'xs2', 'xs3', 'xs4'), **kwargs):
+        super().__init__(bragg, name, **kwargs)
+        self.keys = tuple(channels)
+
+    def values(self, energy):
+        rate = 0.01 * self.flux * (synthetic_mu(energy, self.e0) - 0.5)
+        return {k: self.rng.poisson(max(rate, 0)) for k in self.keys}
+
+
+def simulated_devices(e0=7112, d_spacing=3.1356, channels=('xs1', 'xs2', 'xs3', 'xs4')):
+    '''Return a SimulatedBragg positioned below e0 and ion chambers and a
+    fluorescence detector which read from it.'''
+    bragg = SimulatedBragg(position=float(e2bragg(e0 - 300, d_spacing)))
+    return (bragg,
+            SimulatedIonChambers(bragg, 'quadem1', d_spacing=d_spacing, e0=e0),
+            SimulatedXspress3(bragg, 'xs', channels=channels, d_spacing=d_spacing, e0=e0))
+
+
+class FlyRecorder():
+    '''Poll the Bragg position and a list of detectors every period
+    seconds on a background thread, between start() and stop().
+    Non-numeric readings are ignored.  If a reading fails, polling
+    stops and stop() raises the exception.'''
+    def __init__(self, bragg, detectors, period=0.02):
+        self.bragg, self.detectors, self.period = bragg, detectors, period
+        self.rows   = []
+        self.error  = None
+        self._run   = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.rows = []
+        self.error = None
+        self._run.set()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._run.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('fly scan polling failed') from error
+        if len(self.rows) == 0:
+            raise RuntimeError('fly scan polling returned no readings')
+
+    def _poll(self):
+        try:
+            self._record()
+        except Exception as E:
+            self.error = E
+            self._run.clear()
+
+    def _record(self):
+        while self._run.is_set():
+            tick = time.time()
+            row = {'time': tick, 'bragg': float(self.bragg.position)}
+            for det in self.detectors:
+                for key, reading in det.read().items():
+                    if numpy.ndim(reading['value']) == 0 and isinstance(reading['value'], (int, float, numpy.number)):
+                        row[key] = float(reading['value'])
+            self.rows.append(row)
+            time.sleep(max(self.period - (time.time() - tick), 0))
+
+    def frames(self):
+        '''The readings as a dict of numpy arrays.'''
+        if len(self.rows) == 0:
+            return {}
+        keys = [k for k in self.rows[0] if all(k in r for r in self.rows)]
+        return {k: numpy.array([r[k] for r in self.rows]) for k in keys}
+
+
+def bin_edges(energies):
+    '''Bin edges halfway between the grid points, the outer bins are as
+    wide as their neighbors.'''
+    energies = numpy.asarray(energies, dtype=float)
+    middle = (energies[1:] + energies[:-1]) / 2
+    return numpy.concatenate(([2*energies[0] - middle[0]], middle, [2*energies[-1] - middle[-1]]))
+
+
+def bin_frames(frames, energies, d_spacing):
+    '''Bin fly scan readings onto an energy grid.
+
+    Each detector key is averaged over the readings in a bin, and
+    dcm_energy is the average energy of those readings.
+    dcm_energy_setpoint is the grid energy and dwti_dwell_time is the
+    time spent in the bin.  A bin with no readings (the mono moved too
+    fast for the polling period) is interpolated from its neighbors.
+    Returns a dict of arrays, including nframes, the number of
+    readings in each bin.
+    '''
+    energies = numpy.asarray(energies, dtype=float)
+    npts     = len(energies)
+    energy   = bragg2e(frames['bragg'], d_spacing)
+    interval = numpy.diff(frames['time'], prepend=frames['time'][0])
+    edges    = bin_edges(energies)
+    if edges[0] > edges[-1]:    # a scan down in energy
+        which = npts - numpy.digitize(energy, edges[::-1])
+    else:
+        which = numpy.digitize(energy, edges) - 1
+    good     = (which >= 0) & (which < npts)
+    which    = which[good]
+    counts   = numpy.bincount(which, minlength=npts)
+    filled   = counts > 0
+    table = {'dcm_energy_setpoint' : energies,
+             'dwti_dwell_time'     : numpy.bincount(which, weights=interval[good], minlength=npts),
+             'nframes'             : counts, }
+    columns = {'dcm_energy': energy, **{k: v for k, v in frames.items() if k not in ('time', 'bragg')}}
+    for key, values in columns.items():
+        mean = numpy.bincount(which, weights=values[good], minlength=npts)[filled] / counts[filled]
+        table[key] = numpy.interp(numpy.arange(npts), numpy.flatnonzero(filled), mean)
+    table['time'] = numpy.interp(numpy.arange(npts), numpy.flatnonzero(filled),
+                                 numpy.bincount(which, weights=frames['time'][good], minlength=npts)[filled] / counts[filled])
+    return table
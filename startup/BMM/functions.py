@@ -117,6 +117,13 @@ def e2l(val):
     return 2*pi*HBARC/val
 l2e = e2l
 
+def e2bragg(energy, d_spacing):
+    """Convert absolute photon energy to Bragg angle in degrees"""
+    return 180 * arcsin(e2l(energy) / (2*d_spacing)) / pi
+def bragg2e(angle, d_spacing):
+    """Convert Bragg angle in degrees to absolute photon energy"""
+    return e2l(2*d_spacing*sin(angle*pi/180))
+
 
 
 ## see calibrate_pitch in BMM/mono_calibration.py
@@ -0,0 +1,210 @@
+import os, glob, json, time, traceback, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy, h5py
+
+## Like larch_interface, this module deliberately does not import
+## user_ns so that it can be used on an analysis machine or in the
+## kafka consumer as well as in bsui.
+
+from BMM.larch_interface import Pandrosus
+
+## arrays copied from the Larch group of each scan into the results store
+ARRAYS = ('energy', 'mu', 'norm', 'flat', 'dmude', 'reference',
+          'k', 'chi', 'r', 'chir_mag', 'chir_re', 'chir_im', 'q', 'chiq_re', 'chiq_im')
+
+_catalog = None   # one catalog per worker process, see _start_worker
+
+
+def uids_in_folder(folder):
+    '''Return the UIDs of the XAFS scans written as XDI files in folder,
+    as found in their Scan.uid header lines.'''
+    uids = []
+    for fname in sorted(glob.glob(os.path.join(folder, '*'))):
+        if not os.path.isfile(fname) or fname.endswith(('.h5', '.json', '.prj', '.png', '.log')):
+            continue
+        try:
+            with open(fname, 'r') as fh:
+                for line in fh:
+                    if not line.startswith('#'):
+                        break
+                    if line.startswith('# Scan.uid:'):
+                        uids.append(line.split(':', 1)[1].strip())
+                        break
+        except (UnicodeDecodeError, OSError):
+            continue
+    return uids
+
+
+def batch_parameters(mode=None, pre=None, bkg=None, fft=None, bft=None, kw=2):
+    '''Return the processing parameters as a dict which serializes to
+    the same JSON for the same parameters.  Dicts of Larch parameters
+    override the Pandrosus defaults.'''
+    this = Pandrosus()
+    for name, override in (('pre', pre), ('bkg', bkg), ('fft', fft), ('bft', bft)):
+        getattr(this, name).update(override or {})
+    return {'mode': mode, 'pre': this.pre, 'bkg': this.bkg, 'fft': this.fft, 'bft': this.bft, 'kw': kw}
+
+
+def _start_worker(catalog):
+    '''Process pool initializer: open the catalog once per worker.  A
+    string is taken as the name of a tiled profile.'''
+    global _catalog
+    if isinstance(catalog, str):
+        from tiled.client import from_profile
+        catalog = from_profile(catalog)
+    _catalog = catalog
+
+
+def process_one(uid, folder, params):
+    '''Fetch and process one scan.  Returns a dict with the arrays
+    listed in ARRAYS, the scalar results, timing, and any error
+    message.  Runs in a worker process.'''
+    result = {'uid': uid, 'arrays': {}, 'attrs': {}, 'fetch': 0.0, 'process': 0.0, 'error': None}
+    try:
+        t0 = time.time()
+        this = Pandrosus()
+        this.folder, this.db = folder, _catalog
+        for name in ('pre', 'bkg', 'fft', 'bft'):
+            getattr(this, name).update(params[name])
+        mode = params['mode'] or this.start(uid)['XDI']['_user']['mode']
+        this.fetch(uid, mode=mode, athena=False)
+        t1 = time.time()
+        this.do_xftf(kw=params['kw'])
+        this.do_xftr()
+        g = this.group
+        for name in ARRAYS:
+            if hasattr(g, name) and getattr(g, name) is not None:
+                result['arrays'][name] = numpy.asarray(getattr(g, name))
+        result['attrs'] = {'filename'  : this.filename or '',
+                           'title'     : this.title or '',
+                           'mode'      : mode,
+                           'element'   : this.element or '',
+                           'edge'      : this.edge or '',
+                           'e0'        : float(g.e0),
+                           'edge_step' : float(g.edge_step), }
+        result['fetch']   = round(t1 - t0, 3)
+        result['process'] = round(time.time() - t1, 3)
+    except Exception as E:
+        result['error'] = f'{type(E).__name__}: {E}'
+        result['traceback'] = traceback.format_exc()
+    return result
+
+
+def already_processed(store, uid, signature):
+    '''True if uid is in the results store with the same parameters.'''
+    return uid in store and store[uid].attrs.get('parameters') == signature
+
+
+def store_result(store, result, signature):
+    '''Write one result into the results store, replacing any earlier
+    result for the same UID.'''
+    uid = result['uid']
+    if uid in store:
+        del store[uid]
+    grp = store.create_group(uid)
+    for name, array in result['arrays'].items():
+        grp.create_dataset(name, data=array)
+    for key, value in result['attrs'].items():
+        grp.attrs[key] = value
+    grp.attrs['fetch']      = result['fetch']
+    grp.attrs['process']    = result['process']
+    grp.attrs['parameters'] = signature
+    store.flush()
+
+
+def batch_process(uids=None, folder=None, output=None, catalog='bmm', workers=4,
+                  mode=None, pre=None, bkg=None, fft=None, bft=None, kw=2):
+    '''Normalize, background-subtract, and Fourier transform every XAFS
+    scan in a list of UIDs or in an experiment folder, using a pool of
+    worker processes, and save the results in a single HDF5 file.
+
+    The results store has one group per UID holding the energy, mu,
+    norm, flat, k, chi, r, and chi(R) arrays (see ARRAYS) and
+    attributes for e0, edge_step, element, edge, filename, mode, the
+    processing time, and the JSON-encoded processing parameters.
+
+    Results are written as each scan finishes.  UIDs already in the
+    store with identical parameters are skipped, so an interrupted
+    batch can be restarted by running it again.  Failed scans are
+    reported and not written, so they are retried on the next run.
+
+    Parameters
+    ----------
+    uids : list of str
+        UIDs to process
+    folder : str
+        experiment folder, the UIDs of the XDI files found there are
+        added to uids and data are read from sidecar files when they exist
+    output : str
+        results store [folder/larch_results.h5]
+    catalog : str or catalog object
+        name of a tiled profile or a picklable catalog, e.g. BMM.db.FileCatalog ['bmm']
+    workers : int
+        number of worker processes [4]
+    mode : str
+        measurement mode, default is the mode recorded for each scan
+    pre, bkg, fft, bft : dict
+        overrides of the Pandrosus pre_edge, autobk, xftf, and xftr parameters
+    kw : int
+        k-weight of the forward Fourier transform [2]
+
+    Returns a dict with lists of processed, skipped, and failed UIDs
+    and per-scan timing.
+
+    Examples
+    --------
+
+    >>> batch_process(folder='/nsls2/data3/bmm/proposals/2023-2/pass-312345', workers=8)
+
+    >>> batch_process(uids=[...], output='/path/to/results.h5', fft={'kmin':2, 'kmax':11})
+    '''
+    uids = list(uids or [])
+    if folder is not None:
+        uids.extend(u for u in uids_in_folder(folder) if u not in uids)
+    if output is None:
+        if folder is None:
+            raise ValueError('batch_process needs an output file or an experiment folder')
+        output = os.path.join(folder, 'larch_results.h5')
+    params    = batch_parameters(mode=mode, pre=pre, bkg=bkg, fft=fft, bft=bft, kw=kw)
+    signature = json.dumps(params, sort_keys=True)
+
+    report = {'output': output, 'processed': [], 'skipped': [], 'failed': {}, 'timing': {}, 'elapsed': 0}
+    begin = time.time()
+    with h5py.File(output, 'a') as store:
+        todo = []
+        for u in uids:
+            if already_processed(store, u, signature):
+                report['skipped'].append(u)
+            else:
+                todo.append(u)
+        print(f'processing {len(todo)} scans with {workers} workers, skipping {len(report["skipped"])} already in {output}')
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max(workers, 1), mp_context=context,
+                                 initializer=_start_worker, initargs=(catalog,)) as executor:
+            futures = [executor.submit(process_one, u, folder, params) for u in todo]
+            for i, f in enumerate(as_completed(futures)):
+                result = f.result()
+                uid = result['uid']
+                if result['error'] is not None:
+                    report['failed'][uid] = result['error']
+                    print(f'  [{i+1}/{len(todo)}] FAILED {uid}: {result["error"]}')
+                    continue
+                store_result(store, result, signature)
+                report['processed'].append(uid)
+                report['timing'][uid] = {'fetch': result['fetch'], 'process': result['process']}
+                print(f'  [{i+1}/{len(todo)}] {result["attrs"]["filename"]}  e0={result["attrs"]["e0"]:.1f}  '
+                      f'({result["fetch"]:.2f} + {result["process"]:.2f} sec)')
+    report['elapsed'] = round(time.time() - begin, 3)
+    print(f'{len(report["processed"])} processed, {len(report["skipped"])} skipped, '
+          f'{len(report["failed"])} failed in {report["elapsed"]:.1f} seconds')
+    return report
+
+
+def read_results(output, uid):
+    '''Return (arrays, attrs) for one UID from a results store.'''
+    with h5py.File(output, 'r') as store:
+        grp = store[uid]
+        arrays = {name: grp[name][()] for name in grp}
+        attrs  = dict(grp.attrs)
+    attrs['parameters'] = json.loads(attrs['parameters'])
+    return arrays, attrs
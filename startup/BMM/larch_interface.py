@@ -16,7 +16,8 @@
 ##                           Ovid, Metamorphosis
 ##                           Book II:531-565
 
-import numpy, os
+import numpy, os, threading, hashlib, json, pickle, warnings, copy
+from collections import OrderedDict
 from larch import (Group, Parameter, isParameter, param_value, isNamedClass, Interpreter) 
 from larch.xafs import (find_e0, pre_edge, autobk, xftf, xftr)
 from larch.io import create_athena
@@ -27,6 +28,7 @@ import matplotlib.gridspec as gridspec
 
 #from BMM.functions import etok, ktoe
 from BMM.periodictable import edge_energy, element_symbol
+from BMM.sidecar import sidecar_name, read_sidecar
 
 #from BMM import user_ns as user_ns_module
 #user_ns = vars(user_ns_module)
@@ -44,6 +46,247 @@ def ktoe(k):
     return k*k*KTOE
 
 
+def needed_columns(mode, dtc=None):
+    '''Return the primary stream columns needed to make mu(E) in the
+    given mode.  It and Ir are always included so that the reference
+    spectrum can be made from the same read.'''
+    columns = ['dcm_energy', 'I0', 'It', 'Ir']
+    dtc = list(dtc or [])
+    if mode is None:
+        pass
+    elif mode == 'xs1':
+        columns.extend(dtc[:1])
+    elif mode == 'xs' or any(md in mode for md in ('fluo', 'flou', 'both')):
+        columns.extend(dtc[:4])
+    elif mode in ('icit', 'ici0'):
+        columns.append('I0a')
+    elif mode == 'yield':
+        columns.append('Iy')
+    return columns
+
+
+class ScanCache():
+    '''A size-bounded, least-recently-used cache of column-projected
+    reads of the primary stream, shared by Pandrosus and Kekropidai
+    objects.
+
+    Only the requested columns are read from the catalog.  Tables are
+    kept as dicts of read-only numpy arrays keyed by (uid, column set).
+    A request for a subset of the columns of a cached table is served
+    from that table, so making mu(E) and the reference for a scan costs
+    one catalog read.  Start documents are cached alongside.
+
+    Attributes
+    ----------
+    maxbytes : int
+        bound on the total size of the cached arrays
+    maxstarts : int
+        number of start documents to keep
+    hits, misses : int
+        cache statistics for the column reads
+    '''
+    def __init__(self, maxbytes=64*2**20, maxstarts=256):
+        self.maxbytes  = maxbytes
+        self.maxstarts = maxstarts
+        self.tables    = OrderedDict()
+        self.starts    = OrderedDict()
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.lock      = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.starts.clear()
+            self.nbytes = 0
+            self.hits, self.misses = 0, 0
+
+    def start(self, db, uid):
+        '''Return the start document of uid.'''
+        with self.lock:
+            if uid in self.starts:
+                self.starts.move_to_end(uid)
+                return self.starts[uid]
+        start = self.read_start(db, uid)
+        with self.lock:
+            self.starts[uid] = start
+            while len(self.starts) > self.maxstarts:
+                self.starts.popitem(last=False)
+        return start
+
+    def columns(self, db, uid, columns):
+        '''Return a dict of numpy arrays for the requested columns of the
+        primary stream of uid.'''
+        wanted = frozenset(columns)
+        with self.lock:
+            for key in self.tables:
+                if key[0] == uid and wanted <= key[1]:
+                    self.tables.move_to_end(key)
+                    self.hits += 1
+                    table = self.tables[key]
+                    return {c: table[c] for c in columns}
+            self.misses += 1
+        table = self.read(db, uid, sorted(wanted))
+        with self.lock:
+            key = (uid, wanted)
+            if key not in self.tables:
+                self.tables[key] = table
+                self.nbytes += sum(a.nbytes for a in table.values())
+            while self.nbytes > self.maxbytes and len(self.tables) > 1:
+                (k, old) = self.tables.popitem(last=False)
+                self.nbytes -= sum(a.nbytes for a in old.values())
+        return {c: table[c] for c in columns}
+
+    @staticmethod
+    def read_start(db, uid):
+        '''Read the start document of uid from the catalog.'''
+        if 'Broker' in str(type(db)):  # v1 databroker
+            return db.v2[uid].metadata['start']
+        return db[uid].metadata['start']  # tiled catalog
+
+    @staticmethod
+    def read(db, uid, columns):
+        '''Read only the requested columns from the catalog, falling back
+        to reading the whole primary stream if the catalog cannot
+        project.'''
+        run = db[uid]
+        if 'v1' in str(type(db)) or not hasattr(run, 'primary'):  # v1 databroker or BMM.db.FileCatalog
+            try:
+                table = run.table(fields=columns)
+            except TypeError:
+                table = run.table()
+        else:                      # tiled catalog
+            try:
+                table = run.primary.read(variables=columns)
+            except TypeError:
+                table = run.primary.read()
+        out = dict()
+        for c in columns:
+            out[c] = numpy.array(table[c])
+            out[c].setflags(write=False)
+        return out
+
+    def __repr__(self):
+        return(f'<ScanCache: {len(self.tables)} tables, {self.nbytes/2**20:.1f} MB, {self.hits} hits, {self.misses} misses>')
+
+SCANCACHE = ScanCache()
+
+
+## the attributes of the Larch group set by each processing step, these
+## are what is stored in and restored from a ResultCache.  Attributes
+## not made by the installed version of Larch are skipped.
+STEP_OUTPUTS = {
+    'pre_edge' : ('e0', 'edge_step', 'edge_step_poly', 'norm', 'norm_poly', 'flat', 'flat_coefs', 'flat_alt',
+                  'dmude', 'd2mude', 'pre_edge', 'post_edge', 'pre_slope', 'pre_offset', 'atsym', 'edge',
+                  'pre_edge_details'),
+    'autobk'   : ('e0', 'edge_step', 'bkg', 'chie', 'chi', 'k', 'ek0', 'rbkg', 'delta_chi', 'delta_bkg',
+                  'autobk_details'),
+    'xftf'     : ('kwin', 'r', 'chir', 'chir_mag', 'chir_re', 'chir_im', 'chir_pha', 'xftf_details'),
+    'xftr'     : ('rwin', 'q', 'chiq', 'chiq_mag', 'chiq_re', 'chiq_im', 'chiq_pha', 'xftr_details'),
+}
+
+
+class ResultCache():
+    '''A least-recently-used cache of the results of the Larch
+    processing steps (pre_edge, autobk, xftf, xftr) of Pandrosus.
+
+    Each result is keyed by a hash of the step name, the key of the
+    step it depends on, and the arguments of the step.  The first step
+    depends on a hash of the energy and mu(E) arrays.  Since keys are
+    chained, changing a parameter of one step invalidates that step
+    and the steps downstream of it, but not those upstream.
+
+    A result is the set of attributes of the Larch group listed for
+    the step in STEP_OUTPUTS.  Results are deep-copied going into and
+    coming out of the cache, so the arrays and the Groups of details
+    (pre_edge_details and so on) of a cached result are never shared
+    with a live group.
+
+    Attributes
+    ----------
+    maxsize : int
+        number of results kept in memory
+    folder : str or None
+        when set, results are also pickled to this folder and found
+        there in later sessions
+    hits, misses : int
+        cache statistics
+    '''
+    def __init__(self, maxsize=512, folder=None):
+        self.maxsize = maxsize
+        self.folder  = folder
+        self.results = OrderedDict()
+        self.hits    = 0
+        self.misses  = 0
+        self.lock    = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def data_key(energy, mu):
+        '''Hash the energy and mu(E) arrays.'''
+        h = hashlib.sha1()
+        for a in (energy, mu):
+            h.update(numpy.ascontiguousarray(a, dtype=float).tobytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def key(step, parent, args):
+        text = json.dumps([step, parent, args, STEP_OUTPUTS.get(step)], sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return _copy_attributes(self.results[key])
+        if self.folder is not None:
+            fname = os.path.join(self.folder, key + '.pkl')
+            if os.path.isfile(fname):
+                try:
+                    with open(fname, 'rb') as fh:
+                        found = pickle.load(fh)
+                    self.put(key, found, persist=False)
+                    with self.lock:
+                        self.hits += 1
+                    return _copy_attributes(found)
+                except Exception as E:
+                    warnings.warn(f'could not read cached result {fname} ({type(E).__name__}: {E})')
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, attributes, persist=True):
+        attributes = _copy_attributes(attributes)
+        with self.lock:
+            self.results[key] = attributes
+            self.results.move_to_end(key)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+        if persist and self.folder is not None:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                fname = os.path.join(self.folder, key + '.pkl')
+                with open(fname + '.part', 'wb') as fh:
+                    pickle.dump(attributes, fh)
+                os.replace(fname + '.part', fname)
+            except Exception as E:   # persistence is a convenience, not a requirement
+                warnings.warn(f'could not save cached result to {self.folder} ({type(E).__name__}: {E})')
+
+    def __repr__(self):
+        return(f'<ResultCache: {len(self.results)} results, {self.hits} hits, {self.misses} misses>')
+
+def _copy_attributes(attributes):
+    return copy.deepcopy(attributes)
+
+RESULTCACHE = ResultCache()
+
+
 class Pandrosus():
     '''A thin wrapper around basic XAS data processing for individual
     data sets as implemented in Larch.
@@ -74,6 +317,12 @@ class Pandrosus():
         Dictionary of backward Fourier transform arguments
     rmax : float
         upper bound of R-space plot
+    sidecar : bool
+        True to read data from the binary sidecar next to the XDI file, when it exists
+    cache : ScanCache
+        column-projected, LRU cache of catalog reads, shared by default
+    results : ResultCache
+        cache of the results of the Larch processing steps, shared by default
 
     See http://xraypy.github.io/xraylarch/xafs/preedge.html and
     http://xraypy.github.io/xraylarch/xafs/autobk.html for details
@@ -137,6 +386,11 @@ class Pandrosus():
         self.folder  = None
         self.db      = None
         self.reuse   = True
+        self.sidecar = True
+        self.filename = None
+        self.cache   = SCANCACHE
+        self.results = RESULTCACHE
+        self.steps   = dict()
 
         self.facecolor = (1.0, 1.0, 1.0)
         
@@ -161,15 +415,7 @@ class Pandrosus():
             'transmission', 'fluorescence', or 'reference'
 
         '''
-        if 'v1' in str(type(self.db)):  # v1 databroker
-            header = self.db[uid]
-            start = header.start
-            table  = header.table()
-        else:                               # tiled catalog
-            header = self.db[uid].metadata
-            start = header['start']
-            table  = self.db[uid].primary.read()
-            
+        (table, dtc) = self.read_table(uid, mode)
         self.group.energy = numpy.array(table['dcm_energy'])
         self.group.i0 = numpy.array(table['I0'])
         if mode == 'flourescence': mode = 'fluorescence'
@@ -183,7 +429,7 @@ class Pandrosus():
         # on data in past history.  See new '_dtc' element of start document.  9 Sep 2020     #
         #######################################################################################
         elif any(md in mode for md in ('fluo', 'flou', 'both')):
-            columns = start['XDI']['_dtc']
+            columns = dtc
             self.group.mu = numpy.array((table[columns[0]]+table[columns[1]]+table[columns[2]]+table[columns[3]])/table['I0'])
             self.group.i0 = numpy.array(table['I0'])
             self.group.signal = numpy.array(table[columns[0]]+table[columns[1]]+table[columns[2]]+table[columns[3]])
@@ -199,13 +445,13 @@ class Pandrosus():
                 self.group.signal = numpy.array(table['It'])
 
         elif mode == 'xs1':
-            columns = start['XDI']['_dtc']
+            columns = dtc
             self.group.mu = numpy.array(table[columns[0]]/table['I0'])
             self.group.i0 = numpy.array(table['I0'])
             self.group.signal = numpy.array(table[columns[0]])
 
         elif mode == 'xs':
-            columns = start['XDI']['_dtc']
+            columns = dtc
             self.group.mu = numpy.array((table[columns[0]]+table[columns[1]]+table[columns[2]]+table[columns[3]])/table['I0'])
             self.group.i0 = numpy.array(table['I0'])
             self.group.signal = numpy.array(table[columns[0]]+table[columns[1]]+table[columns[2]]+table[columns[3]])
@@ -231,50 +477,83 @@ class Pandrosus():
 
 
     def make_ref(self, uid):
-        if 'v1' in str(type(self.db)):  # v1 databroker
-            header = self.db[uid]
-            start = header.start
-            table  = header.table()
-        else:                               # tiled catalog
-            header = self.db[uid].metadata
-            start = header['start']
-            table  = self.db[uid].primary.read()
-            
+        (table, dtc) = self.read_table(uid, 'reference')
         self.group.energy = numpy.array(table['dcm_energy'])
         self.group.reference = numpy.array(numpy.log(table['It']/table['Ir']))
 
-            
-    def fetch(self, uid, name=None, mode='transmission'):
+
+    def read_table(self, uid, mode='transmission'):
+        '''Return (table, dtc) for a scan, where table is the primary
+        stream data, indexable by column name, and dtc is the list of
+        dead-time corrected fluorescence channels from the start
+        document.
+
+        If self.sidecar is True and the binary sidecar next to the
+        scan's XDI file exists, the table is memory mapped from there.
+        Otherwise only the columns needed for mode are read from
+        self.db through self.cache.
+        '''
+        found = self.sidecar_table(uid)
+        if found is not None:
+            return found
+        dtc = self.start(uid)['XDI'].get('_dtc')
+        if self.cache is None:
+            table = ScanCache.read(self.db, uid, needed_columns(mode, dtc))
+        else:
+            table = self.cache.columns(self.db, uid, needed_columns(mode, dtc))
+        return table, dtc
+
+    def start(self, uid):
+        '''Return the start document of uid.'''
+        if self.cache is None:
+            return ScanCache.read_start(self.db, uid)
+        return self.cache.start(self.db, uid)
+
+    def sidecar_table(self, uid):
+        '''Return (table, dtc) from the binary sidecar of this scan's
+        XDI file, or None if there is no usable sidecar.'''
+        if not self.sidecar or self.folder is None or self.filename is None:
+            return None
+        fname = sidecar_name(os.path.join(self.folder, self.filename))
+        if not os.path.isfile(fname):
+            return None
+        try:
+            data, md = read_sidecar(fname)
+        except Exception:
+            return None
+        if md['uid'] != uid or 'dcm_energy' not in data or 'I0' not in data:
+            return None
+        return data, md['dtc']
+
+    def fetch(self, uid, name=None, mode='transmission', athena=True):
+        '''Import a scan from the catalog and process it.  When athena is
+        False, skip the round trip through an Athena project file which
+        sets the label of the Larch group.'''
         self.uid = uid
         self.mode = mode
+        start = self.start(uid)
+        self.filename = start['XDI'].get('_filename')
         if name is not None:
             self.name = name
         else:
-            if 'Broker' in str(type(self.db)):  # v1 databroker
-                self.name = self.db.v2[uid].metadata['start']['XDI']['_filename']
-            else:
-                self.name = self.db[uid].metadata['start']['XDI']['_filename']
+            self.name = self.filename
             #self.name = uid[-6:]
         self.group = Group(__name__=self.name)
-        if 'Broker' in str(type(self.db)):  # v1 databroker
-            self.title = self.db.v2[uid].metadata['start']['XDI']['Sample']['name']
-            self.mode  = self.db.v2[uid].metadata['start']['XDI']['_user']['mode']
-        else:                               # tiled catalog
-            self.title = self.db[uid].metadata['start']['XDI']['Sample']['name']
-            self.mode  = self.db[uid].metadata['start']['XDI']['_user']['mode']
+        self.title = start['XDI']['Sample']['name']
+        self.mode  = start['XDI']['_user']['mode']
 
         self.make_xmu(uid, mode=mode)
         self.make_ref(uid)
         self.prep()
+        if athena is False:
+            self.group.args = {'label': start['XDI']['_filename']}
+            return
         toss = create_athena(os.path.join(self.folder, 'prj', 'toss.prj'))
         toss.add_group(self.group)
         toss.save()
         os.remove(os.path.join(self.folder, 'prj', 'toss.prj'))
         toss = None
-        if 'Broker' in str(type(self.db)):  # v1 databroker
-            self.group.args['label'] = self.db.v2[uid].metadata['start']['XDI']['_filename']
-        else:                               # tiled catalog
-            self.group.args['label'] = self.db[uid].metadata['start']['XDI']['_filename']
+        self.group.args['label'] = start['XDI']['_filename']
 
             
     def put(self, energy, mu, name):
@@ -373,32 +652,55 @@ class Pandrosus():
             diff = edge_energy(self.element, 'L1') - edge_energy(self.element, 'L2')
             if self.pre['norm2'] > diff:
                self.pre['norm2'] = diff - 20 
-        pre_edge(self.group.energy, mu=self.group.mu, group=self.group,
-                 e0    = ezero,
-                 step  = None,
-                 pre1  = self.pre['pre1'],
-                 pre2  = self.pre['pre2'],
-                 norm1 = self.pre['norm1'],
-                 norm2 = self.pre['norm2'],
-                 nnorm = self.pre['nnorm'],
-                 nvict = self.pre['nvict'],
-                 _larch=LARCH)
+        args = {'e0'    : ezero,
+                'step'  : None,
+                'pre1'  : self.pre['pre1'],
+                'pre2'  : self.pre['pre2'],
+                'norm1' : self.pre['norm1'],
+                'norm2' : self.pre['norm2'],
+                'nnorm' : self.pre['nnorm'],
+                'nvict' : self.pre['nvict'], }
+        self.process('pre_edge', ResultCache.data_key(self.group.energy, self.group.mu), args,
+                     lambda: pre_edge(self.group.energy, mu=self.group.mu, group=self.group, _larch=LARCH, **args))
         if self.bkg['kmax'] is None:
             self.bkg['kmax'] = self.determine_kmax()
-        autobk(self.group.energy, mu=self.group.mu, group=self.group,
-               rbkg    = self.bkg['rbkg'],
-               e0      = self.bkg['e0'],
-               kmin    = self.bkg['kmin'],
-               kmax    = self.bkg['kmax'],
-               kweight = self.bkg['kweight'],
-               _larch=LARCH)
-        xftf(self.group.k, chi=self.group.chi, group=self.group,
-             window  = self.fft['window'],
-             kmin    = self.fft['kmin'],
-             kmax    = self.fft['kmax'],
-             dk      = self.fft['dk'],
-             kweight = 2,
-             _larch=LARCH)
+        bargs = {'rbkg'    : self.bkg['rbkg'],
+                 'e0'      : self.bkg['e0'],
+                 'kmin'    : self.bkg['kmin'],
+                 'kmax'    : self.bkg['kmax'],
+                 'kweight' : self.bkg['kweight'], }
+        self.process('autobk', self.steps['pre_edge'], bargs,
+                     lambda: autobk(self.group.energy, mu=self.group.mu, group=self.group, _larch=LARCH, **bargs))
+        fargs = {'window'  : self.fft['window'],
+                 'kmin'    : self.fft['kmin'],
+                 'kmax'    : self.fft['kmax'],
+                 'dk'      : self.fft['dk'],
+                 'kweight' : 2, }
+        self.process('xftf', self.steps['autobk'], fargs,
+                     lambda: xftf(self.group.k, chi=self.group.chi, group=self.group, _larch=LARCH, **fargs))
+
+    def process(self, step, parent, args, func):
+        '''Run one Larch processing step, func, or restore its result
+        from self.results.  parent is the key of the step this one
+        depends on and args are the arguments of this step.  The key
+        of this step is recorded in self.steps.  Without a parent
+        (e.g. do_xftf on a group that was not processed by prep), the
+        step is simply run.  The attributes listed for the step in
+        STEP_OUTPUTS are what is cached.'''
+        if parent is None or self.results is None:
+            self.steps[step] = None
+            func()
+            return
+        key = ResultCache.key(step, parent, args)
+        self.steps[step] = key
+        found = self.results.get(key)
+        if found is not None:
+            for name, value in found.items():
+                setattr(self.group, name, value)
+            return
+        func()
+        self.results.put(key, {name: getattr(self.group, name) for name in STEP_OUTPUTS[step]
+                               if hasattr(self.group, name)})
 
     def show(self, which=None):
         if which is None:
@@ -581,13 +883,14 @@ class Pandrosus():
     plot_chik = plot_chi
         
     def do_xftf(self, kw=2):
-        xftf(self.group.k, chi=self.group.chi, group=self.group,
-             window  = self.fft['window'],
-             kmin    = self.fft['kmin'],
-             kmax    = self.fft['kmax'],
-             dk      = self.fft['dk'],
-             kweight = kw,
-             with_phase=True, _larch=LARCH)
+        args = {'window'     : self.fft['window'],
+                'kmin'       : self.fft['kmin'],
+                'kmax'       : self.fft['kmax'],
+                'dk'         : self.fft['dk'],
+                'kweight'    : kw,
+                'with_phase' : True, }
+        self.process('xftf', self.steps.get('autobk'), args,
+                     lambda: xftf(self.group.k, chi=self.group.chi, group=self.group, _larch=LARCH, **args))
     def plot_chir(self, kw=2, win=True, parts='m'):
         '''Make a plot in R-space of a single data set.
 
@@ -669,12 +972,13 @@ class Pandrosus():
             return fig
         
     def do_xftr(self):
-        xftr(self.group.r, chir=self.group.chir, group=self.group,
-             window = self.bft['window'],
-             rmin   = self.bft['rmin'],
-             rmax   = self.bft['rmax'],
-             dr     = self.bft['dr'],
-             with_phase=True, _larch=LARCH)
+        args = {'window'     : self.bft['window'],
+                'rmin'       : self.bft['rmin'],
+                'rmax'       : self.bft['rmax'],
+                'dr'         : self.bft['dr'],
+                'with_phase' : True, }
+        self.process('xftr', self.steps.get('xftf'), args,
+                     lambda: xftr(self.group.r, chir=self.group.chir, group=self.group, _larch=LARCH, **args))
     def plot_chiq(self, kw=2, parts='r', win=True):
         '''Make a plot in back-transformed k-space of a single data set.
 
@@ -843,6 +1147,19 @@ class Kekropidai():
         name of this collection
     rmax : float
         upper bound of R-space plot
+    incremental : bool
+        True to merge from running sums on the energy grid of the first
+        group, so each new group costs one interpolation
+    weight : None, str, or callable
+        None for a plain average, 'i0' to weight each group by its mean
+        I0, or a function taking a Pandrosus object and returning a weight
+        (incremental merge only)
+    reject : float or None
+        reject a group from the incremental merge when its RMS deviation
+        from the running merge exceeds this multiple of the median of
+        those of the groups already accepted
+    rejected : list of str
+        names of groups left out of the incremental merge
       
 
     Methods
@@ -880,6 +1197,30 @@ class Kekropidai():
         self.rmax   = 6
         self.folder = None
         self.db     = None
+        self.incremental = True
+        self.weight = None
+        self.reject = None
+        self.reset()
+
+    def reset(self):
+        '''Discard the running sums of the incremental merge.'''
+        self.grid     = None
+        self.sum      = None
+        self.wsum     = 0
+        self.nmerged  = 0
+        self.deviations = list()
+        self.rejected = list()
+        self.merged   = list()
+        self.settings = self.merge_settings()
+
+    def merge_settings(self):
+        '''The settings which the running sums depend on.'''
+        return (self.weight if not callable(self.weight) else id(self.weight), self.reject)
+
+    @staticmethod
+    def fingerprint(spectrum):
+        '''Identify a group and the data it held when it was merged.'''
+        return (id(spectrum), id(spectrum.group), getattr(spectrum, 'uid', None))
 
     def put(self, uidlist):
         for u in uidlist:
@@ -888,7 +1229,61 @@ class Kekropidai():
             this.fetch(u)
             self.add(this)
 
-    def merge(self):
+    def merge(self, incremental=None):
+        '''Return a Pandrosus object containing the merge of all groups.
+
+        When incremental is True (default is self.incremental), groups
+        added since the last call are accumulated into running sums and
+        the merge is computed from those.  For a plain average, this is
+        identical to the full merge.
+
+        The running sums are discarded and rebuilt when the groups
+        already merged have been removed, replaced, reordered, or
+        re-fetched, or when weight or reject has changed.
+        '''
+        if incremental is None:
+            incremental = self.incremental
+        if incremental is False:
+            return self.full_merge()
+        if self.settings != self.merge_settings() or \
+           [self.fingerprint(s) for s in self.groups[:self.nmerged]] != self.merged:
+            self.reset()
+        for spectrum in self.groups[self.nmerged:]:
+            self.accumulate(spectrum)
+        merge = Pandrosus()
+        merge.folder, merge.db = self.folder, self.db
+        merge.put(self.grid, self.sum / self.wsum, 'merge')
+        return(merge)
+
+    def accumulate(self, spectrum):
+        '''Fold one Pandrosus object into the running sums.'''
+        self.nmerged += 1
+        self.merged.append(self.fingerprint(spectrum))
+        if self.grid is None:
+            self.grid = spectrum.group.energy
+            mu = spectrum.group.mu
+        else:
+            mu = numpy.interp(self.grid, spectrum.group.energy, spectrum.group.mu)
+            if self.reject is not None:
+                deviation = numpy.sqrt(numpy.mean((mu - self.sum/self.wsum)**2))
+                if len(self.deviations) > 1 and deviation > self.reject * numpy.median(self.deviations):
+                    self.rejected.append(spectrum.name)
+                    return
+                self.deviations.append(deviation)
+        if self.weight is None:
+            w = 1
+        elif self.weight == 'i0':
+            w = numpy.mean(spectrum.group.i0)
+        else:
+            w = self.weight(spectrum)
+        if self.sum is None:
+            self.sum = w * mu
+        else:
+            self.sum = self.sum + w * mu
+        self.wsum += w
+
+    def full_merge(self):
+        '''Merge all groups from scratch as a plain average.'''
         base = self.groups[0]
         ee = base.group.energy
         mm = base.group.mu
@@ -1,4 +1,4 @@
-import logging, datetime, emojis
+import logging, datetime, emojis, time
 import os
 from urllib import request, parse
 import json
@@ -287,3 +287,152 @@ def BMM_msg_hook(msg):
             report('Moving %s to %.3f'  % (msg[1].name, msg[2][0]))
 
 
+
+######################################################################################
+# Per-point timing.  RE.msg_hook sees each message before it is processed, but it    #
+# does not see when a message finishes and it is replaced by several plans (xafs()   #
+# sets it to None).  PointTiming is a RunEngine preprocessor instead, so it sees the #
+# same messages as BMM_msg_hook, along with the time at which the RunEngine hands    #
+# back the result of each one -- for a wait message, that is when the motion or the #
+# detector trigger is done.                                                          #
+#                                                                                    #
+#   point_timing = PointTiming()                                                     #
+#   RE.preprocessors.append(point_timing)                                            #
+######################################################################################
+class PointTiming():
+    '''Measure where the time goes at each point of every run.
+
+    Each message between one primary event and the next is timed and
+    attributed to a label:
+
+      <devices> move      set messages and the wait for their group
+      <devices> trigger   trigger messages and the wait for their group
+      <device> read       read messages
+      save                emitting the event document, including all callbacks
+      <command>           anything else, e.g. checkpoint or sleep
+      plan                time spent in the plan itself, between messages
+
+    Timing is opt-in: unless BMMuser.point_timing is True when a plan
+    starts, the plan is passed to the RunEngine untouched.  When it is
+    True, at the end of each run the table of per-point times is kept
+    in runs (keyed by UID, only the most recent runs are kept), a one
+    line summary is printed, and the table is written to
+    timing/<uid>.csv in the experiment folder.
+
+    summary(uid) returns the mean time per point for each label, e.g.
+      {'dcm_energy+inttime move': 0.31, 'quadem1 trigger': 0.52, ...}
+
+    '''
+    keep = 20
+
+    def __init__(self):
+        self.runs    = dict()
+
+    def __call__(self, plan):
+        if user_ns['BMMuser'].point_timing is not True:
+            return plan
+        return self.timed(plan)
+
+    def timed(self, plan):
+        '''Pass each message through to the RunEngine, timing it.'''
+        plan = iter(plan)
+        send, value = plan.send, None
+        self.reset()
+        while True:
+            try:
+                msg = send(value)
+            except StopIteration as stop:
+                return stop.value
+            start = time.time()
+            try:
+                value = yield msg
+            except GeneratorExit:
+                plan.close()
+                raise
+            except BaseException as E:
+                send, value = plan.throw, E
+            else:
+                send = plan.send
+            finally:
+                self.record(msg, start, time.time(), value)
+
+    def reset(self):
+        self.uid, self.plan_name, self.points = None, None, []
+        self.groups, self.current, self.stream = dict(), dict(), None
+        self.mark = time.time()
+
+    def add(self, label, elapsed):
+        self.current[label] = self.current.get(label, 0) + elapsed
+
+    def record(self, msg, start, end, value):
+        command, obj, group = msg.command, msg.obj, msg.kwargs.get('group')
+        name = getattr(obj, 'name', str(obj))
+        if command in ('set', 'trigger'):
+            this = self.groups.setdefault(group, {'kind': 'move' if command == 'set' else 'trigger', 'names': [], 'time': 0})
+            this['names'].append(name)
+            this['time'] += end - start
+        elif command == 'wait':
+            this = self.groups.pop(group, None)
+            if this is None:
+                self.add('wait', end - start)
+            else:
+                self.add(f'{"+".join(this["names"])} {this["kind"]}', this['time'] + end - start)
+        elif command == 'read':
+            self.add(f'{name} read', end - start)
+        elif command == 'create':
+            self.stream = msg.kwargs.get('name', 'primary')
+            self.add('save', end - start)
+        elif command == 'save':
+            self.add('save', end - start)
+            if self.stream == 'primary':
+                self.current['plan'] = max(end - self.mark - sum(self.current.values()), 0)
+                self.current['time'] = end
+                self.points.append(self.current)
+            self.current, self.mark = dict(), end
+        elif command == 'open_run':
+            self.uid, self.plan_name, self.points = value, msg.kwargs.get('plan_name'), []
+            self.current, self.mark = dict(), end
+        elif command == 'close_run':
+            self.finish()
+        else:
+            self.add(command, end - start)
+
+    def finish(self):
+        '''Keep, report, and write the table for the run that just ended.'''
+        if self.uid is None or len(self.points) == 0:
+            return
+        self.runs[self.uid] = {'plan_name': self.plan_name, 'points': self.points}
+        while len(self.runs) > self.keep:
+            self.runs.pop(next(iter(self.runs)))
+        if len(self.points) > 1:
+            text = ', '.join(f'{k} {v:.3f} s' for k, v in self.summary(self.uid).items())
+            print(whisper(f'per point: {text}'))
+        try:
+            self.write(self.uid, os.path.join(user_ns['BMMuser'].folder, 'timing', f'{self.uid}.csv'))
+        except Exception as E:
+            print(error_msg(f'Could not write point timing table: {E}'))
+
+    def labels(self, uid):
+        found = []
+        for point in self.runs[uid]['points']:
+            found.extend(k for k in point if k not in found and k != 'time')
+        return found
+
+    def summary(self, uid=None):
+        '''Return the mean time per point for each label for a run, by default the most recent one.'''
+        if uid is None:
+            uid = next(reversed(self.runs))
+        points = self.runs[uid]['points']
+        means = {k: sum(p.get(k, 0) for p in points)/len(points) for k in self.labels(uid)}
+        return dict(sorted(means.items(), key=lambda kv: -kv[1]))
+
+    def write(self, uid, filename):
+        '''Write the per-point table for a run as CSV, one row per primary event.'''
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        labels = self.labels(uid)
+        with open(filename, 'w') as fh:
+            fh.write(f'# uid: {uid}\n# plan_name: {self.runs[uid]["plan_name"]}\n')
+            fh.write(','.join(['seq_num', 'time'] + labels) + '\n')
+            for i, point in enumerate(self.runs[uid]['points']):
+                fh.write(','.join([str(i+1), f'{point["time"]:.6f}'] + [f'{point.get(k, 0):.6f}' for k in labels]) + '\n')
+        return filename
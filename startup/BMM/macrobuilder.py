@@ -7,7 +7,7 @@ from BMM.functions      import error_msg, warning_msg, go_msg, url_msg, bold_msg
 from BMM.functions      import isfloat, present_options
 from BMM.gdrive         import copy_to_gdrive, rsync_to_gdrive
 from BMM.periodictable  import PERIODIC_TABLE, edge_energy
-from BMM.xafs_functions import conventional_grid, sanitize_step_scan_parameters
+from BMM.xafs_functions import conventional_grid, scan_grid, sanitize_step_scan_parameters
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
@@ -519,7 +519,8 @@ class BMMMacroBuilder():
         t = [float(x) if isfloat(x) else x for x in t]
 
         #print(el, ed, edge_energy(el, ed), b, s, t)
-        (e, t, at, delta) = conventional_grid(bounds=b, steps=s, times=t, e0=edge_energy(el, ed), element=el, edge=ed, ththth=False)
+        (e, t, at, delta) = scan_grid(bounds=b, steps=s, times=t, e0=edge_energy(el, ed), element=el, edge=ed, ththth=False, mode=m['mode'],
+                                      grid=m.get('grid') or 'conventional', duration=m.get('duration'), kweight=m.get('kweight') or 2)
 
         if type(m['nscans']) is int:
             nsc = m['nscans']
@@ -5,21 +5,27 @@ import numpy
 import matplotlib.pyplot as plt
 #plt.ion()
 import h5py
-import os
+import os, time, io
+from concurrent.futures import ThreadPoolExecutor
 
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.neural_network import MLPClassifier
 from sklearn.preprocessing import StandardScaler
 
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, StratifiedKFold
+from sklearn.pipeline import make_pipeline
 from joblib import dump, load
 
+from bluesky.callbacks import CallbackBase
+from event_model import unpack_event_page
+
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
 
 from BMM.functions       import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 from BMM.larch_interface import Pandrosus
+from BMM.sidecar         import read_sidecar
 #from BMM.functions import plotting_mode
 from BMM.user_ns.bmm import BMMuser
 
@@ -35,6 +41,79 @@ from BMM.user_ns.bmm import BMMuser
 
 from BMM.user_ns.base import startup_dir
 
+
+class TrainingStore():
+    '''A training set stored as a single 2-D matrix of mu(E) spectra,
+    one row per spectrum on the grid of the data evaluation model,
+    with parallel 1-D arrays of score, uid, and mode.  A score of -1
+    means not yet scored.
+
+    Rows are appended to a chunked, resizable dataset.  compact()
+    rewrites the matrix as a contiguous dataset so that load() can
+    memory map it.
+    '''
+    format = 'bmm-training-matrix'
+
+    def __init__(self, filename, gridsize=401):
+        self.filename = filename
+        self.gridsize = gridsize
+
+    @classmethod
+    def is_matrix(cls, filename):
+        with h5py.File(filename, 'r') as f:
+            return f.attrs.get('format') == cls.format
+
+    def create(self):
+        '''Start a new, empty training set, overwriting any existing file.'''
+        with h5py.File(self.filename, 'w') as f:
+            f.attrs['format']   = self.format
+            f.attrs['gridsize'] = self.gridsize
+            f.create_dataset('mu',    shape=(0, self.gridsize), maxshape=(None, self.gridsize),
+                             chunks=(256, self.gridsize), dtype='f8')
+            f.create_dataset('score', shape=(0,), maxshape=(None,), chunks=(4096,), dtype='i1')
+            f.create_dataset('uid',   shape=(0,), maxshape=(None,), chunks=(4096,), dtype='S36')
+            f.create_dataset('mode',  shape=(0,), maxshape=(None,), chunks=(4096,), dtype='S16')
+
+    def append(self, mu, score, uid, mode):
+        '''Append rows.  mu is an (n, gridsize) array, the others are length n.'''
+        mu = numpy.atleast_2d(numpy.asarray(mu, dtype=float))
+        n = mu.shape[0]
+        if n == 0:
+            return
+        with h5py.File(self.filename, 'a') as f:
+            start = f['mu'].shape[0]
+            for name, values in (('mu', mu), ('score', score), ('uid', uid), ('mode', mode)):
+                f[name].resize(start + n, axis=0)
+                if name in ('uid', 'mode'):
+                    values = numpy.array([str(v).encode() for v in values], dtype=f[name].dtype)
+                f[name][start:start+n] = values
+
+    def compact(self):
+        '''Rewrite the store with contiguous datasets.'''
+        temp = self.filename + '.part'
+        with h5py.File(self.filename, 'r') as f, h5py.File(temp, 'w') as g:
+            for key, value in f.attrs.items():
+                g.attrs[key] = value
+            for name in ('mu', 'score', 'uid', 'mode'):
+                g.create_dataset(name, data=f[name][()])
+        os.replace(temp, self.filename)
+
+    def load(self, mmap=True):
+        '''Return (mu, score, uid, mode) arrays.  If the store is compact
+        and mmap is True, mu is a read-only numpy.memmap into the file.'''
+        with h5py.File(self.filename, 'r') as f:
+            ds = f['mu']
+            offset = ds.id.get_offset()
+            if mmap and offset is not None and ds.size > 0:
+                mu = numpy.memmap(self.filename, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+            else:
+                mu = ds[()]
+            score = f['score'][()]
+            uid   = f['uid'][()].astype(str)
+            mode  = f['mode'][()].astype(str)
+        return mu, score, uid, mode
+
+
 class BMMDataEvaluation():
     '''A very simple machine learning model for recognizing when an XAS
     scan goes horribly awry.
@@ -180,11 +259,8 @@ class BMMDataEvaluation():
         print(f'Scoring {len(these)} records')
 
         h5file = os.path.join(self.folder, f'{mode}_training_set.hdf5')
-        try:
-            os.remove(h5file)
-        except:
-            pass
-        f = h5py.File(h5file, 'w')
+        store = TrainingStore(h5file, self.GRIDSIZE)
+        store.create()
 
         count = 0
         for uid in list(these):
@@ -200,36 +276,133 @@ class BMMDataEvaluation():
                 elif len(ee) > self.GRIDSIZE:
                     ee = ee[:-1]
                     mm = mm[:-1]
-                grp = f.create_group(uid)
-                grp.create_dataset("energy", data=ee)
-                grp.create_dataset("mu", data=mm)
                 if mode == 'verygood':
-                    grp.attrs['score'] = 1
+                    score = 1
                 else:
                     action = input('\n' + bold_msg('1= good  2=bad  q=quit > '))
                     if action.lower() == 'q':
                         plt.close(fig)
+                        store.compact()
                         return()
-                    else:
-                        grp.attrs['score'] = action
+                    try:
+                        score = int(action)
+                    except ValueError:
+                        score = -1
+                store.append(mm, [score], [uid], [mode])
+        store.compact()
         plt.close(fig)
 
-    def import_training_set(self):
+    def extract_training_set(self, uids=None, query=None, mode='transmission', score=-1,
+                             output=None, clog=None, workers=8):
+        '''Fill a matrix-format training set (see TrainingStore) from a
+        catalog search, reading and interpolating records several at a
+        time.  Every spectrum is given the same score, e.g. 1 for a set
+        of known-good data.  The default of -1 marks them as not yet
+        scored; such rows are ignored by import_training_set.
+
+        Parameters
+        ----------
+        uids : list of str
+            uids to extract
+        query : dict
+            catalog search whose results are added to uids
+        mode : str
+            fluorescence or transmission
+        score : int
+            score given to each spectrum [-1]
+        output : str
+            training set file [<folder>/<mode>_training_set.hdf5]
+        clog : catalog
+            catalog to read from [catalog['bmm']]
+        workers : int
+            number of threads reading from the catalog [8]
+        '''
+        if clog is None:
+            clog = catalog['bmm']
+        uids = list(uids or [])
+        if query is not None:
+            uids.extend(u for u in clog.search(query) if u not in uids)
+        if output is None:
+            output = os.path.join(self.folder, f'{mode}_training_set.hdf5')
+
+        def extract_one(uid):
+            ret = self.extract_mu(clog=clog, uid=uid, mode=mode, show_plot=False)
+            if ret is None:
+                return None
+            ee, mm = self.rationalize_mu(*ret)
+            if len(ee) < self.GRIDSIZE:
+                return None
+            return mm[:self.GRIDSIZE]
+
+        store = TrainingStore(output, self.GRIDSIZE)
+        store.create()
+        begin = time.time()
+        print(f'extracting {len(uids)} records with {workers} workers')
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            rows = list(executor.map(extract_one, uids))
+        keep = [i for i, r in enumerate(rows) if r is not None]
+        store.append(numpy.array([rows[i] for i in keep]).reshape(len(keep), self.GRIDSIZE),
+                     [score]*len(keep), [uids[i] for i in keep], [mode]*len(keep))
+        store.compact()
+        print(f'wrote {len(keep)} of {len(uids)} spectra to {output} in {time.time()-begin:.1f} seconds')
+        return output
+
+    def convert_training_set(self, h5file, output=None):
+        '''Convert a training set with one group per uid, as written by
+        older versions of process_catalog, to the matrix format.  The
+        order of the spectra is preserved, so the train/test split made
+        by import_training_set is unchanged.  The default is to convert
+        in place.'''
+        if output is None:
+            output = h5file
+        mu, scores, uids = [], [], []
+        with h5py.File(h5file, 'r') as f:
+            for uid in f.keys():
+                try:
+                    score = int(f[uid].attrs['score'])
+                except:
+                    score = -1
+                mu.append(f[uid]['mu'][()])
+                scores.append(score)
+                uids.append(uid)
+        mode = os.path.basename(h5file).split('_')[0]
+        store = TrainingStore(output + '.convert', self.GRIDSIZE)
+        store.create()
+        store.append(numpy.array(mu).reshape(len(mu), self.GRIDSIZE), scores, uids, [mode]*len(uids))
+        store.compact()
+        os.replace(output + '.convert', output)
+        print(f'converted {len(uids)} spectra in {h5file} to matrix format')
+
+    def read_training_set(self):
+        '''Return (data, scores) from all the training set files, where data
+        is an (n, GRIDSIZE) matrix of mu(E) and scores is an array of n
+        integers.'''
         scores = list()
         data = list()
         for h5file in self.hdf5:
             if os.path.isfile(h5file):
                 print(f'reading data from {h5file}')
+                if TrainingStore.is_matrix(h5file):
+                    mu, score, uid, mode = TrainingStore(h5file, self.GRIDSIZE).load()
+                    keep = score >= 0
+                    data.append(mu[keep])
+                    scores.append(score[keep].astype(int))
+                    continue
                 f = h5py.File(h5file,'r')
+                these, those = list(), list()
                 for uid in f.keys():
                     try:
                         score = int(f[uid].attrs['score'])
                     except:
                         continue
-                    mu = list(f[uid]['mu'])
-                    scores.append(score)
-                    data.append(mu)
+                    those.append(score)
+                    these.append(f[uid]['mu'][()])
+                data.append(numpy.array(these).reshape(len(these), self.GRIDSIZE))
+                scores.append(numpy.array(those, dtype=int))
+        return numpy.concatenate(data), numpy.concatenate(scores)
 
+    def import_training_set(self):
+        data, scores = self.read_training_set()
         self.trainX, self.X, self.trainy, self.y = train_test_split(data, scores, random_state=0)
         self.scaler.fit(self.trainX)
         dump(self.scaler, self.matrix)
@@ -237,29 +410,116 @@ class BMMDataEvaluation():
         
         #self.X = self.scaler.transform(self.X)
         
-    def train(self, model='rf'):
+    def make_model(self, model='rf', **params):
+        '''Return an unfitted classifier of the given type.  params
+        override the defaults.  Estimators that can fit in parallel are
+        set to use all cores.'''
+        if model.lower() == 'knn':
+            return KNeighborsClassifier(**{'n_neighbors': 1, 'n_jobs': -1, **params})
+        elif model.lower() == 'mpl':
+            return MLPClassifier(**{'solver': 'lbfgs', 'hidden_layer_sizes': (10, ), **params}) #, random_state=1)
+        return RandomForestClassifier(**{'random_state': 0, 'n_jobs': -1, **params})
+
+    def fit_model(self, clf, X, y):
+        '''Fit a classifier using all cores, then set it to predict on a
+        single core, since it will mostly be asked about one spectrum
+        at a time.'''
+        clf.fit(X, y)
+        if 'n_jobs' in clf.get_params():
+            clf.set_params(n_jobs=1)
+        return clf
+
+    def train(self, model='rf', **params):
         '''Using all the hdf5 files of interpolated, scored data, create the
         evaluation model, saving it to a joblib dump file.
 
         '''
 
         print(f"training {model.upper()} model...")
-        if model.lower() == 'knn':
-            self.clf = KNeighborsClassifier(n_neighbors=1)
-        elif model.lower() == 'rf':
-            self.clf = RandomForestClassifier(random_state=0)
-        elif model.lower() == 'mpl':
-            self.clf = MLPClassifier(solver='lbfgs', hidden_layer_sizes=(10, )) #, random_state=1)
-        else:
-            self.clf = RandomForestClassifier(random_state=0)
-        
-        self.clf.fit(self.scaler.transform(self.trainX), self.trainy)
+        self.clf = self.fit_model(self.make_model(model, **params), self.scaler.transform(self.trainX), self.trainy)
         dump(self.clf, self.model)
         print(f'wrote model to {self.model}')
         #self.X = X_test
         #self.y = y_test
         return()
 
+    MODELS = {'knn' : ({'n_neighbors': 1}, {'n_neighbors': 3}, {'n_neighbors': 5}),
+              'rf'  : ({}, {'n_estimators': 300}, {'n_estimators': 100, 'max_depth': 20}),
+              'mpl' : ({}, {'hidden_layer_sizes': (50, )}, {'hidden_layer_sizes': (50, 10)}),}
+
+    def compare_models(self, models=None, folds=5, save=True):
+        '''Run k-fold cross-validation over the training set for each model
+        type and set of hyperparameters, reporting accuracy, training
+        time, single-spectrum and batched inference latency, and the size
+        of the saved model.  The scaler is fit only on the training part
+        of each fold.
+
+        With save=True, the most accurate model (the faster one for a
+        tie) is then trained and saved along with the scaler, exactly as
+        import_training_set() and train() do.
+
+        Parameters
+        ----------
+        models : dict
+            model type => list of hyperparameter dicts [self.MODELS]
+        folds : int
+            number of cross-validation folds [5]
+        save : bool
+            True to train and save the winning model [True]
+
+        Returns a list of dicts, one per model and parameter set.
+
+          clf.compare_models()
+          clf.compare_models(models={'rf': ({'n_estimators': 50}, {'n_estimators': 500})}, save=False)
+
+        '''
+        if models is None:
+            models = self.MODELS
+        data, scores = self.read_training_set()
+        data = numpy.asarray(data)
+        print(bold_msg(f'comparing models on {len(scores)} spectra with {folds}-fold cross validation'))
+        print('      model  parameters                          accuracy     train     1 spectrum     batched      size')
+        results = []
+        for model, paramsets in models.items():
+            for params in paramsets:
+                accuracy, train, single, batch, size = [], [], [], [], 0
+                for trn, tst in StratifiedKFold(n_splits=folds, shuffle=True, random_state=0).split(data, scores):
+                    scaler = StandardScaler()
+                    t0 = time.perf_counter()
+                    X = scaler.fit_transform(data[trn])
+                    clf = self.fit_model(self.make_model(model, **params), X, scores[trn])
+                    train.append(time.perf_counter() - t0)
+                    pipe = make_pipeline(scaler, clf)
+                    t0 = time.perf_counter()
+                    accuracy.append(numpy.mean(pipe.predict(data[tst]) == scores[tst]))
+                    batch.append((time.perf_counter() - t0) / len(tst))
+                    times = []
+                    for row in data[tst][:20]:
+                        t0 = time.perf_counter()
+                        pipe.predict(row.reshape(1, -1))
+                        times.append(time.perf_counter() - t0)
+                    single.append(numpy.median(times))
+                    buffer = io.BytesIO()
+                    dump(clf, buffer)
+                    size = len(buffer.getvalue())
+                this = {'model'    : model,
+                        'params'   : params,
+                        'accuracy' : float(numpy.mean(accuracy)),
+                        'std'      : float(numpy.std(accuracy)),
+                        'train'    : float(numpy.mean(train)),
+                        'single'   : float(numpy.mean(single)),
+                        'batch'    : float(numpy.mean(batch)),
+                        'size'     : size, }
+                results.append(this)
+                print(f'      {model:5s}  {str(params):34s}  {this["accuracy"]:.3f}±{this["std"]:.3f}  {this["train"]:7.2f} s  '
+                      f'{this["single"]*1000:8.2f} ms  {this["batch"]*1000:8.3f} ms  {size/1024:7.0f} kB')
+        best = sorted(results, key=lambda r: (-r['accuracy'], r['single']))[0]
+        print(bold_msg(f'best model: {best["model"]} {best["params"]}, accuracy {best["accuracy"]:.3f}'))
+        if save:
+            self.import_training_set()
+            self.train(best['model'], **best['params'])
+        return results
+
     def score(self):
         '''Thin wrapper around the classifier object's score method.'''
         return(self.clf.score(self.scaler.transform(self.X), self.y))
@@ -279,45 +539,188 @@ class BMMDataEvaluation():
             when not None, used to specify fluorescence or transmission (for a data set that has both)
 
         '''
-        if mode == 'xs':
-            this = user_ns['db'].v2[uid]
-            channels = this.metadata['start']['XDI']['_dtc']
-            el = BMMuser.element
+        found = self.measure_mu(user_ns['db'].v2[uid], mode)
+        if found is None:
+            return()
+        return self.predict(*found)
+
+    def evaluation_columns(self, start, mode):
+        '''Return the primary stream columns needed to evaluate a scan
+        in the given mode.'''
+        columns = ['dcm_energy', 'I0']
+        if mode in ('xs', 'xs1'):
+            columns.extend(start['XDI']['_dtc'][:4 if mode == 'xs' else 1])
+        elif 'trans' in mode:
+            columns.append('It')
+        elif 'ref' in mode:
+            columns.extend(['It', 'Ir'])
+        else:                   # fluorescence and NOT Xspress3
+            columns.extend(['vor:vor_names_name3', 'vor:vor_names_name15', 'vor:vor_names_name19',
+                            'DTC1', 'DTC2', 'DTC3', 'DTC4',
+                            'DTC2_1', 'DTC2_2', 'DTC2_3', 'DTC2_4',
+                            'DTC3_1', 'DTC3_2', 'DTC3_3', 'DTC3_4'])
+        return columns
+
+    def measure_mu(self, this, mode=None):
+        '''Return (energy, mu) for a run using a single read of the
+        needed columns of its primary stream, or None if the
+        fluorescence signal cannot be determined.
+
+        Parameters
+        ----------
+        this : BlueskyRun
+            the run to be evaluated, e.g. db.v2[uid]
+        mode : bool
+            when not None, used to specify fluorescence or transmission (for a data set that has both)
+        '''
+        start = this.metadata['start']
+        if mode is None:
+            mode = start['XDI']['_mode'][0]
+        columns = self.evaluation_columns(start, mode)
+        try:
+            t = this.primary.read(variables=columns)
+        except (KeyError, ValueError, TypeError):   # a column is missing or the catalog cannot project
             t = this.primary.read()
-            i0 = t['I0']
-            en = t['dcm_energy']
-            dtc1 = numpy.array(t[channels[0]])
-            dtc2 = numpy.array(t[channels[1]])
-            dtc3 = numpy.array(t[channels[2]])
-            dtc4 = numpy.array(t[channels[3]])
-            signal = dtc1+dtc2+dtc3+dtc4
+        i0 = numpy.array(t['I0'])
+        en = numpy.array(t['dcm_energy'])
+        if mode in ('xs', 'xs1'):
+            signal = sum(numpy.array(t[c]) for c in columns[2:])
+            mu = signal/i0
+        elif 'trans' in mode:
+            mu = numpy.log(abs(i0/numpy.array(t['It'])))
+        elif 'ref' in mode:
+            mu = numpy.log(abs(numpy.array(t['It'])/numpy.array(t['Ir'])))
+        else:                   # fluorescence and NOT Xspress3
+            element = start['XDI']['Element']['symbol']
+            for vor, channels in (('vor:vor_names_name3',  ('DTC1',   'DTC2',   'DTC3',   'DTC4')),
+                                  ('vor:vor_names_name15', ('DTC2_1', 'DTC2_2', 'DTC2_3', 'DTC2_4')),
+                                  ('vor:vor_names_name19', ('DTC3_1', 'DTC3_2', 'DTC3_3', 'DTC3_4')),):
+                if vor not in t or any(c not in t for c in channels):
+                    continue
+                if element in str(numpy.asarray(t[vor])[0]):
+                    signal = sum(numpy.array(t[c]) for c in channels)
+                    break
+            else:
+                print('cannot figure out fluorescence signal')
+                return None
             mu = signal/i0
+        return(en, mu)
+
+    def evaluate_many(self, uids, mode=None, workers=4):
+        '''Evaluate many measurements at once.  Each run is read once,
+        several at a time, then all the spectra are interpolated onto
+        the training grid together and the scaler and classifier are
+        each called once on the stacked matrix.
+
+        Returns a list of (score, emoji) tuples in the order of uids.
+        An empty tuple marks a run that could not be evaluated.
+
+        Parameters
+        ----------
+        uids : list of str
+            uids of data to be evaluated
+        mode : bool
+            when not None, used to specify fluorescence or transmission
+        workers : int
+            number of threads reading from the catalog [4]
+        '''
+        def read_one(uid):
+            try:
+                return self.measure_mu(user_ns['db'].v2[uid], mode)
+            except Exception as E:
+                print(error_msg(f'could not read {uid}: {E}'))
+                return None
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            spectra = list(executor.map(read_one, uids))
+        return self.predict_many(spectra)
+
+    def rationalize_many(self, spectra):
+        '''Vectorized rationalize_mu.  spectra is a list of (energy, mu)
+        tuples.  Returns a (len(spectra), GRIDSIZE) matrix of mu, each row
+        interpolated onto the same grid that rationalize_mu would use
+        for that spectrum.
+
+        The spectra are laid end to end on one energy axis, offset so
+        that they do not overlap, so that a single call to numpy.interp
+        does all the interpolations.
+        '''
+        n = len(spectra)
+        first = numpy.array([float(en[0])  for en, mu in spectra])
+        last  = numpy.array([float(en[-1]) for en, mu in spectra])
+        step  = (last - first) / self.GRIDSIZE
+        span  = numpy.array([float(numpy.max(en) - numpy.min(en)) for en, mu in spectra]) + 1
+        shift = numpy.concatenate(([0], numpy.cumsum(span)[:-1])) - numpy.array([float(numpy.min(en)) for en, mu in spectra])
+        xp = numpy.concatenate([numpy.asarray(en, dtype=float) + shift[i] for i, (en, mu) in enumerate(spectra)])
+        fp = numpy.concatenate([numpy.asarray(mu, dtype=float) for en, mu in spectra])
+        grid = first[:, None] + step[:, None] * numpy.arange(self.GRIDSIZE)
+        return numpy.interp(grid + shift[:, None], xp, fp).reshape(n, self.GRIDSIZE)
+
+    def predict_many(self, spectra):
+        '''Subject a list of (energy, mu) tuples to the model all at once.
+        Entries of None are not evaluated.  Returns a list of (score,
+        emoji) tuples, with an empty tuple for each None.'''
+        good = [i for i, s in enumerate(spectra) if s is not None]
+        results = [()] * len(spectra)
+        if len(good) == 0:
+            return results
+        m = self.scaler.transform(self.rationalize_many([spectra[i] for i in good]))
+        for i, result in zip(good, self.clf.predict(m)):
+            results[i] = (result, self.good_emoji if result == 1 else self.bad_emoji)
+        return results
+
+    def evaluate_sidecar(self, filename, mode=None):
+        '''Perform an evaluation of a measurement using the binary
+        sidecar of its XDI file rather than reading from Databroker.
+        Returns the same tuple as evaluate.
+
+        Parameters
+        ----------
+        filename : str
+            the XDI file or its sidecar
+        mode : bool
+            when not None, used to specify fluorescence or transmission (for a data set that has both)
+
+        '''
+        data, md = read_sidecar(filename)
+        if mode is None:
+            mode = md['mode'] or 'transmission'
+        if 'dcm_energy' in data:
+            en = data['dcm_energy']
+        elif '333_energy' in data:        # Si(333) data, the sidecar holds the XDI columns
+            en = data['333_energy'] / 3
         else:
-            this = user_ns['db'].v2[uid]
-            if mode is None:
-                mode = this.metadata['start']['XDI']['_mode'][0]
-            element = this.metadata['start']['XDI']['Element']['symbol']
-            i0 = this.primary.read()['I0']
-            en = this.primary.read()['dcm_energy']
-            if 'trans' in mode:
-                it = this.primary.read()['It']
-                mu = numpy.log(abs(i0/it))
-            elif 'ref' in mode:
-                it = this.primary.read()['It']
-                ir = this.primary.read()['Ir']
-                mu = numpy.log(abs(it/ir))
-            else:               # fluorescence and NOT Xspress3
-                if element in str(this.primary.read()['vor:vor_names_name3'][0].values):
-                    signal = this.primary.read()['DTC1'] + this.primary.read()['DTC2'] + this.primary.read()['DTC3'] + this.primary.read()['DTC4']
-                elif element in str(this.primary.read()['vor:vor_names_name15'][0].values):
-                    signal = this.primary.read()['DTC2_1'] + this.primary.read()['DTC2_2'] + this.primary.read()['DTC2_3'] + this.primary.read()['DTC2_4']
-                elif element in str(this.primary.read()['vor:vor_names_name19'][0].values):
-                    signal = this.primary.read()['DTC3_1'] + this.primary.read()['DTC3_2'] + this.primary.read()['DTC3_3'] + this.primary.read()['DTC3_4']
-                else:
-                    print('cannot figure out fluorescence signal')
-                    #print(f'vor:vor_names_name3 {}')
-                    return()
-                mu = signal/i0
+            print('cannot find the energy column in the sidecar')
+            return()
+        if 'I0' not in data:
+            print('cannot find the I0 column in the sidecar')
+            return()
+        i0 = data['I0']
+        if 'trans' in mode:
+            if 'It' not in data:
+                print('cannot find the It column in the sidecar')
+                return()
+            mu = numpy.log(abs(i0/data['It']))
+        elif 'ref' in mode:
+            if 'It' not in data or 'Ir' not in data:
+                print('cannot find the It and Ir columns in the sidecar')
+                return()
+            mu = numpy.log(abs(data['It']/data['Ir']))
+        else:
+            channels = [c for c in md['dtc'] if c in data]
+            if len(channels) == 0:
+                print('cannot figure out fluorescence signal')
+                return()
+            mu = sum(data[c] for c in channels)/i0
+        return self.predict(en, mu)
+
+    def online(self, mode=None, energies=None, **kwargs):
+        '''Return an OnlineEvaluator callback using this model.  See
+        OnlineEvaluator for the arguments.'''
+        return OnlineEvaluator(self, mode=mode, energies=energies, **kwargs)
+
+    def predict(self, en, mu):
+        '''Interpolate mu(E) onto the grid of the training set and
+        subject it to the model.  Returns (score, emoji).'''
         e,m = self.rationalize_mu(en, mu)
         if len(e) > self.GRIDSIZE:
             e, m = e[:-1], m[:-1]
@@ -409,3 +812,180 @@ class BMMDataEvaluation():
                 grp.attrs['score'] = action
                 print(go_msg(f'added #{count}'))
         h5.close()
+
+
+class OnlineEvaluator(CallbackBase):
+    '''A callback which scores the quality of an XAFS scan with the
+    data evaluation model while the scan is underway.
+
+    Every few points, the partially measured mu(E) is interpolated
+    onto the same GRIDSIZE-point grid used by the model, spanning the
+    whole planned energy range.  Beyond the last measured point, mu is
+    held at its last value.  The model then scores the spectrum.
+
+    The model was trained on complete spectra, so the scores of a
+    partial spectrum are only informational.  Whether to skip the rest
+    of a scan sequence is decided from the score of the complete
+    spectrum, made at the stop document.
+
+    Attributes
+    ----------
+    confidence : float
+        model probability that the spectrum is good, None until the first score
+    fraction : float
+        fraction of the planned energy range measured so far
+    history : list of tuple
+        (number of points, fraction, confidence) for each score
+    doubtful : bool
+        True once the confidence of the partial spectrum has stayed
+        below threshold for patience consecutive scores after
+        min_fraction of the scan, informational only
+    final : float
+        confidence of the complete spectrum, None until the stop document
+    skip_requested : bool
+        True if the confidence of the complete spectrum is below threshold
+
+    Parameters
+    ----------
+    evaluator : BMMDataEvaluation
+        the trained model
+    mode : str
+        measurement mode, default is the _mode in the start document
+    energies : array
+        planned energy grid, default is the energies measured so far
+    every : int
+        score after this many new points [10]
+    min_fraction : float
+        do not mark the scan as doubtful before this fraction of the scan [0.25]
+    threshold : float
+        confidence below which a score counts against the scan [0.2]
+    patience : int
+        number of consecutive low partial scores needed to mark the scan as doubtful [3]
+
+    Examples
+    --------
+
+    Replay a stored run through the callback:
+
+    >>> this = clf.online()
+    >>> this.replay(db.v2[uid])
+    >>> this.history
+    '''
+    def __init__(self, evaluator, mode=None, energies=None, every=10, min_fraction=0.25, threshold=0.2, patience=3):
+        super().__init__()
+        self.evaluator    = evaluator
+        self.mode         = mode
+        self.energies     = None if energies is None else numpy.asarray(energies, dtype=float)
+        self.every        = every
+        self.min_fraction = min_fraction
+        self.threshold    = threshold
+        self.patience     = patience
+        self.reset()
+
+    def reset(self):
+        self.en, self.mu    = [], []
+        self.channels       = []
+        self.descriptors    = dict()
+        self.confidence     = None
+        self.fraction       = 0
+        self.history        = []
+        self.lowcount       = 0
+        self.doubtful       = False
+        self.final          = None
+        self.skip_requested = False
+        self.uid            = None
+
+    def start(self, doc):
+        self.reset()
+        self.uid = doc['uid']
+        xdi = doc.get('XDI', dict())
+        mode = self.mode
+        if mode is None:
+            mode = xdi.get('_mode', ('transmission',))[0]
+        self.this_mode = mode
+        self.channels  = list(xdi.get('_dtc', []))
+        if mode == 'xs1':
+            self.channels = self.channels[:1]
+
+    def descriptor(self, doc):
+        self.descriptors[doc['uid']] = doc['name']
+
+    def point(self, data):
+        '''Return mu for one event, or None.'''
+        mode = self.this_mode
+        try:
+            if 'trans' in mode:
+                return numpy.log(abs(data['I0']/data['It']))
+            elif 'ref' in mode:
+                return numpy.log(abs(data['It']/data['Ir']))
+            return sum(data[c] for c in self.channels)/data['I0']
+        except (KeyError, ZeroDivisionError, TypeError):
+            return None
+
+    def event(self, doc):
+        if self.descriptors.get(doc['descriptor']) != 'primary':
+            return
+        data = doc['data']
+        if 'dcm_energy' not in data:
+            return
+        mu = self.point(data)
+        if mu is None or not numpy.isfinite(mu):
+            return
+        self.en.append(float(data['dcm_energy']))
+        self.mu.append(float(mu))
+        if len(self.en) % self.every == 0:
+            self.score()
+
+    def score(self):
+        '''Score the spectrum measured so far.'''
+        ev = self.evaluator
+        if ev.clf is None or len(self.en) < 2:
+            return None
+        order = numpy.argsort(self.en)         # backwards scans arrive in descending order
+        en, mu = numpy.array(self.en)[order], numpy.array(self.mu)[order]
+        planned = self.energies if self.energies is not None else en
+        (first, last) = (float(numpy.min(planned)), float(numpy.max(planned)))
+        if last <= first:
+            return None
+        grid = first + (last - first) / ev.GRIDSIZE * numpy.arange(ev.GRIDSIZE)
+        m = ev.scaler.transform(numpy.interp(grid, en, mu).reshape(1, -1))
+        if hasattr(ev.clf, 'predict_proba'):
+            classes = list(ev.clf.classes_)
+            self.confidence = float(ev.clf.predict_proba(m)[0][classes.index(1)]) if 1 in classes else 0.0
+        else:
+            self.confidence = float(ev.clf.predict(m)[0] == 1)
+        self.fraction = float(min((en[-1] - en[0]) / (last - first), 1.0))
+        self.history.append((len(self.en), round(self.fraction, 3), round(self.confidence, 3)))
+        if self.fraction >= self.min_fraction and self.confidence < self.threshold:
+            self.lowcount += 1
+        else:
+            self.lowcount = 0
+        if self.lowcount >= self.patience:
+            self.doubtful = True
+        return self.confidence
+
+    def stop(self, doc):
+        self.final = self.score()
+        self.skip_requested = self.final is not None and self.final < self.threshold
+
+    def replay(self, run):
+        '''Feed the documents of a stored run through this callback.  If
+        no planned energy grid was given, the energies of the whole run
+        are used, as they would have been planned.  Returns self.history.'''
+        documents = []
+        for name, doc in run.documents():
+            if name == 'event_page':
+                documents.extend(('event', ev) for ev in unpack_event_page(doc))
+            else:
+                documents.append((name, doc))
+        given = self.energies
+        if given is None:
+            primary = [d['uid'] for n, d in documents if n == 'descriptor' and d.get('name') == 'primary']
+            self.energies = numpy.array([d['data']['dcm_energy'] for n, d in documents
+                                         if n == 'event' and d['descriptor'] in primary and 'dcm_energy' in d['data']])
+        try:
+            for name, doc in documents:
+                self(name, doc)
+        finally:
+            self.energies = given
+        return self.history
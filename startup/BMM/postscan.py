@@ -0,0 +1,95 @@
+import threading, queue, time
+
+from BMM.functions import error_msg
+from BMM.logging   import report
+
+## The work that follows each repetition of an XAFS scan sequence --
+## writing the XDI file, data evaluation, reporting to Slack,
+## synching with Google Drive, dossier bookkeeping -- does not need
+## the RunEngine.  Handing it to a PostScanQueue lets the mono rewind
+## and the next repetition begin while the previous repetition's
+## outputs are finalized.
+
+
+class PostScanQueue():
+    '''Run jobs on a single background thread, one at a time, in the
+    order in which they were submitted.
+
+      tail = PostScanQueue()
+      tail.submit('write XDI file', write_XDI, datafile, header)
+      tail.submit('data evaluation', evaluate, uid)
+      ...
+      tail.close()         # wait for everything, before writing the dossier
+
+    Because there is only one worker, the jobs for one repetition are
+    finished before any job for the next repetition starts, and jobs
+    appending to shared state (like dossier.scanlist) do so in order.
+
+    An exception in a job is reported and recorded in the errors
+    list as a (label, exception) tuple.  The jobs which follow it
+    still run.  The elapsed time of each job is recorded in the
+    timing list as a (label, seconds) tuple.
+
+    With background=False, each job is run immediately by submit(),
+    which is the same as doing the work inline.
+
+    '''
+    def __init__(self, background=True, name='post-scan work'):
+        self.background = background
+        self.name       = name
+        self.errors     = []
+        self.timing     = []
+        self._queue     = queue.Queue()
+        self._thread    = None
+
+    def submit(self, label, func, *args, **kwargs):
+        '''Queue func(*args, **kwargs) to run after every job submitted before it.'''
+        if self.background is False:
+            self._run(label, func, args, kwargs)
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name=self.name, daemon=True)
+            self._thread.start()
+        self._queue.put((label, func, args, kwargs))
+
+    def _run(self, label, func, args, kwargs):
+        start = time.time()
+        try:
+            func(*args, **kwargs)
+        except Exception as E:
+            self.errors.append((label, E))
+            report(f'{self.name}: {label} failed ({type(E).__name__}: {E})', level='error')
+        self.timing.append((label, time.time() - start))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(*job)
+            finally:
+                self._queue.task_done()
+
+    @property
+    def pending(self):
+        '''The number of jobs which have not yet finished.'''
+        return self._queue.unfinished_tasks
+
+    def join(self):
+        '''Wait for every job submitted so far to finish.  Return the list of errors.'''
+        if self.pending > 0:
+            print(f'waiting for {self.pending} {self.name} job(s) to finish')
+        self._queue.join()
+        return self.errors
+
+    def close(self):
+        '''Wait for every job to finish, then stop the worker thread.  Return the list of errors.'''
+        self.join()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if len(self.errors) > 0:
+            print(error_msg(f'{len(self.errors)} {self.name} job(s) failed: {", ".join(e[0] for e in self.errors)}'))
+        return self.errors
@@ -0,0 +1,101 @@
+import numpy, h5py, json, os
+
+## This module deliberately does not import user_ns so that it can be
+## used outside of bsui, e.g. by the kafka consumer.
+
+
+def sidecar_name(datafile):
+    '''Return the name of the binary sidecar for an XDI file.'''
+    return datafile + '.h5'
+
+
+def sidecar_metadata(start, stop=None):
+    '''Pluck the metadata needed to reprocess a scan from its start and
+    stop documents.
+    '''
+    xdi = start.get('XDI', dict())
+    def dig(*keys):
+        this = xdi
+        for k in keys:
+            if not isinstance(this, dict) or k not in this:
+                return None
+            this = this[k]
+        return this
+    md = {'uid'         : start.get('uid'),
+          'scan_id'     : start.get('scan_id'),
+          'plan_name'   : start.get('plan_name'),
+          'start_time'  : start.get('time'),
+          'stop_time'   : None if stop is None else stop.get('time'),
+          'filename'    : dig('_filename'),
+          'mode'        : dig('_mode'),
+          'user_mode'   : dig('_user', 'mode'),
+          'kind'        : dig('_kind'),
+          'dtc'         : list(dig('_dtc') or []),
+          'element'     : dig('Element', 'symbol'),
+          'edge'        : dig('Element', 'edge'),
+          'edge_energy' : dig('Scan', 'edge_energy'),
+          'sample'      : dig('Sample', 'name'),
+          'prep'        : dig('Sample', 'prep'),
+    }
+    if isinstance(md['mode'], (list, tuple)):   # _mode is stored as a 1-tuple
+        md['mode'] = md['mode'][0] if len(md['mode']) > 0 else None
+    return md
+
+
+def write_sidecar(datafile, table, start, stop=None):
+    '''Write a columnar binary copy of the data in an XDI file.
+
+    The sidecar is an HDF5 file next to datafile (see sidecar_name)
+    with one contiguous, uncompressed dataset per column of table in
+    the "data" group and the metadata from sidecar_metadata as JSON in
+    the "metadata" attribute.  Contiguous datasets can be memory mapped
+    by read_sidecar.
+
+    Datetime columns (i.e. the time column of a SEAD scan) are stored
+    as unix time stamps.
+
+    Returns the name of the sidecar file.
+    '''
+    fname = sidecar_name(datafile)
+    temp  = fname + '.part'
+    with h5py.File(temp, 'w') as f:
+        grp = f.create_group('data')
+        columns = []
+        for col in table.columns:
+            values = table[col].to_numpy()
+            if numpy.issubdtype(values.dtype, numpy.datetime64):
+                values = values.astype('datetime64[ns]').view('int64') / 10**9
+            else:
+                values = values.astype(float)
+            name = str(col).replace('/', '_')
+            grp.create_dataset(name, data=values)
+            columns.append(name)
+        f.attrs['columns']  = json.dumps(columns)
+        f.attrs['metadata'] = json.dumps(sidecar_metadata(start, stop), default=str)
+    os.replace(temp, fname)
+    return fname
+
+
+def read_sidecar(filename, mmap=True):
+    '''Read a sidecar written by write_sidecar.
+
+    filename is either the sidecar or the XDI file it sits next to.
+
+    Returns (data, md), where data is a dict of 1D arrays keyed by
+    column name and md is the metadata dict.  When mmap is True, the
+    arrays are read-only numpy.memmap objects pointing into the file,
+    so nothing is read from disk until an array is used.
+    '''
+    if not filename.endswith('.h5'):
+        filename = sidecar_name(filename)
+    data = dict()
+    with h5py.File(filename, 'r') as f:
+        md = json.loads(f.attrs['metadata'])
+        for name in json.loads(f.attrs['columns']):
+            ds = f['data'][name]
+            offset = ds.id.get_offset()
+            if mmap and offset is not None and ds.size > 0:
+                data[name] = numpy.memmap(filename, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+            else:
+                data[name] = ds[()]
+    return data, md
@@ -1,11 +1,12 @@
 from databroker import catalog
 from databroker.queries import TimeRange
-import numpy, json, os, time
+import numpy, json, os, time, sqlite3, datetime, threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm           # progress bar
 from pprint import pprint
 
 from BMM.periodictable import element_symbol, edge_energy, Z_number
-from BMM.functions import elapsed_time
+from BMM.functions import elapsed_time, e2bragg
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
@@ -15,6 +16,208 @@ from BMM.user_ns.base import startup_dir
         
 
 
+class TelemetryStore():
+    '''A persistent, per-UID store of the timing of XAFS scans, kept in
+    an SQLite database.
+
+    Each row of the runs table holds the element, edge, start and stop
+    times, elapsed time, measurement time (the sum of the dwell
+    times), number of points, the time spent on the visual metadata
+    and the XRF spectrum, the webcam UID identifying the set of
+    snapshots, and a status:
+
+      ok          complete record, used for statistics
+      incomplete  record stopped before all points were measured
+      beamdump    elapsed time exceeds BMMTelemetry.beamdump times the measurement time
+      open        no stop document yet, looked at again on the next refresh
+      failed      record could not be read
+
+    The meta table records the span of time that has been ingested.
+
+    The points table holds the per-event energy, dwell time, and time
+    stamp arrays of the ok records, along with the detector class and
+    mono d-spacing, for fitting an OverheadModel.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with self.connect() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS runs (
+                              uid TEXT PRIMARY KEY, element TEXT, edge TEXT,
+                              start REAL, stop REAL, elapsed REAL, measurement REAL, npoints INTEGER,
+                              visual REAL, xrf REAL, webcam TEXT, status TEXT)''')
+            db.execute('CREATE INDEX IF NOT EXISTS runs_element ON runs (element, start)')
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)')
+            db.execute('''CREATE TABLE IF NOT EXISTS points (
+                              uid TEXT PRIMARY KEY, element TEXT, start REAL, detector TEXT,
+                              d_spacing REAL, energy BLOB, dwell BLOB, time BLOB)''')
+
+    def connect(self):
+        return sqlite3.connect(self.filename)
+
+    def get(self, key):
+        with self.connect() as db:
+            row = db.execute('SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value):
+        with self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def put(self, rows):
+        '''Insert or replace a list of row dicts.'''
+        columns = ('uid', 'element', 'edge', 'start', 'stop', 'elapsed', 'measurement', 'npoints',
+                   'visual', 'xrf', 'webcam', 'status')
+        with self.connect() as db:
+            db.executemany(f'INSERT OR REPLACE INTO runs VALUES ({",".join("?"*len(columns))})',
+                           [tuple(r.get(c) for c in columns) for r in rows])
+
+    def uids(self, status=None):
+        with self.connect() as db:
+            if status is None:
+                return [r[0] for r in db.execute('SELECT uid FROM runs')]
+            return [r[0] for r in db.execute('SELECT uid FROM runs WHERE status=?', (status,))]
+
+    def put_points(self, rows):
+        '''Insert or replace a list of per-event timing dicts, see BMMTelemetry.timing.'''
+        with self.connect() as db:
+            db.executemany('''INSERT OR REPLACE INTO points (uid, element, start, detector, d_spacing, energy, dwell, time)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                           [(r['uid'], r['element'], r['start'], r['detector'], r['d_spacing'],
+                             numpy.asarray(r['energy'], dtype=float).tobytes(),
+                             numpy.asarray(r['dwell'],  dtype=float).tobytes(),
+                             numpy.asarray(r['time'],   dtype=float).tobytes()) for r in rows])
+
+    def points(self, since=None):
+        '''Return the per-event timing of the ok records, oldest first, as a
+        list of dicts which include the elapsed and measurement times
+        from the runs table.'''
+        query, args = '''SELECT p.uid, p.element, p.start, p.detector, p.d_spacing,
+                                p.energy, p.dwell, p.time, r.elapsed, r.measurement
+                         FROM points p JOIN runs r ON p.uid = r.uid WHERE r.status=?''', ['ok']
+        if since is not None:
+            query += ' AND p.start>=?'
+            args.append(since)
+        with self.connect() as db:
+            rows = db.execute(query + ' ORDER BY p.start', args).fetchall()
+        names = ('uid', 'element', 'start', 'detector', 'd_spacing', 'energy', 'dwell', 'time', 'elapsed', 'measurement')
+        out = []
+        for row in rows:
+            this = dict(zip(names, row))
+            for a in ('energy', 'dwell', 'time'):
+                this[a] = numpy.frombuffer(this[a], dtype=float)
+            out.append(this)
+        return out
+
+    def point_uids(self):
+        with self.connect() as db:
+            return [r[0] for r in db.execute('SELECT uid FROM points')]
+
+    def runs(self, element=None, since=None, status='ok'):
+        '''Return the matching rows as a dict of numpy arrays.'''
+        query, args = 'SELECT elapsed, measurement, npoints, visual, xrf, webcam FROM runs WHERE status=?', [status]
+        if element is not None:
+            query += ' AND element=?'
+            args.append(element)
+        if since is not None:
+            query += ' AND start>=?'
+            args.append(since)
+        with self.connect() as db:
+            rows = db.execute(query + ' ORDER BY start', args).fetchall()
+        names = ('elapsed', 'measurement', 'npoints', 'visual', 'xrf', 'webcam')
+        if len(rows) == 0:
+            return {n: numpy.array([]) for n in names}
+        columns = list(zip(*rows))
+        out = {n: numpy.array(c, dtype=float) for n, c in zip(names[:-1], columns[:-1])}
+        out['webcam'] = numpy.array(columns[-1], dtype=object)
+        return out
+
+
+def detector_class(mode):
+    '''Sort a measurement mode into the detector classes of the
+    OverheadModel.  Like plotting_mode, but without needing to know
+    whether the Xspress3 is in use.'''
+    mode = (mode or '').lower()
+    if mode == 'xs1':
+        return 'xs1'
+    if any(x in mode for x in ('xs', 'fluo', 'flou', 'both')):
+        return 'xs'
+    if mode == 'yield':
+        return 'yield'
+    return 'trans'
+
+
+class OverheadModel():
+    '''A linear model of the overhead of each point of an XAFS scan,
+    that is, the time between successive events less the dwell time.
+
+    The features of each point are the size of the mono move (in
+    millidegrees of Bragg angle) and its square root, for the
+    velocity- and acceleration-limited parts of a move, the dwell
+    time, and an offset for each detector class other than
+    transmission (see detector_class).  The mono acceleration time is
+    not a feature: the step moves are always made at
+    BMMuser.acc_fast, so it cannot be told apart from the constant.  The
+    overhead of a whole scan is the sum over its points plus a setup
+    term for the first point and the start and stop of the scan.
+
+    '''
+    detectors = ('xs', 'xs1', 'yield')
+    features  = ('constant', 'move', 'sqrt_move', 'dwell') + detectors
+
+    def __init__(self, coefficients=None, setup=0.0):
+        self.coefficients = None if coefficients is None else numpy.asarray(coefficients, dtype=float)
+        self.setup        = setup
+
+    @classmethod
+    def design(cls, energy, dwell, detector='trans', d_spacing=3.1356):
+        '''Return the feature matrix for the second through last points of a
+        scan, one row per point.'''
+        move = 1000 * numpy.abs(numpy.diff(e2bragg(numpy.asarray(energy, dtype=float), d_spacing)))
+        X = numpy.zeros((len(move), len(cls.features)))
+        X[:,0] = 1
+        X[:,1] = move
+        X[:,2] = numpy.sqrt(move)
+        X[:,3] = numpy.asarray(dwell, dtype=float)[1:]
+        if detector in cls.detectors:
+            X[:, 4 + cls.detectors.index(detector)] = 1
+        return X
+
+    @staticmethod
+    def observed(record):
+        '''Per-point overheads of a stored record, aligned with design.'''
+        return numpy.diff(record['time']) - record['dwell'][1:]
+
+    def fit(self, records, pause=30):
+        '''Least-squares fit to a list of records from TelemetryStore.points.
+        Points with negative overhead or overhead longer than pause
+        seconds (a suspended scan, for instance) are left out of the fit.'''
+        X = numpy.vstack([self.design(r['energy'], r['dwell'], r['detector'], r['d_spacing']) for r in records])
+        y = numpy.concatenate([self.observed(r) for r in records])
+        good = (y >= 0) & (y < pause)
+        self.coefficients = numpy.linalg.lstsq(X[good], y[good], rcond=None)[0]
+        residual = [r['elapsed'] - r['measurement'] - self.predict(r['energy'], r['dwell'], r['detector'], r['d_spacing'])
+                    for r in records]
+        self.setup = float(numpy.median(residual))
+        return self
+
+    def predict(self, energy, dwell, detector='trans', d_spacing=3.1356):
+        '''Predicted overhead in seconds of the points after the first.'''
+        if len(energy) < 2:
+            return 0.0
+        return float(self.design(energy, dwell, detector, d_spacing).dot(self.coefficients).sum())
+
+    def total(self, energy, dwell, detector='trans', d_spacing=3.1356):
+        '''Predicted overhead in seconds of a whole scan.'''
+        return self.predict(energy, dwell, detector, d_spacing) + self.setup
+
+    def todict(self):
+        return {'features': list(self.features), 'coefficients': list(self.coefficients), 'setup': self.setup}
+
+    @classmethod
+    def fromdict(cls, d):
+        return cls(d['coefficients'], d['setup'])
+
+
 class BMMTelemetry():
     '''A class for figuring out the historical average overhead for an
     XAS scan at BMM
@@ -24,11 +227,33 @@ class BMMTelemetry():
     in the start and stop document.  The measurement time is the sum
     of the dwell time column in the datatable from the measurement.
 
+    The timing of each XAFS record is kept in a TelemetryStore.
+    refresh() ingests only records newer than those already in the
+    store, so the per-element statistics from overhead() and
+    periodic_table() are computed from the store without walking the
+    catalog.
+
+    fit_overhead_model() fits an OverheadModel to the time stamps of
+    the events of each record and reports how well it predicts held
+    out records compared to the per-element dpp average.
+    conventional_grid uses the model when it does better.
+
     '''
-    def __init__(self):
-        self.folder      = os.path.join(startup_dir, 'telemetry')
+    def __init__(self, bc=None, folder=None):
+        self.folder      = os.path.join(startup_dir, 'telemetry') if folder is None else folder
         self.json        = os.path.join(self.folder, 'telemetry.json')
-        self.bc          = catalog['bmm']
+        self.sqlite      = os.path.join(self.folder, 'telemetry.sqlite')
+        self.model_json  = os.path.join(self.folder, 'overhead_model.json')
+        self._store      = None
+        self.bc          = catalog['bmm'] if bc is None else bc
+        self.workers     = 8      # size of the thread pool for catalog requests
+        self.batch       = 100    # number of snapshot uids per catalog search
+        self._tele       = None   # contents of the json file, see telemetry()
+        self._averages   = None
+        self._stamp      = None
+        self._model      = None   # contents of the model json file, see model()
+        self._model_stamp = None
+        self.pause       = 30     # per-point overhead treated as a pause when fitting
         self._start_date = '2021-09-01'
         self.reliability = 10
         self.beamdump    = 3
@@ -37,6 +262,13 @@ class BMMTelemetry():
         self.time_search = None
         self.xafs_search = None
         self.seen = {}
+        self.seen_lock = threading.Lock()   # measure runs on a thread pool, see visual_metadata
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = TelemetryStore(self.sqlite)
+        return self._store
 
     @property
     def start_date(self):
@@ -66,16 +298,37 @@ class BMMTelemetry():
         record the time required to capture the XRF spectrun and make
         its png image.
 
+        Each set of snapshots is counted once.  The set is claimed in
+        self.seen before its metadata are fetched, so that records of
+        the same sequence measured on other threads do not count it
+        again.  The claim is given up if the metadata cannot be fetched.
+
         '''
         #print(snapshots['webcam_uid'])
-        if snapshots['webcam_uid'] in self.seen:
-            return 0
+        with self.seen_lock:
+            if snapshots['webcam_uid'] in self.seen:
+                return (0, 0)
+            self.seen[snapshots['webcam_uid']] = 1
+        metadata = dict()
+        try:
+            for key in ('webcam_uid', 'anacam_uid', 'usbcam1_uid', 'usbcam2_uid', 'xrf_uid'):
+                if key in snapshots:
+                    metadata[snapshots[key]] = self.bc[snapshots[key]].metadata
+        except:
+            with self.seen_lock:
+                self.seen.pop(snapshots['webcam_uid'], None)
+            return (0, 0)
+        return self.snapshot_times(snapshots, metadata)
+
+    def snapshot_times(self, snapshots, metadata):
+        '''Compute (visual, xrf) times for a set of snapshots from a dict of
+        metadata keyed by uid.'''
         net_time, between_time, xrf_time = 0,0,0
         try:
-            web  = self.bc[snapshots['webcam_uid']].metadata
-            ana  = self.bc[snapshots['anacam_uid']].metadata
-            usb1 = self.bc[snapshots['usbcam1_uid']].metadata
-            usb2 = self.bc[snapshots['usbcam2_uid']].metadata
+            web  = metadata[snapshots['webcam_uid']]
+            ana  = metadata[snapshots['anacam_uid']]
+            usb1 = metadata[snapshots['usbcam1_uid']]
+            usb2 = metadata[snapshots['usbcam2_uid']]
             net_time = (web['stop']['time'] - web['start']['time']) +\
                 (ana['stop']['time']  - ana['start']['time']) +\
                 (usb1['stop']['time'] - usb1['start']['time']) +\
@@ -84,98 +337,340 @@ class BMMTelemetry():
                 (usb1['start']['time'] - ana['stop']['time']) +\
                 (usb2['start']['time'] - usb1['stop']['time'])
             if 'xrf_uid' in snapshots:
-                xrf = self.bc[snapshots['xrf_uid']].metadata
+                xrf = metadata[snapshots['xrf_uid']]
                 xrf_time = (xrf['stop']['time'] - xrf['start']['time']) + (web['start']['time'] - xrf['stop']['time'])
-            self.seen[snapshots['webcam_uid']] = 1
+            with self.seen_lock:
+                self.seen[snapshots['webcam_uid']] = 1
         except:
             pass
         #print(net_time, between_time)
         return(net_time + between_time, xrf_time)
         
             
+    def measure(self, uid, this, visual=True):
+        '''Return a store row for one XAFS record.  With visual=False, the
+        snapshot times are left for batch_visual.'''
+        row = {'uid': uid, 'status': 'failed'}
+        try:
+            md = this.metadata
+            start = md['start']
+            row.update({'element' : start['XDI']['Element']['symbol'],
+                        'edge'    : start['XDI']['Element']['edge'],
+                        'start'   : start['time'], })
+            if md['stop'] is None:
+                row['status'] = 'open'
+                return row
+            row['stop'] = md['stop']['time']
+            ## records that did not complete normally
+            if 'primary' in md['stop']['num_events']:
+                if start['num_points'] != md['stop']['num_events']['primary']:
+                    row['status'] = 'incomplete'
+                    return row
+            t = this['primary', 'data', 'dwti_dwell_time'][:]
+            row.update({'measurement' : float(t.sum()),
+                        'elapsed'     : md['stop']['time'] - start['time'],
+                        'npoints'     : len(t), })
+            ## exclude records that span beam dumps or other pauses
+            if row['elapsed']/row['measurement'] > self.beamdump:
+                row['status'] = 'beamdump'
+                return row
+            snapshots = start['XDI'].get('_snapshots', {})
+            row['webcam'] = snapshots.get('webcam_uid')
+            row['visual'], row['xrf'] = (0, 0)
+            if visual is False:
+                row['snapshots'] = snapshots
+            elif 'webcam_uid' in snapshots:
+                row['visual'], row['xrf'] = self.visual_metadata(snapshots)
+            row['status'] = 'ok'
+        except: #  Exception as E:             # if a record cannot be processed for any reason, just mark it failed
+            pass
+        return row
+
+    def metadata_many(self, uids, pool):
+        '''Fetch the metadata of many records, self.batch at a time, with
+        one catalog search per batch run on the thread pool.  Returns a
+        dict keyed by uid.'''
+        def fetch(chunk):
+            try:
+                return {u: r.metadata for u, r in self.bc.search({'uid': {'$in': chunk}}).items()}
+            except:
+                found = dict()
+                for u in chunk:
+                    try:
+                        found[u] = self.bc[u].metadata
+                    except:
+                        pass
+                return found
+        metadata = dict()
+        chunks = [uids[i:i+self.batch] for i in range(0, len(uids), self.batch)]
+        for found in pool.map(fetch, chunks):
+            metadata.update(found)
+        return metadata
+
+    def batch_visual(self, rows, pool):
+        '''Fill in the snapshot times for rows measured with visual=False.
+        Each set of snapshots is counted for the first row that uses it.'''
+        sets = dict()
+        for row in rows:
+            snapshots = row.pop('snapshots', None)
+            if row['status'] == 'ok' and snapshots and 'webcam_uid' in snapshots and snapshots['webcam_uid'] not in self.seen:
+                sets.setdefault(snapshots['webcam_uid'], (row, snapshots))
+        uids = [snapshots[k] for row, snapshots in sets.values()
+                for k in ('webcam_uid', 'anacam_uid', 'usbcam1_uid', 'usbcam2_uid', 'xrf_uid') if k in snapshots]
+        metadata = self.metadata_many(uids, pool)
+        for webcam, (row, snapshots) in sets.items():
+            row['visual'], row['xrf'] = self.snapshot_times(snapshots, metadata)
+            with self.seen_lock:
+                self.seen[webcam] = 1
+
+    def ingest(self, searches, workers=None, batch=True):
+        '''Measure each record in one or more catalog searches and put them in
+        the store.
+
+        With workers > 1, the searches are listed and the records
+        measured on a bounded thread pool and, with batch=True, the
+        snapshot metadata are fetched in batches (see metadata_many).
+        '''
+        if not isinstance(searches, (list, tuple)):
+            searches = [searches]
+        workers = self.workers if workers is None else max(workers, 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            items = [item for found in pool.map(lambda s: list(s.items()), searches) for item in found]
+            measured = pool.map(lambda item: self.measure(*item, visual=not batch), items)
+            rows = list(tqdm(measured, total=len(items)))
+            if batch:
+                self.batch_visual(rows, pool)
+        self.store.put(rows)
+
+    def searches(self, since, until):
+        '''Return one catalog search per element for XAFS records in a
+        span of time.'''
+        span = self.bc.search(TimeRange(since=since, until=until)).search({'XDI._kind':'xafs'})
+        return [span.search({'XDI.Element.symbol': element_symbol(z)}) for z in self.all_elements]
+
+    def refresh(self, workers=None, batch=True):
+        '''Bring the telemetry store up to date.  Only records which
+        started after the last refresh are read from the catalog, along
+        with any that were still underway at the last refresh.  If
+        start_date is earlier than anything in the store, the earlier
+        span is ingested as well.
+
+        The per-element searches and the records they find are read
+        concurrently, see ingest.'''
+        start = time.time()
+        self.seen = {}
+        since = datetime.datetime.fromisoformat(self.start_date).timestamp()
+        covered_since, covered_until = self.store.get('covered_since'), self.store.get('covered_until')
+        if covered_since is None or since < covered_since:
+            until = covered_since if covered_since is not None else start
+            print(f'ingesting records from {self.start_date}')
+            self.ingest(self.searches(since, until), workers=workers, batch=batch)
+            self.store.set('covered_since', since)
+            covered_until = covered_until or until
+        if covered_until < start:
+            print(f'ingesting records since {datetime.datetime.fromtimestamp(covered_until)}')
+            self.ingest(self.searches(covered_until, start), workers=workers, batch=batch)
+        for uid in self.store.uids(status='open'):
+            self.store.put([self.measure(uid, self.bc[uid])])
+        self.store.set('covered_until', start)
+        elapsed_time(start)
+
+    def timing(self, uid, this):
+        '''Return the per-event energy, dwell time, and time stamp of one
+        record, along with what is needed to compute its OverheadModel
+        features.  Returns None if the record cannot be read.'''
+        try:
+            start = this.metadata['start']
+            xdi   = start['XDI']
+            return {'uid'          : uid,
+                    'element'      : xdi['Element']['symbol'],
+                    'start'        : start['time'],
+                    'detector'     : detector_class(xdi.get('_user', {}).get('mode')),
+                    'd_spacing'    : float(xdi['Mono']['d_spacing']),
+                    'energy'       : numpy.asarray(this['primary', 'data', 'dcm_energy'][:], dtype=float),
+                    'dwell'        : numpy.asarray(this['primary', 'data', 'dwti_dwell_time'][:], dtype=float),
+                    'time'         : numpy.asarray(this['primary', 'data', 'time'][:], dtype=float), }
+        except Exception:
+            return None
+
+    def collect_timing(self, workers=None):
+        '''Read the per-event timing of every ok record in the store which
+        does not yet have it, concurrently on a thread pool.'''
+        have = set(self.store.point_uids())
+        todo = [u for u in self.store.uids(status='ok') if u not in have]
+        if len(todo) == 0:
+            return 0
+        workers = self.workers if workers is None else max(workers, 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows = list(tqdm(pool.map(lambda u: self.timing(u, self.bc[u]), todo), total=len(todo)))
+        rows = [r for r in rows if r is not None]
+        self.store.put_points(rows)
+        return len(rows)
+
+    def fit_overhead_model(self, holdout=0.2, collect=True, workers=None):
+        '''Fit an OverheadModel to the per-event timing of the records in
+        the store and write it to the model JSON file.
+
+        The most recent holdout fraction of records is held out of a
+        first fit.  The total overhead (elapsed less measurement time)
+        of each held out record is predicted by the model and by the
+        per-element dpp average of the training records times the
+        number of points, and the errors of the two are reported.  The
+        saved model is then fit to all records, and is used by
+        conventional_grid only if it beat the dpp average.
+
+        Returns the error report as a dict.
+        '''
+        if collect:
+            self.collect_timing(workers=workers)
+        since   = datetime.datetime.fromisoformat(self.start_date).timestamp()
+        records = self.store.points(since=since)
+        ntest   = int(len(records) * holdout)
+        if ntest < 1 or len(records) - ntest < len(OverheadModel.features):
+            print(f'not enough records to fit the overhead model ({len(records)})')
+            return {}
+        train, test = records[:-ntest], records[-ntest:]
+
+        model = OverheadModel().fit(train, pause=self.pause)
+        dpp = dict()
+        for r in train:
+            dpp.setdefault(r['element'], []).append((r['elapsed'] - r['measurement']) / len(r['time']))
+        dpp_all = numpy.mean([d for v in dpp.values() for d in v])
+        dpp = {el: numpy.mean(v) for el, v in dpp.items()}
+
+        actual = numpy.array([r['elapsed'] - r['measurement'] for r in test])
+        scalar = numpy.array([dpp.get(r['element'], dpp_all) * len(r['time']) for r in test])
+        fitted = numpy.array([model.total(r['energy'], r['dwell'], r['detector'], r['d_spacing']) for r in test])
+        report = {'train': len(train), 'test': len(test)}
+        for name, predicted in (('scalar', scalar), ('model', fitted)):
+            error = predicted - actual
+            report[name] = {'mae'      : float(numpy.abs(error).mean()),
+                            'rms'      : float(numpy.sqrt((error**2).mean())),
+                            'relative' : float(numpy.abs(error/actual).mean()), }
+        report['better'] = report['model']['mae'] < report['scalar']['mae']
+
+        print(f'held out {len(test)} of {len(records)} records, overhead error per scan:')
+        print(f'    {"":8s} {"MAE (s)":>10s} {"RMS (s)":>10s} {"relative":>10s}')
+        for name in ('scalar', 'model'):
+            print(f'    {name:8s} {report[name]["mae"]:10.1f} {report[name]["rms"]:10.1f} {report[name]["relative"]:10.1%}')
+        print(f'the overhead model {"beats" if report["better"] else "does not beat"} the dpp average')
+
+        model = OverheadModel().fit(records, pause=self.pause)
+        with open(self.model_json + '.part', 'w') as fh:
+            json.dump({**model.todict(), 'report': report, 'fitted': time.time()}, fh)
+        os.replace(self.model_json + '.part', self.model_json)
+        return report
+
+    def model(self):
+        '''Return the contents of the model JSON file, or None if there is
+        none.  Read again only when the file changes.'''
+        if not os.path.isfile(self.model_json):
+            return None
+        st = os.stat(self.model_json)
+        stamp = (self.model_json, st.st_mtime_ns, st.st_size)
+        if self._model is None or stamp != self._model_stamp:
+            with open(self.model_json, 'r') as fh:
+                self._model = json.load(fh)
+            self._model_stamp = stamp
+        return self._model
+
+    def estimate_overhead(self, energy, dwell, mode=None, d_spacing=3.1356):
+        '''Return (overhead, uncertainty) in seconds for a scan on an energy
+        and dwell time grid from the overhead model, or None if there
+        is no model or the model did not beat the dpp average.  The
+        uncertainty is the mean relative error on the held out records.
+        A model fitted with a different set of features is ignored.'''
+        saved = self.model()
+        if saved is None or not saved['report'].get('better') or len(energy) < 2:
+            return None
+        if saved.get('features') != list(OverheadModel.features):
+            return None
+        total = OverheadModel.fromdict(saved).total(energy, dwell, detector_class(mode), d_spacing)
+        return (total, total * saved['report']['model']['relative'])
+
     def overhead(self, element=None):
         '''Determine the average overhead for all scans in a time period and
-        of a particular element.  Also record the time taken to
-        capture the visual metadata.
+        of a particular element from the telemetry store.  Also report
+        the time taken to capture the visual metadata.  Run refresh()
+        first to include recent scans.
 
         '''
         if element is None: return({})
-        element_search = self.records(element)
-        l = len(element_search)
-        if l == 0: return({})
-        ratio, difference, dpp, visual, xrf = numpy.zeros(l), numpy.zeros(l), numpy.zeros(l), numpy.zeros(l), numpy.zeros(l)
-        count = 0
-        start = time.time()
-        self.seen = {}
-        for u, this in tqdm(element_search.items()):
-            ## records that did not complete normally
-            #if this is None: continue
-            md = this.metadata
-            if md is None or md['stop'] is None: continue
-            if 'primary' in md['stop']['num_events']:
-                if md['start']['num_points'] != md['stop']['num_events']['primary']:
-                    continue
-            try:
-                t = this['primary', 'data', 'dwti_dwell_time'][:]
-                measurement_time = float(t.sum())
-                time_elapsed = md['stop']['time'] - md['start']['time']
-
-                ## exclude records that span beam dumps or other pauses
-                if time_elapsed/measurement_time > self.beamdump:
-                    continue
-
-                ## gather simple statistics
-                difference[count] = time_elapsed - measurement_time  # total motor motion overhead
-                ratio[count]      = time_elapsed/measurement_time
-                dpp[count]        = difference[count] / len(t)  # approximate overhead as evenly distributed point-by-point
-                visual[count], xrf[count] = self.visual_metadata(md['start']['XDI']['_snapshots'])
-                count             = count + 1
-            except: #  Exception as E:             # if a record cannot be processed for any reason, just skip it.
-                #print(E)
-                pass
-
-        ## count will likely be smaller than l
+        since = datetime.datetime.fromisoformat(self.start_date).timestamp()
+        runs = self.store.runs(element=element, since=since)
+        count = len(runs['elapsed'])
+        if count == 0: return({})
+        difference = runs['elapsed'] - runs['measurement']   # total motor motion overhead
+        ratio      = runs['elapsed'] / runs['measurement']
+        dpp        = difference / runs['npoints']           # approximate overhead as evenly distributed point-by-point
+        ## the visual metadata are captured once per sequence and their times are stored
+        ## with whichever record of the sequence was measured first, so count each set of
+        ## snapshots once, using the largest times among its records
+        sets = dict()
+        for w, v, x in zip(runs['webcam'], runs['visual'], runs['xrf']):
+            if w is not None:
+                sets[w] = numpy.fmax(sets.get(w, (0, 0)), (v, x))
+        visual = numpy.array([v for v, x in sets.values()], dtype=float)
+        xrf    = numpy.array([x for v, x in sets.values()], dtype=float)
+
         ratio = ratio[numpy.flatnonzero(ratio)]
         difference = difference[numpy.flatnonzero(difference)]
         dpp = dpp[numpy.flatnonzero(dpp)]
         visual = visual[numpy.flatnonzero(visual)]
         xrf = xrf[numpy.flatnonzero(xrf)]
-        elapsed_time(start)
         ## return means and standard deviations
         return({'count'     : count,
                 'ratio'     : [ratio.mean(), ratio.std()],
                 'difference': [difference.mean(), difference.std()],
                 'dpp'       : [dpp.mean(), dpp.std(), dpp.max(), dpp.min()],
-                'visual'    : [visual.mean(), visual.std(), len(visual)],
-                'xrf'       : [xrf.mean(), xrf.std(), len(xrf)],
+                'visual'    : [visual.mean() if len(visual) else 0, visual.std() if len(visual) else 0, len(visual)],
+                'xrf'       : [xrf.mean() if len(xrf) else 0, xrf.std() if len(xrf) else 0, len(xrf)],
             })
-    
+
 
     ## TODO: take a list of integers/element symbols as an input
     ## parameter, extract just those, modify json file for those
     ## elements
-    def periodic_table(self):
+    def periodic_table(self, refresh=True, workers=None, batch=True):
+        '''Update the telemetry store, then write the per-element statistics
+        to the telemetry JSON file.  The file is replaced atomically,
+        so a reader never sees a partial file.'''
+        if refresh:
+            self.refresh(workers=workers, batch=batch)
         start = time.time()
         results = {}
         for z in self.all_elements:
             el = element_symbol(z)
             results[el] = self.overhead(el)
-            pprint(results[el])
-            j = json.dumps(results)
-            f = open(self.json,"w")
-            f.write(j)
-            f.close()
-        end = time.time()
-        print('\n\nThat took %.1f min' % ((end-start)/60))
+        j = json.dumps(results)
+        f = open(self.json + '.part',"w")
+        f.write(j)
+        f.close()
+        os.replace(self.json + '.part', self.json)
+        print(f'wrote statistics for {len(self.all_elements)} elements to {self.json} in {(time.time()-start)*1000:.0f} ms')
+
 
+    def telemetry(self):
+        '''Return the contents of the telemetry JSON file.  The file is
+        read once and read again only when its modification time or size
+        changes.  The averages over all elements are computed when the
+        file is read.'''
+        st = os.stat(self.json)
+        stamp = (self.json, st.st_mtime_ns, st.st_size)
+        if self._tele is None or stamp != self._stamp:
+            with open(self.json, 'r') as td:
+                alltele = json.load(td)
+            averages = dict()
+            for thing in ('dpp', 'visual', 'xrf', 'ratio', 'difference'):
+                a = numpy.array([alltele[el][thing][0] for el in alltele.keys() if thing in alltele[el]])
+                averages[thing] = (a.mean(), a.std()) if len(a) > 0 else (0, 0)
+            self._tele, self._averages, self._stamp = alltele, averages, stamp
+        return self._tele
 
     def value(self, el, thing='dpp'):
         if thing not in ('dpp', 'visual', 'xrf', 'ratio', 'difference'):
             return 0
-        with open(self.json, 'r') as td:
-            tdata = td.read()
-        alltele = json.loads(tdata)
-        return alltele[el.capitalize()][thing][0]
+        return self.telemetry()[el.capitalize()][thing][0]
         
     def average(self, thing='dpp'):
         '''In the case of an element that has not been measured before, use
@@ -184,14 +679,8 @@ class BMMTelemetry():
         '''
         if thing not in ('dpp', 'visual', 'xrf', 'ratio', 'difference'):
             return (0,0)
-        with open(self.json, 'r') as td:
-            tdata = td.read()
-        alltele = json.loads(tdata)
-        a = []
-        for el in alltele.keys():
-            if 'dpp' in alltele[el]:
-                a.append(alltele[el]['dpp'][0])
-        return(numpy.array(a).mean(), numpy.array(a).std())
+        self.telemetry()
+        return self._averages[thing]
 
     # def interpolate(self, energy):
     #     a = json.load(open(self.json))
@@ -211,7 +700,7 @@ class BMMTelemetry():
     #     return(numpy.interp(energy, e[s], t[s]))
 
     def overhead_per_point(self, element, edge=None):
-        a = json.load(open(self.json))
+        a = self.telemetry()
         element = element_symbol(element)
         if edge is not None and edge.lower() in ('l2', 'l1'):
             return(self.average(thing='dpp'))
@@ -103,6 +103,12 @@ class BMM_User(Borg):
         list of energy ot k steps
     times : list of float or str
         list of integration times
+    grid : str
+        conventional or adaptive energy grid
+    duration : float
+        target time in minutes for one scan on an adaptive grid
+    kweight : float
+        k-weight of the dwell times on an adaptive grid
     folder : str
         data folder on Lustre
     folder_link : str
@@ -143,6 +149,18 @@ class BMM_User(Borg):
         measuring with the Si(333) reflection
     mode : str
         in-scan plotting mode
+    stream_xdi : bool
+        True to write the XDI file as the data arrive rather than after the scan
+    xdi_sidecar : bool
+        True to write a binary copy of the data next to each XDI file
+    ml_online : bool
+        True to score the data quality with the ML model while a scan is underway
+    ml_abort : bool
+        True to skip the remaining repetitions when the online score of the complete spectrum says the data are bad
+    postscan_queue : bool
+        True to finish each repetition (XDI file, evaluation, reporting) on a background thread
+    point_timing : bool
+        True to time each point of every run, print a summary, and write the table to the timing folder
 
     Single energy time scan attributes, default values
     --------------------------------------------------
@@ -262,6 +280,15 @@ class BMM_User(Borg):
         self.ththth        = False
         self.lims          = True
         self.mode          = 'transmission'
+        self.grid          = 'conventional'
+        self.duration      = 20.0
+        self.kweight       = 2.0
+        self.stream_xdi    = False
+        self.xdi_sidecar   = False
+        self.ml_online     = False
+        self.ml_abort      = False
+        self.postscan_queue = True
+        self.point_timing  = False
         self.url           = False
         self.doi           = False
         self.cif           = False
@@ -298,16 +325,17 @@ class BMM_User(Borg):
                              "readout_mode", "folder", "folder_link", "filename",
                              "experimenters", "element", "edge", "sample", "prep", "comment",
                              "xs1", "xs2", "xs3", "xs4", "xs8", "pds_mode", "mode", "roi1",
-                             "roi2", "roi3", "roi4", "dtc1", "dtc2", "dtc3", "dtc4")
+                             "roi2", "roi3", "roi4", "dtc1", "dtc2", "dtc3", "dtc4", "grid")
         self.bmm_ints     = ("gup", "saf", "detector", "npoints", "bender_xas", "bender_xrd",
                              "bender_margin", "filter_state", "nscans", "start")
         self.bmm_floats   = ("macro_sleep", "dwell", "delay", "acc_fast", "acc_slow",
-                             "inttime", "tweak_xas_time") #, "edge_energy")
+                             "inttime", "tweak_xas_time", "duration", "kweight") #, "edge_energy")
         self.bmm_booleans = ("prompt", "final_log_entry", "use_pilatus", "staff", "echem",
                              "use_slack", "trigger", "running_macro", "suspenders_engaged",
                              "macro_dryrun", "snapshots", "usbstick", "rockingcurve",
                              "htmlpage", "bothways", "channelcut", "ththth", "lims", "url",
-                             "doi", "cif", "syns", "enable_live_plots",
+                             "doi", "cif", "syns", "enable_live_plots", "stream_xdi", "xdi_sidecar",
+                             "ml_online", "ml_abort", "postscan_queue", "point_timing",
                              "post_webcam", "post_anacam", "post_usbcam1", "post_usbcam2", "post_xrf")
         self.bmm_none     = ("echem_remote", "slack_channel", "extra_metadata")
         self.bmm_ignore   = ("motor_fault", "bounds", "steps", "times", "motor", "motor2",
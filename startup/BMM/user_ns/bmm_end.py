@@ -274,7 +274,7 @@ from BMM.xdi import write_XDI
 # import logging
 # logging.getLogger("hdf5plugin").setLevel(logging.ERROR) # no longer needed, I guess...
 run_report('\t'+'xafs')
-from BMM.xafs import howlong, xafs, xanes, db2xdi
+from BMM.xafs import howlong, xafs, xanes, db2xdi, db2xdi_batch
 from BMM.xafs_functions import xrfat
 from BMM.dossier import lims
 
@@ -304,6 +304,7 @@ from BMM.raster import raster, difference_data
 
 run_report('\t'+'Larch')
 from BMM.larch_interface import Pandrosus, Kekropidai
+from BMM.larch_batch import batch_process
 ## examples that only work at BMM...
 # se = Pandrosus()
 # se.fetch('8e293af3-811c-4e96-a4e5-733d0dc77dad', name\='Se metal', mode='transmission')
@@ -319,7 +320,7 @@ run_report('\t'+'Demeter')
 from BMM.demeter import run_athena, run_hephaestus, toprj
 
 run_report('\t'+'machine learning and data evaluation')
-from BMM.ml import BMMDataEvaluation
+from BMM.ml import BMMDataEvaluation, OnlineEvaluator
 clf = BMMDataEvaluation()
 
 run_report('\t'+'telemetry')
@@ -398,8 +399,10 @@ lsmb.folder = BMMuser.folder     # LakeShore 331 temperature controller
 gmb.folder = BMMuser.folder      # generic motor grid
 gawheel.description = 'the glancing angle stage'
 
-from BMM.logging import BMM_msg_hook
+from BMM.logging import BMM_msg_hook, PointTiming
 user_ns['RE'].msg_hook = BMM_msg_hook
+point_timing = PointTiming()     # per-point timing when BMMuser.point_timing is True, see BMM/logging.py
+user_ns['RE'].preprocessors.append(point_timing)
 
 def measuring(element, edge=None):
     BMMuser.element = element
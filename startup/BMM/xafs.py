@@ -1,10 +1,11 @@
 from bluesky.plans import scan_nd, count
-from bluesky.plan_stubs import sleep, mv, null
-from bluesky.preprocessors import subs_decorator, finalize_wrapper
+from bluesky.plan_stubs import sleep, mv, null, abs_set, wait
+from bluesky.preprocessors import subs_decorator, subs_wrapper, finalize_wrapper
 #from databroker.core import SingleRunCache
 
-import numpy, os, re, shutil, uuid
+import numpy, os, re, shutil, uuid, json, time, threading
 import textwrap, configparser, datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from cycler import cycler
 import matplotlib
 import matplotlib.pyplot as plt
@@ -14,7 +15,7 @@ from tiled.client import from_profile
 
 from urllib.parse import quote
 
-from BMM.db              import file_resource
+from BMM.db              import file_resource, search_uids, FileRun
 from BMM.demeter         import toprj
 from BMM.derivedplot     import DerivedPlot, close_all_plots, close_last_plot
 from BMM.dossier         import BMMDossier
@@ -29,10 +30,11 @@ from BMM.metadata        import bmm_metadata, display_XDI_metadata, metadata_at_
 from BMM.modes           import get_mode, describe_mode
 from BMM.motor_status    import motor_sidebar, motor_status
 from BMM.periodictable   import edge_energy, Z_number, element_name
+from BMM.postscan        import PostScanQueue
 from BMM.resting_state   import resting_state_plan
 from BMM.suspenders      import BMM_suspenders, BMM_clear_to_start, BMM_clear_suspenders
-from BMM.xdi             import write_XDI
-from BMM.xafs_functions  import conventional_grid, sanitize_step_scan_parameters
+from BMM.xdi             import write_XDI, XDIStreamWriter, XDIHeaderRecorder
+from BMM.xafs_functions  import conventional_grid, scan_grid, energy_limits, sanitize_step_scan_parameters
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
@@ -131,6 +133,7 @@ def scan_metadata(inifile=None, **kwargs):
         True = measure in pseudo-channel-cut mode
     ththth : bool
         True = measure using the Si(333) reflection
+        (refused by xafs() until the detectors can be put into continuous acquisition)
     mode : str
         transmission, fluorescence, or reference -- how to display the data
     bounds : list
@@ -139,6 +142,12 @@ def scan_metadata(inifile=None, **kwargs):
         scan grid step sizes (not kwarg-able at this time)
     times : list
         scan grid dwell times (not kwarg-able at this time)
+    grid : str
+        conventional or adaptive, see xafs_functions.adaptive_grid
+    duration : float
+        target time in minutes of one scan on an adaptive grid
+    kweight : float
+        k-weight of the dwell times on an adaptive grid
 
     Any or all of these can be specified.  Values from the INI file
     are read first, then overridden with specified values.  If values
@@ -189,7 +198,12 @@ def scan_metadata(inifile=None, **kwargs):
             found[a] = True
         parameters['bounds_given'] = parameters['bounds'].copy()
 
-    (problem, text, reference) = sanitize_step_scan_parameters(parameters['bounds'], parameters['steps'], parameters['times'])
+    ## the grid type is needed to know whether steps and times must match the bounds
+    if 'grid' in kwargs:
+        adaptive = str(kwargs['grid']).lower() == 'adaptive'
+    else:
+        adaptive = config.get('scan', 'grid', fallback=BMMuser.grid).lower() == 'adaptive'
+    (problem, text, reference) = sanitize_step_scan_parameters(parameters['bounds'], parameters['steps'], parameters['times'], adaptive=adaptive)
     if len(text) > 1:
         print(text)
         print(f'\nsee: {reference}')
@@ -198,7 +212,7 @@ def scan_metadata(inifile=None, **kwargs):
 
     ## ----- strings
     for a in ('folder', 'experimenters', 'element', 'edge', 'filename', 'comment',
-              'mode', 'sample', 'prep', 'url', 'doi', 'cif'):
+              'mode', 'sample', 'prep', 'url', 'doi', 'cif', 'grid'):
         found[a] = False
         if a not in kwargs:
             try:
@@ -214,6 +228,9 @@ def scan_metadata(inifile=None, **kwargs):
         print(error_msg('\nfolder %s does not exist\n' % parameters['folder']))
         return {}, {}
     parameters['mode'] = parameters['mode'].lower()
+    parameters['grid'] = parameters['grid'].lower()
+    if parameters['grid'] == 'adaptive':  # steps and times are not used by an adaptive grid
+        found['steps'], found['times'] = True, True
     
     ## ----- start value
     if 'start' not in kwargs:
@@ -249,7 +266,7 @@ def scan_metadata(inifile=None, **kwargs):
             found[a] = True
 
     ## ----- floats
-    for a in ('e0', 'energy', 'inttime', 'dwell', 'delay'):
+    for a in ('e0', 'energy', 'inttime', 'dwell', 'delay', 'duration', 'kweight'):
         found[a] = False
         if a not in kwargs:
             try:
@@ -354,6 +371,27 @@ def attain_energy_position(value):
     return True
 
 
+def attain_energy_position_while(value, func):
+    '''Start moving the mono to an energy position, call func while it
+    moves, then finish with attain_energy_position to deal with any
+    encoder loss on the Bragg axis.
+
+    Arguments
+    =========
+      value : (float) target energy value
+      func : function without arguments, it must not use the mono
+
+    Returns the return value of func
+    '''
+    dcm, dcm_bragg = user_ns['dcm'], user_ns['dcm_bragg']
+    dcm_bragg.clear_encoder_loss()
+    yield from abs_set(dcm.energy, value, group='rewind')
+    result = func()
+    yield from wait(group='rewind')
+    yield from attain_energy_position(value)
+    return result
+
+
 def ini_sanity(found):
     '''Very simple sanity checking of the scan control file.'''
     ok = True
@@ -369,7 +407,7 @@ def ini_sanity(found):
 ##########################################################
 # --- export a database energy scan entry to an XDI file #
 ##########################################################
-def db2xdi(datafile, key):
+def db2xdi(datafile, key, sidecar=False):
     '''
     Export a database entry for an XAFS scan to an XDI file.
 
@@ -379,6 +417,8 @@ def db2xdi(datafile, key):
         output file name
     key : str
         UID in database
+    sidecar : bool
+        True to also write a binary sidecar file (see BMM/sidecar.py)
 
 
     Examples
@@ -399,10 +439,170 @@ def db2xdi(datafile, key):
         return
     header = db[key]
     ## sanity check, make sure that db returned a header AND that the header was an xafs scan
-    write_XDI(dfile, header)
+    write_XDI(dfile, header, sidecar=sidecar)
     print(bold_msg('wrote %s' % dfile))
 
 
+def db2xdi_batch(uids=None, query=None, folder=None, catalog=None, workers=4, connections=2, manifest=None, sidecar=False):
+    '''
+    Export many database entries for XAFS scans to XDI files, several
+    at a time.
+
+    Records are fetched and written by a pool of worker threads.  No
+    more than connections records are read from the catalog at the
+    same time.  Each output file is named after the _filename in the
+    start document, e.g. "Fe-foil.001".
+
+    The start documents are read first and the output names are
+    reserved before any file is written.  Records whose output files
+    already exist are skipped.  A record whose output name is the same
+    as that of an earlier record in the list (as happens for a query
+    spanning experiments) is marked as a conflict and not written.
+    Output files are created exclusively, so an existing file is never
+    overwritten.
+
+    A manifest is written as a JSON file, listing each UID, its output
+    file, whether it was written, skipped, in conflict, or failed, the
+    time spent fetching and writing it, and any error message.
+
+    Parameters
+    ----------
+    uids : list of str
+        UIDs to export
+    query : dict
+        catalog search, e.g. {'XDI._kind': 'xafs', 'XDI.Facility.SAF': 312345},
+        matching records are added to uids
+    folder : str
+        output folder [BMMuser.folder]
+    catalog : Databroker or BMM.db.FileCatalog
+        source of records [db]
+    workers : int
+        number of worker threads [4]
+    connections : int
+        maximum number of simultaneous catalog reads [2]
+    manifest : str
+        output manifest file [folder/db2xdi_manifest_<timestamp>.json]
+    sidecar : bool
+        True to also write a binary sidecar for each file [False]
+
+    Examples
+    --------
+
+    >>> db2xdi_batch(query={'XDI._kind': 'xafs', 'XDI.Facility.GUP': 312345})
+
+    >>> db2xdi_batch(uids=['0783ac3a-658b-44b0-bba5-ed4e0c4e7216', ...], folder='/path/to/folder')
+
+    '''
+    BMMuser = user_ns['BMMuser']
+    if catalog is None:
+        catalog = db
+    if folder is None:
+        folder = BMMuser.folder
+    uids = list(uids or [])
+    if query is not None:
+        uids.extend(search_uids(catalog, query))
+    uids = list(dict.fromkeys(uids))     # each UID once, in order
+    if manifest is None:
+        manifest = os.path.join(folder, f'db2xdi_manifest_{now()}.json')
+    gate = threading.BoundedSemaphore(max(connections, 1))
+    entries = {u: {'uid': u, 'file': None, 'status': 'failed', 'fetch': 0.0, 'write': 0.0, 'error': None} for u in uids}
+    headers = dict()
+
+    def lookup(uid):
+        entry = entries[uid]
+        try:
+            t0 = time.time()
+            with gate:
+                header = catalog[uid]
+                start = header.start
+            try:
+                fname = start['XDI']['_filename']
+            except:
+                fname = f'scan_{start["scan_id"]}.xdi'
+            entry['file'] = os.path.join(folder, fname)
+            entry['fetch'] = time.time() - t0
+            headers[uid] = header
+        except Exception as E:
+            entry['error'] = f'{type(E).__name__}: {E}'
+
+    def export_one(uid):
+        entry = entries[uid]
+        try:
+            handle = open(entry['file'], 'x')   # claim the file, in case something else is writing to this folder
+            handle.close()
+        except FileExistsError:
+            entry['status'] = 'skipped'
+            return entry
+        except Exception as E:
+            entry['error'] = f'{type(E).__name__}: {E}'
+            return entry
+        try:
+            t0 = time.time()
+            with gate:
+                run = FileRun.from_header(headers.pop(uid))
+            t1 = time.time()
+            entry['fetch'] = round(entry['fetch'] + t1 - t0, 3)
+            write_XDI(entry['file'], run, sidecar=sidecar)
+            entry['write'] = round(time.time() - t1, 3)
+            entry['status'] = 'written'
+        except Exception as E:
+            entry['error'] = f'{type(E).__name__}: {E}'
+            os.remove(entry['file'])
+        return entry
+
+    print(bold_msg(f'exporting {inflect("record", len(uids))} to {folder} with {workers} workers'))
+    begin = time.time()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        list(executor.map(lookup, uids))
+
+        ## reserve the output names in the order of the uids, before anything is written
+        reserved, todo = dict(), []
+        for u in uids:
+            entry = entries[u]
+            if entry['file'] is None:
+                continue
+            if entry['file'] in reserved:
+                entry['status'] = 'conflict'
+                entry['error'] = f'same file name as {reserved[entry["file"]]}'
+                print(error_msg(f'conflict: {u}  ({os.path.basename(entry["file"])} is also the name of {reserved[entry["file"]]})'))
+                headers.pop(u, None)
+            elif os.path.isfile(entry['file']):
+                reserved[entry['file']] = u
+                entry['status'] = 'skipped'
+                headers.pop(u, None)
+            else:
+                reserved[entry['file']] = u
+                todo.append(u)
+
+        futures = [executor.submit(export_one, u) for u in todo]
+        for f in as_completed(futures):
+            entry = f.result()
+            if entry['status'] == 'failed':
+                print(error_msg(f'failed: {entry["uid"]}  ({entry["error"]})'))
+            elif entry['status'] == 'written':
+                print(whisper(f'wrote {entry["file"]}  ({entry["fetch"]:.2f} + {entry["write"]:.2f} sec)'))
+    for entry in entries.values():
+        if entry['status'] == 'failed' and entry['file'] is None:
+            print(error_msg(f'failed: {entry["uid"]}  ({entry["error"]})'))
+        entry['fetch'] = round(entry['fetch'], 3)
+
+    summary = {'catalog'     : str(catalog),
+               'folder'      : folder,
+               'workers'     : workers,
+               'connections' : connections,
+               'elapsed'     : round(time.time() - begin, 3),
+               'written'     : sum(e['status'] == 'written' for e in entries.values()),
+               'skipped'     : sum(e['status'] == 'skipped' for e in entries.values()),
+               'conflict'    : sum(e['status'] == 'conflict' for e in entries.values()),
+               'failed'      : sum(e['status'] == 'failed'  for e in entries.values()),
+               'files'       : [entries[u] for u in uids], }
+    with open(manifest, 'w') as fh:
+        json.dump(summary, fh, indent=2)
+    print(bold_msg(f'{summary["written"]} written, {summary["skipped"]} skipped, {summary["conflict"]} in conflict, {summary["failed"]} failed in {summary["elapsed"]:.1f} seconds'))
+    print(bold_msg(f'manifest: {manifest}'))
+    return summary
+
+
 
 #########################
 # -- the main XAFS scan #
@@ -662,11 +862,33 @@ def xafs(inifile=None, **kwargs):
         if 'xs' in plotting_mode(p['mode']) and BMMuser.lims is True:
             yield from dossier.capture_xrf(p['folder'], p['filename'], p['mode'], md)
 
+        ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
+        ## the XRF spectrum is measured at Eave and the photos are taken
+        ## with the mono at rest, so that their baseline readings are not
+        ## of a moving DCM.  after that the mono can rewind to the start
+        ## of the first repetition while the images are exported.  the
+        ## rewind in the loop over repetitions then has nothing left to
+        ## do unless there was an encoder loss
+        first = scan_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'],
+                          grid=p['grid'], duration=p['duration'], kweight=p['kweight'])[0]
+        emin, emax = energy_limits(dcm._crystal)
+
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## snap photos
         if p['snapshots']:
             yield from dossier.cameras(p['folder'], p['filename'], md)
 
+        rewind = None if first is None else first[0]-5
+        if rewind is not None and emin <= rewind <= emax:
+            yield from mv(dcm_bragg.acceleration, BMMuser.acc_slow)
+            print(whisper('  Rewinding DCM to %.1f eV while exporting snapshots' % rewind))
+            dcm_bragg.clear_encoder_loss()
+            yield from abs_set(dcm.energy, rewind, group='prescan')
+            dossier.wait_for_snapshots()
+            yield from wait(group='prescan')
+            yield from mv(dcm_bragg.acceleration, BMMuser.acc_fast)
+        dossier.wait_for_snapshots()
+
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## capture dossier metadata for start document
         md['_snapshots'] = {**dossier.xrf_md, **dossier.cameras_md}
@@ -771,7 +993,8 @@ def xafs(inifile=None, **kwargs):
             ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
             ## compute energy and dwell grids
             print(bold_msg('computing energy and dwell time grids'))
-            (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
+            (energy_grid, time_grid, approx_time, delta) = scan_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'],
+                                                                     grid=p['grid'], duration=p['duration'], kweight=p['kweight'])
             if plotting_mode(p['mode']) == 'xs':
                 yield from mv(xs.total_points, len(energy_grid))
             if plotting_mode(p['mode']) == 'xs1':
@@ -822,6 +1045,63 @@ def xafs(inifile=None, **kwargs):
                    level='bold', slack=True, rid=dossier.rid)
             cnt = 0
             uidlist = []
+
+            ## if BMMuser.stream_xdi is True, the XDI file is written as the data arrive
+            ## if BMMuser.ml_online is True, the data quality is scored as the data arrive
+            def scan_and_write(detectors, trajectory, callbacks, md=None):
+                callbacks = [cb for cb in callbacks if cb is not None]
+                if len(callbacks) == 0:
+                    return (yield from scan_nd(detectors, trajectory, md=md))
+                return (yield from subs_wrapper(scan_nd(detectors, trajectory, md=md), callbacks))
+
+            ## the work after each repetition is handed to the post-scan queue (see BMM/postscan.py)
+            ## so the mono rewind and the next repetition can start while it is done.  it is
+            ## given only what was recorded from this repetition, the XDI header is made on the
+            ## RunEngine thread by an XDIHeaderRecorder, since the profile will soon describe the
+            ## next repetition
+            def finish_repetition(uid, datafile, fname, scan_id, streamed, header, names, sidecar, online):
+                if not streamed:
+                    write_XDI(datafile, db[uid], sidecar=sidecar, header=header, names=names)
+                print(bold_msg('wrote %s' % datafile))
+                BMM_log_info(f'energy scan finished, uid = {uid}, scan_id = {scan_id}\ndata file written to {datafile}')
+
+                ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
+                ## data evaluation + message to Slack
+                ## also sync data with Google Drive
+                if any(md in p['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs', 'xs1', 'yield')):
+                    try:
+                        score, emoji = user_ns['clf'].evaluate(uid, mode=plotting_mode(p['mode']))
+                        report(f"ML data evaluation model: {emoji}", level='bold', slack=True)
+                        if score == 0:
+                            report(f'An {emoji} may not mean that there is anything wrong with your data. See https://tinyurl.com/yrnrhshj', level='whisper', slack=True)
+                            with open('/home/xf06bm/Data/bucket/failed_data_evaluation.txt', 'a') as f:
+                                f.write(f'{now()}\n\tmode = {p["mode"]}/{plotting_mode(p["mode"])}\n\t{uid}\n\n')
+                    except:
+                        pass
+                    if p['lims'] is True:
+                        try:
+                            if not is_re_worker_active():
+                                rsync_to_gdrive()
+                                synch_gdrive_folder()
+                        except Exception as e:
+                            print(error_msg(e))
+                            report(f'Failed to push {fname} to Google drive...', level='bold', slack=True)
+                        
+                if online is not None and online.final is not None:
+                    print(whisper(f'online data evaluation: confidence {online.final:.2f} after {len(online.en)} points' +
+                                  (', the partial spectrum was doubtful' if online.doubtful else '')))
+
+            ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
+            ## generate left sidebar text for the static html page for this scan sequence
+            def scanlist_entry(uid, fname, scan_id):
+                js_text = f'<a href="javascript:void(0)" onclick="toggle_visibility(\'{fname}\');" title="This is the scan number for {fname}, click to show/hide its UID">#{scan_id}</a><div id="{fname}" style="display:none;"><small>{uid}</small></div>'
+                ##% (fname, fname, header.start['scan_id'], fname, uid)
+                printedname = fname
+                if len(p['filename']) > 11:
+                    printedname = fname[0:6] + '&middot;&middot;&middot;' + fname[-5:]
+                return f'<li><a href="../{quote(fname)}" title="Click to see the text of {fname}">{printedname}</a>&nbsp;&nbsp;&nbsp;&nbsp;{js_text}</li>\n'
+                #                  % (quote(fname), fname, printedname, js_text)
+
             kafka_message({'xafs_sequence' : 'start',
                            'element'       : p["element"],
                            'edge'          : p["edge"],
@@ -900,7 +1180,7 @@ def xafs(inifile=None, **kwargs):
                     energy_trajectory    = cycler(dcm.energy, energy_grid[::-1])
                     dwelltime_trajectory = cycler(dwell_time, time_grid[::-1])
                     md['Mono']['direction'] = 'backward'
-                    yield from attain_energy_position(energy_grid[-1]+5)
+                    rightnow = yield from attain_energy_position_while(energy_grid[-1]+5, metadata_at_this_moment) # see metadata.py
                     #dcm_bragg.clear_encoder_loss()
                     #yield from mv(dcm.energy, energy_grid[-1]+5)
                 else:
@@ -908,13 +1188,12 @@ def xafs(inifile=None, **kwargs):
                     ## for the rewind, explicitly rewind, then reset for measurement
                     yield from mv(dcm_bragg.acceleration, BMMuser.acc_slow)
                     print(whisper('  Rewinding DCM to %.1f eV with acceleration time = %.2f sec' % (energy_grid[0]-5, dcm_bragg.acceleration.get())))
-                    yield from attain_energy_position(energy_grid[0]-5)
+                    rightnow = yield from attain_energy_position_while(energy_grid[0]-5, metadata_at_this_moment) # see metadata.py
                     #dcm_bragg.clear_encoder_loss()
                     #yield from mv(dcm.energy, energy_grid[0]-5)
                     yield from mv(dcm_bragg.acceleration, BMMuser.acc_fast)
                     print(whisper('  Resetting DCM acceleration time to %.2f sec' % dcm_bragg.acceleration.get()))
                     
-                rightnow = metadata_at_this_moment() # see metadata.py
                 for family in rightnow.keys():       # transfer rightnow to md
                     if type(rightnow[family]) is dict:
                         if family not in md:
@@ -940,6 +1219,14 @@ def xafs(inifile=None, **kwargs):
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
                 ## call the stock scan_nd plan with the correct detectors
                 uid = None
+                xdi_writer = None
+                xdi_recorder = XDIHeaderRecorder()
+                if BMMuser.stream_xdi:
+                    xdi_writer = XDIStreamWriter(datafile, sidecar=BMMuser.xdi_sidecar)
+                online = None
+                if BMMuser.ml_online and user_ns['clf'].clf is not None and \
+                   any(md in p['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs', 'xs1')):
+                    online = user_ns['clf'].online(mode=plotting_mode(p['mode']), energies=energy_grid)
                 more_kafka = {'filename': p["filename"],
                               'folder': BMMuser.folder,
                               'element': p["element"],
@@ -949,25 +1236,25 @@ def xafs(inifile=None, **kwargs):
                 kafka_message({'xafsscan': 'next',
                                'count': cnt })
                 if any(md in p['mode'] for md in ('trans', 'ref', 'yield', 'test')):
-                    uid = yield from scan_nd([quadem1], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata, 'plan_name' : f'scan_nd xafs {p["mode"]}',
-                                                 'BMM_kafka': { 'hint': f'xafs {p["mode"]}', **more_kafka }})
+                    uid = yield from scan_and_write([quadem1], energy_trajectory + dwelltime_trajectory, [xdi_writer, xdi_recorder, online],
+                                                    md={**xdi, **supplied_metadata, 'plan_name' : f'scan_nd xafs {p["mode"]}',
+                                                        'BMM_kafka': { 'hint': f'xafs {p["mode"]}', **more_kafka }})
                 elif any(md in p['mode'] for md in ('icit', 'ici0')):
-                    uid = yield from scan_nd([quadem1, ic0], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata, 'plan_name' : f'scan_nd xafs {p["mode"]}',
-                                                 'BMM_kafka': { 'hint': f'xafs {p["mode"]}', **more_kafka }})
+                    uid = yield from scan_and_write([quadem1, ic0], energy_trajectory + dwelltime_trajectory, [xdi_writer, xdi_recorder, online],
+                                                    md={**xdi, **supplied_metadata, 'plan_name' : f'scan_nd xafs {p["mode"]}',
+                                                        'BMM_kafka': { 'hint': f'xafs {p["mode"]}', **more_kafka }})
                 elif user_ns['with_xspress3'] is True and plotting_mode(p['mode']) == 'xs':
-                    uid = yield from scan_nd([quadem1, xs], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata, 'plan_name' : 'scan_nd xafs fluorescence',
-                                                 'BMM_kafka': { 'hint':  'xafs xs', **more_kafka }})
+                    uid = yield from scan_and_write([quadem1, xs], energy_trajectory + dwelltime_trajectory, [xdi_writer, xdi_recorder, online],
+                                                    md={**xdi, **supplied_metadata, 'plan_name' : 'scan_nd xafs fluorescence',
+                                                        'BMM_kafka': { 'hint':  'xafs xs', **more_kafka }})
                 elif user_ns['with_xspress3'] is True and plotting_mode(p['mode']) == 'xs1':
-                    uid = yield from scan_nd([quadem1, xs1], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata, 'plan_name' : 'scan_nd xafs fluorescence',
-                                                 'BMM_kafka': { 'hint':  'xafs xs1', **more_kafka }})
+                    uid = yield from scan_and_write([quadem1, xs1], energy_trajectory + dwelltime_trajectory, [xdi_writer, xdi_recorder, online],
+                                                    md={**xdi, **supplied_metadata, 'plan_name' : 'scan_nd xafs fluorescence',
+                                                        'BMM_kafka': { 'hint':  'xafs xs1', **more_kafka }})
                 else:
-                    uid = yield from scan_nd([quadem1, vor], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata, 'plan_name' : 'scan_nd xafs fluorescence',
-                                                 'BMM_kafka': { 'hint':  'xafs analog', **more_kafka }})
+                    uid = yield from scan_and_write([quadem1, vor], energy_trajectory + dwelltime_trajectory, [xdi_writer, xdi_recorder, online],
+                                                    md={**xdi, **supplied_metadata, 'plan_name' : 'scan_nd xafs fluorescence',
+                                                        'BMM_kafka': { 'hint':  'xafs analog', **more_kafka }})
 
                 ## here is where we would use the new SingleRunCache solution in databroker v1.0.3
                 ## see #64 at https://github.com/bluesky/tutorials
@@ -984,46 +1271,23 @@ def xafs(inifile=None, **kwargs):
                     hdf5_uid = xs.hdf5.file_name.value
                     
                 uidlist.append(uid)
-                header = db[uid]
-                write_XDI(datafile, header)
-                print(bold_msg('wrote %s' % datafile))
-                BMM_log_info(f'energy scan finished, uid = {uid}, scan_id = {header.start["scan_id"]}\ndata file written to {datafile}')
+                streamed = xdi_writer is not None and xdi_writer.failed is None
+                dossier.scanlist += scanlist_entry(uid, fname, xdi_recorder.scan_id)
+                tail.submit(f'finishing {fname}', finish_repetition, uid, datafile, fname, xdi_recorder.scan_id, streamed,
+                            xdi_recorder.header, xdi_recorder.names, BMMuser.xdi_sidecar, online)
 
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-                ## data evaluation + message to Slack
-                ## also sync data with Google Drive
-                if any(md in p['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs', 'xs1', 'yield')):
-                    try:
-                        score, emoji = user_ns['clf'].evaluate(uid, mode=plotting_mode(p['mode']))
-                        report(f"ML data evaluation model: {emoji}", level='bold', slack=True)
-                        if score == 0:
-                            report(f'An {emoji} may not mean that there is anything wrong with your data. See https://tinyurl.com/yrnrhshj', level='whisper', slack=True)
-                            with open('/home/xf06bm/Data/bucket/failed_data_evaluation.txt', 'a') as f:
-                                f.write(f'{now()}\n\tmode = {p["mode"]}/{plotting_mode(p["mode"])}\n\t{uid}\n\n')
-                    except:
-                        pass
-                    if p['lims'] is True:
-                        try:
-                            if not is_re_worker_active():
-                                rsync_to_gdrive()
-                                synch_gdrive_folder()
-                        except Exception as e:
-                            print(error_msg(e))
-                            report(f'Failed to push {fname} to Google drive...', level='bold', slack=True)
-                        
-                ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-                ## generate left sidebar text for the static html page for this scan sequence
-                js_text = f'<a href="javascript:void(0)" onclick="toggle_visibility(\'{fname}\');" title="This is the scan number for {fname}, click to show/hide its UID">#{header.start["scan_id"]}</a><div id="{fname}" style="display:none;"><small>{uid}</small></div>'
-                ##% (fname, fname, header.start['scan_id'], fname, uid)
-                printedname = fname
-                if len(p['filename']) > 11:
-                    printedname = fname[0:6] + '&middot;&middot;&middot;' + fname[-5:]
-                dossier.scanlist += f'<li><a href="../{quote(fname)}" title="Click to see the text of {fname}">{printedname}</a>&nbsp;&nbsp;&nbsp;&nbsp;{js_text}</li>\n' 
-                #                  % (quote(fname), fname, printedname, js_text)
+                ## the online evaluator can ask that the rest of the sequence be skipped,
+                ## based on its score of the complete spectrum
+                if online is not None and online.skip_requested and BMMuser.ml_abort and cnt < p['nscans']:
+                    report(f'Online data evaluation scored {fname} as bad, skipping the remaining {inflect("repetitions", p["nscans"]-cnt)}',
+                           level='bold', slack=True)
+                    break
 
 
             ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
             ## finish up, close out
+            tail.join()
             dossier.uidlist = uidlist
             dossier.seqend = now('%A, %B %d, %Y %I:%M %p')
             print('Returning to fixed exit mode') #  and returning DCM to %1.f' % eave)
@@ -1040,6 +1304,7 @@ def xafs(inifile=None, **kwargs):
     def cleanup_plan(inifile):
         print('Finishing up after an XAFS scan sequence')
         BMM_clear_suspenders()
+        tail.close()
 
         #db = user_ns['db']
         ## db[-1].stop['num_events']['primary'] should equal db[-1].start['num_points'] for a complete scan
@@ -1105,6 +1370,7 @@ def xafs(inifile=None, **kwargs):
     ######################################################################
     dossier = BMMDossier()
     dossier.measurement = 'XAFS'
+    tail = PostScanQueue(background=BMMuser.postscan_queue)
     BMMuser.final_log_entry = True
     RE.msg_hook = None
     if BMMuser.lims is False:
@@ -1195,7 +1461,8 @@ def howlong(inifile=None, interactive=True, **kwargs):
     if not ok:
         print(error_msg('\nThe following keywords are missing from your INI file: '), '%s\n' % str.join(', ', missing))
         return(orig, -1)
-    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
+    (energy_grid, time_grid, approx_time, delta) = scan_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'],
+                                                             grid=p['grid'], duration=p['duration'], kweight=p['kweight'])
     if delta == 0:
         text = f'One scan of {len(energy_grid)} points will take about {approx_time:.1f} minutes\n'
         text +=f'The sequence of {inflect("scan", p["nscans"])} will take about {approx_time * int(p["nscans"])/60:.1f} hours'
@@ -1264,7 +1531,8 @@ def xafs_grid(inifile=None, **kwargs):
     if not ok:
         print(error_msg('\nThe following keywords are missing from your INI file: '), '%s\n' % str.join(', ', missing))
         return(orig, -1)
-    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
+    (energy_grid, time_grid, approx_time, delta) = scan_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'], mode=p['mode'],
+                                                             grid=p['grid'], duration=p['duration'], kweight=p['kweight'])
     print(f'{p["element"]} {p["edge"]}')
     return(energy_grid, time_grid)
 
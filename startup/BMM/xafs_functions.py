@@ -1,7 +1,7 @@
-import os
+import os, functools
 
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
-from BMM.functions     import countdown, boxedtext, now, isfloat, inflect, e2l, etok, ktoe
+from BMM.functions     import countdown, boxedtext, now, isfloat, inflect, e2l, etok, ktoe, KTOE
 from BMM.kafka         import kafka_message
 import numpy
 
@@ -14,20 +14,24 @@ CS_TIMES      = [0.5, 0.5, '0.25k']
 CS_MULTIPLIER = 0.72
 
 
-def sanitize_step_scan_parameters(bounds, steps, times):
-    '''Attempt to identify and flag/correct some common scan parameter mistakes.'''
+def sanitize_step_scan_parameters(bounds, steps, times, adaptive=False):
+    '''Attempt to identify and flag/correct some common scan parameter mistakes.
+    With adaptive=True, only the bounds are checked, since steps and
+    times are not used by an adaptive grid.'''
     problem = False
     text = ''
+    if adaptive:
+        steps, times = [], []
 
     ############################################################################
     # bounds is one longer than steps/times, length of steps = length of times #
     ############################################################################
-    if (len(bounds) - len(steps)) != 1:
+    if not adaptive and (len(bounds) - len(steps)) != 1:
         text += error_msg('\nbounds must have one more item than steps\n')
         text += error_msg('\tbounds = "%s"\n' % ' '.join(map(str, bounds)))
         text += error_msg('\tsteps = "%s"\n'  % ' '.join(map(str, steps)))
         problem = True
-    if (len(bounds) - len(times)) != 1:
+    if not adaptive and (len(bounds) - len(times)) != 1:
         text += error_msg('\nbounds must have one more item than times\n')
         text += error_msg('\tbounds = "%s"\n' % ' '.join(map(str, bounds)))
         text += error_msg('\ttimes = "%s"\n'  % ' '.join(map(str, times)))
@@ -103,7 +107,73 @@ def sanitize_step_scan_parameters(bounds, steps, times):
     
 
 
-def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112, element=None, edge=None, ththth=False):
+@functools.lru_cache(maxsize=128)
+def _step_grid(bounds, steps, times, e0, ththth):
+    '''Build the energy and dwell time grids of a step scan as read-only
+    numpy arrays.  The arguments are tuples so that the result can be
+    memoized, see conventional_grid for their meaning.
+
+    All regions are computed at once: each point knows its region,
+    its index within the region, and whether the region is stepped in
+    energy or in wavenumber.  The points are the same as the
+    numpy.arange of each region.
+    '''
+    bounds = sorted(ktoe(float(b[:-1])) if type(b) is str else float(b) for b in bounds)
+    enot, scale = (e0/3.0, 3.0) if ththth else (e0, 1.0)
+    bounds = numpy.array(bounds) / scale
+
+    ksteps = numpy.array([type(s) is str for s in steps])
+    step   = numpy.array([float(s[:-1]) if type(s) is str else float(s) for s in steps]) / scale
+    first  = numpy.where(ksteps, etok(numpy.abs(bounds[:-1])), enot + bounds[:-1])
+    last   = numpy.where(ksteps, etok(numpy.abs(bounds[1:])), enot + bounds[1:])
+    npts   = numpy.maximum(numpy.ceil((last - first) / step), 0).astype(int)
+
+    region = numpy.repeat(numpy.arange(len(steps)), npts)
+    index  = numpy.arange(npts.sum()) - numpy.repeat(numpy.cumsum(npts) - npts, npts)
+    x      = first[region] + index * step[region]
+    energy = numpy.where(ksteps[region], enot + ktoe(x), x)
+
+    ktimes = numpy.array([type(t) is str for t in times])
+    value  = numpy.array([float(t[:-1]) if type(t) is str else float(t) for t in times])
+    dwell  = numpy.where(ktimes[region], etok(numpy.abs(energy - enot)) * value[region], value[region])
+
+    grid, timegrid = numpy.round(energy, decimals=2), numpy.round(dwell, decimals=2)
+    grid.flags.writeable, timegrid.flags.writeable = False, False
+    return grid, timegrid
+
+
+def estimate_scan_time(grid, timegrid, element=None, mode=None):
+    '''Return (approximate_time, delta) in minutes for one scan on an
+    energy and dwell time grid.
+
+    When a mode is given and the telemetry overhead model beats the
+    per-element average overhead per point (see
+    BMMTelemetry.fit_overhead_model), the overhead is computed point
+    by point from the mono moves, dwell times, and detector.
+    Otherwise the average overhead per point for the element is used.
+    '''
+    tele = user_ns['tele']
+    estimate = None
+    if mode is not None:
+        d_spacing = user_ns['dcm']._twod/2 if 'dcm' in user_ns else 3.1356
+        estimate = tele.estimate_overhead(grid, timegrid, mode=mode, d_spacing=d_spacing)
+    if estimate is not None:
+        (overhead, uncertainty) = estimate
+        approximate_time = (sum(timegrid) + overhead + user_ns['BMMuser'].tweak_xas_time) / 60.0
+        delta = uncertainty / 60.0
+        return (approximate_time, delta)
+
+    if element is not None:
+        overhead, uncertainty, maxdpp, mindpp = tele.overhead_per_point(element) #, edge)
+    else:
+        overhead, uncertainty = tele.average()
+
+    approximate_time = (sum(timegrid) + float(len(timegrid))*overhead + user_ns['BMMuser'].tweak_xas_time) / 60.0
+    delta = float(len(timegrid))*uncertainty / 60.0
+    return (approximate_time, delta)
+
+
+def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112, element=None, edge=None, ththth=False, mode=None):
     '''
     Parameters
     ----------
@@ -117,12 +187,14 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
         edge energy, reference for boundary values
     ththth : Boolean
         using the Si(333) reflection
+    mode : str
+        measurement mode, used by the per-point overhead model
 
     Output
     ------
-    grid : list
+    grid : numpy array
         absolute energy values
-    timegrid : list
+    timegrid : numpy array
         integration times
     approximate_time : float
         a very crude estimate of how long in minutes the scan will take
@@ -135,6 +207,9 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
     be converted from wavenumber to energy.  E.g. '14k' will be
     converted to 746.75 eV, i.e. that much above the edge energy.
 
+    The time estimate is made by estimate_scan_time, see there for the
+    use of mode.
+
     Step values are either in eV units (floats) or wavenumber units
     (strings).  Again, wavenumber values will be converted to energy
     steps as appropriate.  For example, '0.05k' will be converted into
@@ -148,6 +223,10 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
     So at 5 invAng, integrate for 2.5 seconds.  At 10 invAng,
     integrate for 5 seconds.
 
+    The grids are memoized on (bounds, steps, times, e0, ththth), so
+    howlong, the macro builders, and xafs do not recompute them.  The
+    arguments are not modified.
+
     Examples
     --------
     this is the default (same as (g,it,at) = conventional_grid()):
@@ -174,51 +253,144 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
     >>>                                           steps=[0.25,],
     >>>                                           times=[0.5,], e0=7112)
     '''
-    tele = user_ns['tele']
-    
     if (len(bounds) - len(steps)) != 1:
-        return (None, None, None)
+        return (None, None, None, None)
     if (len(bounds) - len(times)) != 1:
-        return (None, None, None)
-    for i,s in enumerate(bounds):
-        if type(s) is str:
-            this = float(s[:-1])
-            bounds[i] = ktoe(this)
-    bounds.sort()
-
-    enot = e0
-    if ththth:
-        enot = e0/3.0
-        bounds = list(numpy.array(bounds)/3)
-    grid = list()
-    timegrid = list()
-    for i,s in enumerate(steps):
-        if type(s) is str:
-            step = float(s[:-1])
-            if ththth: step = step/3.
-            ar = enot + ktoe(numpy.arange(etok(bounds[i]), etok(bounds[i+1]), step))
-        else:
-            step = steps[i]
-            if ththth: step = step/3.
-            ar = numpy.arange(enot+bounds[i], enot+bounds[i+1], step)
-        grid = grid + list(ar)
-        grid = list(numpy.round(grid, decimals=2))
-        if type(times[i]) is str:
-            tar = etok(ar-enot)*float(times[i][:-1])
-        else:
-            tar = times[i]*numpy.ones(len(ar))
-        timegrid = timegrid + list(tar)
-        timegrid = list(numpy.round(timegrid, decimals=2))
+        return (None, None, None, None)
+    grid, timegrid = _step_grid(tuple(bounds), tuple(steps), tuple(times), e0, bool(ththth))
+    grid, timegrid = grid.copy(), timegrid.copy()
 
-    if element is not None:
-        overhead, uncertainty, maxdpp, mindpp = tele.overhead_per_point(element) #, edge)
-    else:
-        overhead, uncertainty = tele.average()
+    approximate_time, delta = estimate_scan_time(grid, timegrid, element=element, mode=mode)
+    return (grid, timegrid, approximate_time, delta)
 
-    approximate_time = (sum(timegrid) + float(len(timegrid))*overhead + user_ns['BMMuser'].tweak_xas_time) / 60.0
-    delta = float(len(timegrid))*uncertainty / 60.0
+
+def energy_limits(crystal='111'):
+    """Return the lowest and highest mono energies for a crystal set,
+    the same limits as are checked by xafs()."""
+    if crystal == '311':
+        return (5500, 23500)
+    return (2900, 21200)
+
+
+def adaptive_grid(bounds=CS_BOUNDS, e0=7112, duration=20, kweight=2, element=None, edge=None, ththth=False, mode=None,
+                  prestep=10, edgestep=0.5, kstep=0.05, mindwell=0.5, maxdwell=20, crystal=None):
+    '''
+    Compute an energy and dwell time grid with a smoothly varying step
+    size and a k-weighted dwell time which fits in a given amount of
+    time.
+
+    Parameters
+    ----------
+    bounds : list of float or str
+        only the first and last values are used, the start and end of
+        the scan relative to e0, the end may be in wavenumber, e.g. '14k'
+    e0 : float
+        edge energy
+    duration : float
+        target time in minutes for one scan, including overhead
+    kweight : float
+        k-weight w, the dwell time is proportional to k^(2w) so that
+        the statistical noise in k^w * chi(k) is the same at every point
+    element, edge, mode : str
+        used for the time estimate, see estimate_scan_time
+    ththth : Boolean
+        using the Si(333) reflection
+    prestep : float
+        step size in eV far below the edge [10]
+    edgestep : float
+        step size in eV through the edge [0.5]
+    kstep : float
+        step size in inverse Angstroms in the EXAFS [0.05]
+    mindwell, maxdwell : float
+        limits on the dwell time at a point in seconds [0.5, 20]
+    crystal : str
+        '111' or '311', default is the crystal set in use
+
+    Output
+    ------
+    grid, timegrid, approximate_time, delta
+        as for conventional_grid
+
+    The step size goes smoothly from prestep far below the edge to
+    edgestep from 10 eV below the edge, and from edgestep to the
+    energy equivalent of kstep above the edge, where that is larger.
+    The grid is spaced so that the step size changes from point to
+    point, with no discontinuities between regions.
+
+    Every point below k0 (the wavenumber at which kstep becomes larger
+    than edgestep) gets the same dwell time, which rises as
+    (k/k0)^(2w) above k0.  That dwell time is scaled so that the
+    estimated time of the scan is duration minutes, within the
+    mindwell and maxdwell limits.  If the grid cannot be measured in
+    duration minutes even at mindwell, the estimate will exceed it.
+
+    A grid which would reach beyond the energy range of the mono is
+    truncated at the end of the range.
+
+    Examples
+    --------
+    a 20 minute scan, k^2 weighted, to 14 inverse Angstrom above the Fe K edge
+
+    >>> (grid, inttime, time, delta) = adaptive_grid(bounds=[-200, '14k'], e0=7112, duration=20, kweight=2)
+    '''
+    first = float(bounds[0][:-1]) if type(bounds[0]) is str else float(bounds[0])
+    last  = ktoe(float(bounds[-1][:-1])) if type(bounds[-1]) is str else float(bounds[-1])
+    if last <= first:
+        return (None, None, None, None)
+
+    if crystal is None:
+        crystal = user_ns['dcm']._crystal if 'dcm' in user_ns else '111'
+    low, high = energy_limits(crystal)
+    scale = 3.0 if ththth else 1.0
+    if e0 + first < low*scale:
+        print(warning_msg(f'adaptive grid starts at {low*scale:.0f} eV, the lower limit of the Si({crystal}) mono'))
+        first = low*scale - e0
+    if e0 + last > high*scale:
+        print(warning_msg(f'adaptive grid ends at {high*scale:.0f} eV, the upper limit of the Si({crystal}) mono'))
+        last = high*scale - e0
+
+    ## step size on a fine mesh, count points by integrating 1/step, place a point at each whole number
+    mesh  = numpy.linspace(first, last, 20001)
+    x     = numpy.clip((-mesh - 10) / 40, 0, 1)     # 0 within 10 eV of the edge, 1 beyond 50 eV below it
+    below = edgestep + (prestep - edgestep) * x*x*(3 - 2*x)
+    above = numpy.maximum(edgestep, 2 * KTOE * etok(numpy.clip(mesh, 0, None)) * kstep)
+    step  = numpy.where(mesh < 0, below, above)
+    count = numpy.concatenate(([0], numpy.cumsum(numpy.diff(mesh) * 0.5 * (1/step[1:] + 1/step[:-1]))))
+    relative = numpy.interp(numpy.arange(0, count[-1]), count, mesh)
+
+    ## dwell time is flat to k0 then goes as (k/k0)^2w, scaled to fit the duration
+    k0     = edgestep / (2 * KTOE * kstep)
+    k      = etok(numpy.clip(relative, 0, None))
+    shape  = numpy.maximum(k/k0, 1)**(2*kweight)
+    grid   = numpy.round((e0 + relative) / scale, decimals=2)
+    def timegrid_for(t0):
+        return numpy.round(numpy.clip(t0*shape, mindwell, maxdwell), decimals=2)
+    target = duration * 60
+    lo, hi = 0.0, maxdwell
+    for i in range(40):
+        t0 = (lo + hi) / 2
+        approximate_time, delta = estimate_scan_time(grid, timegrid_for(t0), element=element, mode=mode)
+        if approximate_time*60 > target:
+            hi = t0
+        else:
+            lo = t0
+    timegrid = timegrid_for(lo)
+    approximate_time, delta = estimate_scan_time(grid, timegrid, element=element, mode=mode)
+    if approximate_time*60 > target*1.01:
+        print(warning_msg(f'{len(grid)} points take about {approximate_time:.1f} minutes at the shortest dwell time, longer than {duration} minutes'))
     return (grid, timegrid, approximate_time, delta)
 
+
+def scan_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112, element=None, edge=None, ththth=False, mode=None,
+              grid='conventional', duration=None, kweight=2):
+    '''Compute the energy and dwell time grids with conventional_grid or,
+    if grid is "adaptive", with adaptive_grid, in which case steps and
+    times are not used.  Returns (grid, timegrid, approximate_time, delta).'''
+    if str(grid).lower() == 'adaptive':
+        return adaptive_grid(bounds, e0=e0, duration=duration or 20, kweight=kweight, element=element, edge=edge, ththth=ththth, mode=mode)
+    return conventional_grid(bounds, steps, times, e0=e0, element=element, edge=edge, ththth=ththth, mode=mode)
+
+
 ## -----------------------
 ##  energy step scan plan concept
 ##  1. collect metadata from an INI file
@@ -1,7 +1,10 @@
 from bluesky import __version__ as bluesky_version
+from bluesky.callbacks import CallbackBase
 import re, pathlib, sys, datetime, pandas, numpy
+from collections import namedtuple
 
-from BMM.functions import plotting_mode
+from BMM.functions import plotting_mode, error_msg
+from BMM.sidecar   import write_sidecar
 
 from BMM import user_ns as user_ns_module
 user_ns = vars(user_ns_module)
@@ -55,6 +58,7 @@ class metadata_for_XDI_file():
     def __init__(self):
         self.xdilist = []
         self.dataframe = None
+        self.start = dict()
 
     def insert_line(self, line):
         '''Insert a line directly into the list of header lines. Presumably,
@@ -77,7 +81,7 @@ class metadata_for_XDI_file():
 
             'XDI.Beamline.name'
 
-        indicating that db[key].start['XDI']['Beamline']['name'] is
+        indicating that start['XDI']['Beamline']['name'] is
         the correct value from the start document to use.  The string
         is split along the dots and the substrings are used as dictionary
         keys in the start document.
@@ -87,7 +91,7 @@ class metadata_for_XDI_file():
         text = ''
         (group,family,key) = datum.split('.') # e.g. XDI.Beamline.name
         try:
-            text = template % self.dataframe.start[group][family][key]
+            text = template % self.start[group][family][key]
         except:
             if '%s' in template:
                 text = template % ''
@@ -97,38 +101,72 @@ class metadata_for_XDI_file():
 
 
 
-def write_XDI(datafile, dataframe):
-    BMMuser, xafs_wheel, ga = user_ns['BMMuser'], user_ns['xafs_wheel'], user_ns['ga']
+def write_XDI(datafile, dataframe, sidecar=False, header=None, names=None):
+    '''Write an XDI file from a run, after the fact.
+
+    datafile is the output file name and dataframe is the run as
+    returned by db[uid].  If sidecar is True, also write the data
+    columns to a binary sidecar file (see BMM/sidecar.py).
+
+    header is (lines, mode, kind) as returned by xdi_header and names
+    is a snapshot of the detector channel names as returned by
+    xdi_column_names.  Both are made from the current state of the
+    profile when they are None.  Pass them, as recorded by an
+    XDIHeaderRecorder, when the file is written after the state of
+    the profile may have changed.
+    '''
+    if header is None:
+        baseline, table = dict(), dataframe.table('baseline')
+        if len(table) > 0:
+            baseline = dict(table.iloc[0])
+        header = xdi_header(dataframe.start, baseline, end=dataframe.stop['time'])
+    (lines, mode, kind) = header
+
     handle = open(datafile, 'w')
+    for line in lines:
+        handle.write(line + '\n')
+    table = dataframe.table()
+    column_list, template = xdi_data_columns(table, mode, kind, names=names)
+    handle.write(xdi_data_block(table.loc[:,column_list], template, kind))
+    handle.flush()
+    handle.close()
+    if sidecar:
+        write_sidecar(datafile, table.loc[:,column_list], dataframe.start, dataframe.stop)
 
-    ## set Scan.start_time & Scan.end_time ... this is how it is done
-    d=datetime.datetime.fromtimestamp(round(dataframe.start['time']))
-    start_time = datetime.datetime.isoformat(d)
-    d=datetime.datetime.fromtimestamp(round(dataframe.stop['time']))
-    end_time   = datetime.datetime.isoformat(d)
-    st = pandas.Timestamp(start_time) # this is a UTC problem
-
-    ##################################
-    # grab the "underscore" metadata #
-    ##################################
+
+def xdi_time(stamp):
+    '''Format a unix time stamp as it appears in the XDI Scan.start_time
+    and Scan.end_time lines.'''
+    d=datetime.datetime.fromtimestamp(round(stamp))
+    return datetime.datetime.isoformat(d)
+
+
+def xdi_underscore_metadata(start):
+    '''Grab the "underscore" metadata from a start document.
+
+    Returns (mode, comment, kind).
+    '''
     try:
-        mode = dataframe.start['XDI']['_mode'][0]
+        mode = start['XDI']['_mode'][0]
     except:
         mode = 'transmission'
 
     try:
-        comment = dataframe.start['XDI']['_comment'][0]
+        comment = start['XDI']['_comment'][0]
     except:
         comment = ''
 
     try:
-        kind = dataframe.start['XDI']['_kind']
+        kind = start['XDI']['_kind']
     except:
         kind = 'xafs'
+    return mode, comment, kind
+
 
-    ##########################
-    # grab the detector list #
-    ##########################
+def xdi_detectors(mode):
+    '''Return the list of detector signals written to an XDI file
+    measured in mode.'''
+    BMMuser = user_ns['BMMuser']
     mm = plotting_mode(mode)
     if 'trans' in mm:
         detectors = transmission
@@ -148,14 +186,59 @@ def write_XDI(datafile, dataframe):
         detectors = fluorescence
         if BMMuser.detector == 1:
             detectors = fluorescence_1ch
-            
-        
+    return detectors
+
+
+def xdi_plot_hint(mode, kind='xafs'):
+    '''Return the Scan.plot_hint text for data measured in mode.'''
+    BMMuser = user_ns['BMMuser']
+    plot_hint = 'ln(I0/It)  --  ln($5/$6)'
+    if kind == 'sead': plot_hint = 'ln(I0/It)  --  ln($3/$4)'
+    mm = plotting_mode(mode)
+    if mm == 'xs1':
+        plot_hint = f'{BMMuser.xs8}/I0  --  $8/$5'
+    elif mm == 'xs' and type == 'sead':
+        plot_hint = f'({BMMuser.xs1}+{BMMuser.xs2}+{BMMuser.xs3}+{BMMuser.xs4})/I0  --  ($5+$6+$7+$8)/$5'
+    elif mm == 'xs':
+        plot_hint = f'({BMMuser.xs1}+{BMMuser.xs2}+{BMMuser.xs3}+{BMMuser.xs4})/I0  --  ($8+$9+$10+$11)/$5'
+    elif 'fluo' in mode or 'flou' in mode or 'both' in mode:
+        plot_hint = '(%s + %s + %s + %s) / I0  --  ($8+$9+$10+$11) / $5' % (BMMuser.dtc1, BMMuser.dtc2, BMMuser.dtc3, BMMuser.dtc4)
+        if kind == 'sead': plot_hint = '(%s + %s + %s) / I0  --  ($6+$7+$9) / $3' % (BMMuser.dtc1, BMMuser.dtc2, BMMuser.dtc4)
+        if BMMuser.detector == 1: plot_hint = '%s / I0  --  ($8+$9+$10+$11) / $5' % BMMuser.dtc1
+    elif 'yield' in mode:
+        plot_hint = 'Iy/I0  --  $8/$5'
+    elif 'test' in mode:
+        plot_hint = 'I0  --  $2'
+    elif 'ref' in mode:
+        plot_hint = 'ln(It/Ir)  --  ln($6/$7)'
+    return plot_hint
+
+
+def xdi_header(start, baseline, end=None):
+    '''Generate the header of an XDI file.
+
+    start is the start document of the run, baseline is a dict of the
+    first baseline reading, and end is the unix time stamp of the stop
+    document.  If the run has not ended, end is None and the start
+    time is used as a placeholder for Scan.end_time.
+
+    Returns (lines, mode, kind), where lines is the list of header
+    lines, ending with the line of column labels, and mode and kind
+    are from the underscore metadata of the start document.
+    '''
+    BMMuser, xafs_wheel, ga = user_ns['BMMuser'], user_ns['xafs_wheel'], user_ns['ga']
+
+    ## set Scan.start_time & Scan.end_time ... this is how it is done
+    start_time = xdi_time(start['time'])
+    end_time   = start_time if end is None else xdi_time(end)
+    (mode, comment, kind) = xdi_underscore_metadata(start)
+    detectors = xdi_detectors(mode)
 
     ############################################
     # start gathering formatted metadata lines #
     ############################################
     metadata = metadata_for_XDI_file()
-    metadata.dataframe = dataframe
+    metadata.start = start
 
     ## snarf XDI metadata from the dataframe and elsewhere
     metadata.insert_line('# XDI/1.0 BlueSky/%s BMM/%s' % (bluesky_version, pathlib.Path(sys.executable).parts[-3]))
@@ -217,23 +300,23 @@ def write_XDI(datafile, dataframe):
     XDI_record = user_ns['XDI_record']
     for r in XDI_record.keys():
         if XDI_record[r][0] is True:
-            if r in dataframe.table('baseline'):
-                metadata.insert_line('# %s: %.3f mm' % (XDI_record[r][1], dataframe.table('baseline')[r][1]))
+            if r in baseline:
+                metadata.insert_line('# %s: %.3f mm' % (XDI_record[r][1], baseline[r]))
     
     metadata.start_doc('# Scan.experimenters: %s', 'XDI.Scan.experimenters')
     metadata.start_doc('# Scan.edge_energy: %s',   'XDI.Scan.edge_energy')
 
     if kind == '333':
         try:
-            ththth_energy = dataframe.start['XDI']['Scan']['edge_energy'] / 3.0
+            ththth_energy = start['XDI']['Scan']['edge_energy'] / 3.0
             metadata.insert_line('# Scan.edge_energy_333: %.1f'  % ththth_energy)
         except:
             pass
 
     metadata.insert_line('# Scan.start_time: %s'   % start_time)
     metadata.insert_line('# Scan.end_time: %s'     % end_time)
-    metadata.insert_line('# Scan.transient_id: %s' % dataframe.start['scan_id'])
-    metadata.insert_line('# Scan.uid: %s'          % dataframe.start['uid'])
+    metadata.insert_line('# Scan.transient_id: %s' % start['scan_id'])
+    metadata.insert_line('# Scan.uid: %s'          % start['uid'])
 
     if kind == 'sead':
         metadata.start_doc('# Beamline.energy: %.3f eV',      'XDI.Beamline.energy')
@@ -244,25 +327,7 @@ def write_XDI(datafile, dataframe):
     ###############################
     # plot hint and column labels #
     ###############################
-    plot_hint = 'ln(I0/It)  --  ln($5/$6)'
-    if kind == 'sead': plot_hint = 'ln(I0/It)  --  ln($3/$4)'
-    mm = plotting_mode(mode)
-    if mm == 'xs1':
-        plot_hint = f'{BMMuser.xs8}/I0  --  $8/$5'
-    elif mm == 'xs' and type == 'sead':
-        plot_hint = f'({BMMuser.xs1}+{BMMuser.xs2}+{BMMuser.xs3}+{BMMuser.xs4})/I0  --  ($5+$6+$7+$8)/$5'
-    elif mm == 'xs':
-        plot_hint = f'({BMMuser.xs1}+{BMMuser.xs2}+{BMMuser.xs3}+{BMMuser.xs4})/I0  --  ($8+$9+$10+$11)/$5'
-    elif 'fluo' in mode or 'flou' in mode or 'both' in mode:
-        plot_hint = '(%s + %s + %s + %s) / I0  --  ($8+$9+$10+$11) / $5' % (BMMuser.dtc1, BMMuser.dtc2, BMMuser.dtc3, BMMuser.dtc4)
-        if kind == 'sead': plot_hint = '(%s + %s + %s) / I0  --  ($6+$7+$9) / $3' % (BMMuser.dtc1, BMMuser.dtc2, BMMuser.dtc4)
-        if BMMuser.detector == 1: plot_hint = '%s / I0  --  ($8+$9+$10+$11) / $5' % BMMuser.dtc1
-    elif 'yield' in mode:
-        plot_hint = 'Iy/I0  --  $8/$5'
-    elif 'test' in mode:
-        plot_hint = 'I0  --  $2'
-    elif 'ref' in mode:
-        plot_hint = 'ln(It/Ir)  --  ln($6/$7)'
+    plot_hint = xdi_plot_hint(mode, kind)
     metadata.insert_line('# Scan.plot_hint: %s' % plot_hint)
     labels = []
     abscissa_columns = ('energy', 'requested_energy', 'measurement_time', 'xmu')
@@ -287,17 +352,36 @@ def write_XDI(datafile, dataframe):
         labels.append(this)
         metadata.insert_line('# Column.%d: %s %s' % (i, this, units(this)))
 
-    ####################
-    # write it all out #
-    ####################
-    eol = '\n'
-    for line in metadata.xdilist:
-        handle.write(line + eol)
-    handle.write('# ///////////' + eol)
-    handle.write('# ' + comment + eol)
-    handle.write('# -----------' + eol)
-    handle.write('# ' + '  '.join(labels) + eol)
-    table = dataframe.table()
+    lines = metadata.xdilist + ['# ///////////', '# ' + comment, '# -----------', '# ' + '  '.join(labels)]
+    return lines, mode, kind
+
+
+XDIColumnNames = namedtuple('XDIColumnNames', ('xs1', 'xs2', 'xs3', 'xs4', 'xs8',
+                                               'dtc1', 'dtc2', 'dtc3', 'dtc4',
+                                               'roi1', 'roi2', 'roi3', 'roi4', 'detector'))
+
+def xdi_column_names():
+    '''Return an XDIColumnNames with the detector channel names and the
+    number of fluorescence channels from BMMuser, as used by
+    xdi_data_columns.'''
+    BMMuser = user_ns['BMMuser']
+    return XDIColumnNames(*(getattr(BMMuser, name) for name in XDIColumnNames._fields))
+
+
+def xdi_data_columns(table, mode, kind='xafs', names=None):
+    '''Choose the data columns and the row template for an XDI file.
+
+    The xmu column (and the 333_energy column for a Si(333)
+    measurement) is computed and added to table, which is a pandas
+    DataFrame like the one returned by dataframe.table().  The
+    detector channel names are from names, an XDIColumnNames, or from
+    BMMuser when names is None.
+
+    Returns (column_list, template) where column_list is the list of
+    table columns to write and template is the %-format string for
+    one row of data.
+    '''
+    BMMuser = user_ns['BMMuser'] if names is None else names
     if plotting_mode(mode) == 'xs1':
         table['xmu'] = table[BMMuser.xs8] / table['I0']
         column_list = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'xmu', 'I0', 'It', 'Ir']
@@ -374,16 +458,210 @@ def write_XDI(datafile, dataframe):
             template = "  %.3f  %.6f  %.6f  %.6f\n"
     if kind == 'sead':
         column_list.insert(0, 'time')
-    this = table.loc[:,column_list]
-
-    for i in range(0,len(this)):
-        datapoint = list(this.iloc[i])
-        if kind == 'sead':
-            ti = this.iloc[i, 0]
-            st = this.iloc[0, 0]
-            elapsed =  (ti.value - st.value)/10**9
-            datapoint[0] = elapsed
-        handle.write(template % tuple(datapoint))
-        #handle.write(template % tuple(this.iloc[i]))
-    handle.flush()
-    handle.close()
+    return column_list, template
+
+
+def xdi_data_block(this, template, kind='xafs', t0=None):
+    '''Format the entire data section of an XDI file in one go.
+
+    this is the DataFrame of columns to write, in order, and template
+    is the %-format string for one row, as returned by
+    xdi_data_columns.  For a SEAD scan, the first column is the event
+    time, which is written as seconds elapsed since t0, the time of
+    the first point in nanoseconds.  t0 defaults to the first row of
+    this.
+
+    The data block is made by converting the table to a float array,
+    then applying the row template repeated for every row to the
+    flattened array.  This gives the same text as formatting the
+    table row-by-row with template, but without the per-row overhead
+    of iloc.
+    '''
+    npts = len(this)
+    if npts == 0:
+        return ''
+    if kind == 'sead':
+        ti = this.iloc[:, 0].to_numpy(dtype='datetime64[ns]').view('int64')
+        if t0 is None:
+            t0 = ti[0]
+        elapsed = (ti - t0) / 10**9
+        values = numpy.column_stack((elapsed, this.iloc[:, 1:].to_numpy(dtype=float)))
+    else:
+        values = this.to_numpy(dtype=float)
+    return (template * npts) % tuple(values.ravel().tolist())
+
+
+class XDIStreamWriter(CallbackBase):
+    '''A callback which writes an XDI file as the run happens.
+
+    The file is opened at the start document.  The header is written
+    from the start document and the first baseline reading (or at the
+    first primary event, if there is no baseline).  Each primary event
+    is then formatted and appended to the file, so the data measured
+    up to that point survive an aborted scan.  At the stop document,
+    Scan.end_time is filled in and the file is closed.
+
+    The header, column, and plot_hint choices are the same as for
+    write_XDI.  If sidecar is True, the binary sidecar is written at
+    the stop document.
+
+    An exception while writing does not interrupt the scan.  It is
+    printed and kept as the failed attribute, the file is closed, and
+    the rest of the run is ignored.  When failed is not None, write the
+    file after the scan with write_XDI.
+
+      writer = XDIStreamWriter('/path/to/datafile.001')
+      uid = yield from subs_wrapper(scan_nd(...), writer)
+
+    '''
+    def __init__(self, datafile, sidecar=False):
+        super().__init__()
+        self.datafile    = datafile
+        self.sidecar     = sidecar
+        self.rows        = []
+        self.handle      = None
+        self.start_doc   = None
+        self.scan_id     = None
+        self.descriptors = dict()
+        self.mode        = 'transmission'
+        self.kind        = 'xafs'
+        self.t0          = None
+        self.end_offset  = None
+        self.npoints     = 0
+        self.failed      = None
+
+    def __call__(self, name, doc):
+        if self.failed is not None:
+            return
+        try:
+            return super().__call__(name, doc)
+        except Exception as E:
+            self.failed = E
+            print(error_msg(f'streaming {self.datafile} failed at a {name} document ({type(E).__name__}: {E}), it will be written after the scan'))
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+    def start(self, doc):
+        self.handle      = open(self.datafile, 'w')
+        self.start_doc   = doc
+        self.scan_id     = doc['scan_id']
+        self.descriptors = dict()
+        self.t0          = None
+        self.end_offset  = None
+        self.npoints     = 0
+        self.rows        = []
+
+    def write_header(self, baseline):
+        (lines, self.mode, self.kind) = xdi_header(self.start_doc, baseline)
+        for line in lines:
+            if line.startswith('# Scan.end_time: '):
+                ## remember where the end time goes, it gets filled in at the stop document
+                self.handle.write('# Scan.end_time: ')
+                self.end_offset = self.handle.tell()
+                line = line[len('# Scan.end_time: '):]
+            self.handle.write(line + '\n')
+        self.handle.flush()
+
+    def descriptor(self, doc):
+        self.descriptors[doc['uid']] = doc['name']
+
+    def event(self, doc):
+        if self.handle is None:
+            return
+        stream = self.descriptors.get(doc['descriptor'])
+        if stream == 'baseline' and self.npoints == 0 and self.end_offset is None:
+            self.write_header(doc['data'])
+        if stream != 'primary':
+            return
+        if self.end_offset is None:
+            self.write_header(dict())
+        row = pandas.DataFrame([doc['data']])
+        if self.kind == 'sead':
+            row.insert(0, 'time', pandas.to_datetime([doc['time']], unit='s'))
+            if self.t0 is None:
+                self.t0 = row['time'].to_numpy(dtype='datetime64[ns]').view('int64')[0]
+        column_list, template = xdi_data_columns(row, self.mode, self.kind)
+        self.handle.write(xdi_data_block(row.loc[:,column_list], template, self.kind, t0=self.t0))
+        self.handle.flush()
+        self.npoints += 1
+        if self.sidecar:
+            self.rows.append(row.loc[:,column_list])
+
+    def stop(self, doc):
+        if self.handle is None:
+            return
+        if self.end_offset is None:
+            self.write_header(dict())
+        self.handle.seek(self.end_offset)
+        self.handle.write(xdi_time(doc['time']))
+        self.handle.flush()
+        self.handle.close()
+        self.handle = None
+        if self.sidecar and len(self.rows) > 0:
+            write_sidecar(self.datafile, pandas.concat(self.rows, ignore_index=True), self.start_doc, doc)
+        self.rows = []
+
+
+class XDIHeaderRecorder(CallbackBase):
+    '''A callback which makes the header of an XDI file as the run
+    happens, for a file which is written later with write_XDI.
+
+    xdi_header reads the sample stage, the detectors, and the XDI
+    record from the profile.  When the file is written on another
+    thread after the scan, that state may already belong to the next
+    scan.  This records the start document and the first baseline
+    reading.  At the stop document, on the RunEngine thread, it sets
+
+      header : (lines, mode, kind) from xdi_header, with lines a tuple
+      names  : the detector channel names, from xdi_column_names
+
+    Both are immutable and are passed on to write_XDI.
+
+    An exception is printed and kept as the failed attribute, header
+    and names stay None, and write_XDI then uses the state of the
+    profile when the file is written.
+
+      recorder = XDIHeaderRecorder()
+      uid = yield from subs_wrapper(scan_nd(...), recorder)
+      write_XDI(datafile, db[uid], header=recorder.header, names=recorder.names)
+
+    '''
+    def __init__(self):
+        super().__init__()
+        self.start_doc   = None
+        self.scan_id     = None
+        self.baseline    = None
+        self.descriptors = dict()
+        self.header      = None
+        self.names       = None
+        self.failed      = None
+
+    def __call__(self, name, doc):
+        if self.failed is not None:
+            return
+        try:
+            return super().__call__(name, doc)
+        except Exception as E:
+            self.failed = E
+            print(error_msg(f'recording the XDI header failed at a {name} document ({type(E).__name__}: {E}), it will be made when the file is written'))
+
+    def start(self, doc):
+        self.start_doc   = doc
+        self.scan_id     = doc['scan_id']
+        self.baseline    = None
+        self.descriptors = dict()
+        self.header      = None
+        self.names       = None
+
+    def descriptor(self, doc):
+        self.descriptors[doc['uid']] = doc['name']
+
+    def event(self, doc):
+        if self.baseline is None and self.descriptors.get(doc['descriptor']) == 'baseline':
+            self.baseline = dict(doc['data'])
+
+    def stop(self, doc):
+        (lines, mode, kind) = xdi_header(self.start_doc, self.baseline or dict(), end=doc['time'])
+        self.header = (tuple(lines), mode, kind)
+        self.names  = xdi_column_names()
@@ -0,0 +1,15 @@
+'''Measurement harnesses for the performance work in the BMM profile.
+
+Each module times a part of the profile, mostly on synthetic data so
+that it can be run away from the beamline, and prints a comparison.
+None of this is used by the profile itself.  In bsui:
+
+   from benchmarks.xdi import benchmark_xdi_data_block
+   benchmark_xdi_data_block()
+
+   from benchmarks.derivedplot  import derivedplot_benchmark
+   from benchmarks.dwelltime    import dwell_time_benchmark
+   from benchmarks.evaluation   import evaluation_benchmark
+   from benchmarks.telemetry    import benchmark
+
+'''
@@ -0,0 +1,40 @@
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+from BMM.derivedplot import DerivedPlot
+
+
+def derivedplot_benchmark(npoints=2000, max_fps=10, interval=0.0):
+    '''Measure the time spent in the DerivedPlot callback per event for
+    a synthetic scan of npoints events, with redraws capped at max_fps
+    and with the whole figure redrawn at every event (max_fps=None).
+    The events are sent interval seconds apart, by default as fast as
+    possible, which is the worst case for the RunEngine.
+
+    Returns a dict of {max_fps: (mean ms per event, max ms per event, redraws)}.
+    '''
+    energy = np.linspace(-200, 1000, npoints) + 7112
+    mu     = np.arctan((energy-7112)/5) + 0.1*np.sin((energy-7112)/30)*(energy > 7112)
+    results = {}
+    for fps in (max_fps, None):
+        plot = DerivedPlot(lambda doc: (doc['data']['energy'], doc['data']['mu']),
+                           xlabel='energy (eV)', ylabel='mu', title=f'max_fps = {fps}', max_fps=fps)
+        plot.start({'uid': f'benchmark-{fps}', 'scan_id': 0, 'time': time.time()})
+        plot.descriptor({'uid': 'descriptor', 'name': 'primary'})
+        costs = np.empty(npoints)
+        for i in range(npoints):
+            doc = {'descriptor': 'descriptor', 'seq_num': i+1, 'time': time.time(),
+                   'data': {'energy': energy[i], 'mu': mu[i]}, 'timestamps': {}}
+            start = time.perf_counter()
+            plot.event(doc)
+            costs[i] = time.perf_counter() - start
+            if interval > 0:
+                time.sleep(interval)
+        plot.stop({'uid': 'stop', 'exit_status': 'success'})
+        if len(plot.x_data) != npoints:
+            raise RuntimeError(f'DerivedPlot kept {len(plot.x_data)} of {npoints} events')
+        results[fps] = (1000*costs.mean(), 1000*costs.max(), dict(plot.redraws))
+        print(f'max_fps = {str(fps):5s}  {results[fps][0]:7.3f} ms per event (max {results[fps][1]:.1f} ms)  redraws: {plot.redraws}')
+        plt.close(plot.ax.figure)
+    return results
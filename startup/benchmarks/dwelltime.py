@@ -0,0 +1,83 @@
+import threading, time
+
+from ophyd import SoftPositioner
+from ophyd import Component as Cpt
+
+from BMM.dwelltime import DwellTimes
+
+
+class SimulatedDwellChain(SoftPositioner):
+    '''A soft signal chain which takes latency seconds to accept a new
+    dwell time, like an averaging time written with put completion.
+    Counts the number of times it is written.'''
+    def __init__(self, *args, latency=0.05, **kwargs):
+        self.latency = 0
+        self.writes  = 0
+        super().__init__(*args, **kwargs)   # this sets init_pos
+        self.latency = latency
+        self.writes  = 0
+
+    def _setup_move(self, position, status):
+        self.writes += 1
+        def finish():
+            self._set_position(position)
+            self._done_moving()
+        threading.Timer(self.latency, finish).start()
+
+
+class SimulatedDwellTimes(DwellTimes):
+    '''Dwell times with simulated QuadEM, IC0, and Xspress3 signal chains, see dwell_time_benchmark.'''
+    quadem_dwell_time   = Cpt(SimulatedDwellChain, init_pos=0.5, egu='seconds')
+    ic0_dwell_time      = Cpt(SimulatedDwellChain, init_pos=0.25, egu='seconds')
+    xspress3_dwell_time = Cpt(SimulatedDwellChain, init_pos=0.5, egu='seconds')
+
+    def writes(self):
+        return sum(real.writes for real in self._real)
+
+
+def dwell_time_benchmark(time_grid=None, nscans=3, latency=0.05):
+    '''Compare the time per point spent setting the dwell time over an
+    XAFS scan sequence, using simulated signal chains which each take
+    latency seconds to accept a new value.
+
+      every point  : every chain is written at every point, one chain after another
+      scan_nd      : scan_nd, which skips points where the dwell time does not change,
+                     with the chains written concurrently
+
+    time_grid defaults to the dwell times of the default conventional
+    grid.  Returns a dict of {case: (seconds per point, chain writes)}.
+
+    '''
+    from bluesky import RunEngine
+    from bluesky.plans import scan_nd
+    from cycler import cycler
+    if time_grid is None:
+        from BMM.xafs_functions import conventional_grid
+        time_grid = conventional_grid()[1]
+    time_grid = list(time_grid)
+    npoints = len(time_grid) * nscans
+    RE = RunEngine({})
+    results = {}
+
+    def simulated(**kwargs):
+        dwti = SimulatedDwellTimes('', name='dwti', **kwargs)
+        for real in dwti._real:
+            real.latency = latency
+        return dwti
+
+    dwti = simulated(concurrent=False)
+    start = time.time()
+    for i in range(nscans):
+        for t in time_grid:
+            dwti.move(t, wait=True)
+    results['every point'] = ((time.time() - start) / npoints, dwti.writes())
+
+    dwti = simulated()
+    start = time.time()
+    for i in range(nscans):
+        RE(scan_nd([], cycler(dwti.dwell_time, time_grid)))
+    results['scan_nd'] = ((time.time() - start) / npoints, dwti.writes())
+
+    for case, (per_point, writes) in results.items():
+        print(f'{case:12s}  {1000*per_point:7.2f} ms per point   {writes:5d} writes')
+    return results
@@ -0,0 +1,44 @@
+import time, numpy
+
+from BMM.functions import error_msg
+
+
+def evaluation_benchmark(clf, sizes=(1, 10, 500), uids=None):
+    '''Compare per-scan latency of evaluating scans one at a time
+    with evaluate_many, for clf, a BMMDataEvaluation.
+
+    With a list of uids, the runs are read from the catalog, so
+    the comparison includes I/O.  Otherwise synthetic spectra are
+    used and only the interpolation, scaling, and prediction are
+    timed.
+
+      evaluation_benchmark(clf)
+      evaluation_benchmark(clf, uids=[...], sizes=(1, 10))
+
+    '''
+    if clf.clf is None:
+        print(error_msg('there is no trained model'))
+        return
+    rng = numpy.random.default_rng()
+    print('      scans    one at a time      batched      speedup')
+    for n in sizes:
+        if uids is not None:
+            these = (list(uids) * n)[:n]
+            t0 = time.time()
+            single = [clf.evaluate(u) for u in these]
+            t1 = time.time()
+            batch = clf.evaluate_many(these)
+            t2 = time.time()
+        else:
+            spectra = []
+            for i in range(n):
+                en = numpy.sort(rng.uniform(8800, 9900, rng.integers(300, 600)))
+                spectra.append((en, numpy.arctan((en-8979)/5) + rng.normal(0, 0.01, len(en))))
+            t0 = time.time()
+            single = [clf.predict(*s) for s in spectra]
+            t1 = time.time()
+            batch = clf.predict_many(spectra)
+            t2 = time.time()
+        agree = sum(a[:1] == b[:1] for a, b in zip(single, batch))
+        (slow, fast) = ((t1-t0)/n*1000, (t2-t1)/n*1000)
+        print(f'      {n:5d}   {slow:9.2f} ms/scan {fast:9.2f} ms/scan {slow/max(fast, 1e-6):7.1f}x   ({agree}/{n} agree)')
@@ -0,0 +1,139 @@
+import numpy, json, time, datetime, tempfile, shutil, uuid
+
+from BMM.functions import e2bragg
+from BMM.telemetry import BMMTelemetry
+
+
+class StandInCatalog():
+    '''A local stand-in for the bmm catalog with just enough of its
+    interface for BMMTelemetry: search with a TimeRange or a dict of
+    (dotted) keys, items, lookup by uid, metadata, and reading the
+    dwell time, energy, and time stamp columns.  Every request sleeps for latency seconds to
+    mimic a catalog served over the network.  See benchmark.
+    '''
+    def __init__(self, runs=None, latency=0.005):
+        self.runs    = runs if runs is not None else dict()
+        self.latency = latency
+
+    @classmethod
+    def synthetic(cls, nrecords=2000, latency=0.005, elements=('Fe', 'Cu', 'Zn', 'Mn', 'Ti', 'Pt'), start_date='2021-09-01'):
+        '''Make a stand-in with nrecords XAFS records in sequences of
+        three, each sequence with one set of camera images and an XRF
+        spectrum.  The per-point overhead of each record depends on
+        the size of the mono move and the detector, as an
+        OverheadModel supposes.'''
+        rng = numpy.random.default_rng(0)
+        runs, t = dict(), datetime.datetime.fromisoformat(start_date).timestamp()
+        def add(kind, start, stop, **xdi):
+            uid = str(uuid.uuid4())
+            runs[uid] = StandInRun({'start': {'uid': uid, 'time': start, 'num_points': xdi.pop('npoints', 1),
+                                              'XDI': {'_kind': kind, **xdi}},
+                                    'stop' : {'time': stop, 'num_events': {'primary': xdi.get('_npoints', 1)}}},
+                                   latency)
+            return uid
+        for i in range(0, nrecords, 3):
+            element = elements[(i//3) % len(elements)]
+            snapshots = dict()
+            for cam in ('xrf', 'webcam', 'anacam', 'usbcam1', 'usbcam2'):
+                snapshots[f'{cam}_uid'] = add(cam, t, t + rng.uniform(1, 5))
+                t += 6
+            e0, mode = rng.uniform(5000, 20000), ('transmission', 'fluorescence')[(i//3) % 2]
+            for j in range(min(3, nrecords - i)):
+                npts = int(rng.integers(200, 500))
+                energy = e0 - 200 + numpy.cumsum(rng.choice((0.5, 2, 10), npts))
+                dwell = rng.uniform(0.5, 2.0, npts)
+                move = 1000 * numpy.abs(numpy.diff(e2bragg(energy, 3.1356), prepend=e2bragg(energy[0]-5, 3.1356)))
+                overhead = 0.3 + 0.002*move + 0.05*numpy.sqrt(move) + (0.4 if mode == 'fluorescence' else 0) + rng.exponential(0.05, npts)
+                stamps = t + 2 + numpy.cumsum(dwell + overhead)
+                elapsed = stamps[-1] + 1 - t
+                uid = add('xafs', t, t + elapsed, npoints=npts, _npoints=npts, _user={'mode': mode},
+                          Element={'symbol': element, 'edge': 'K'}, Mono={'d_spacing': '3.1356000'}, _snapshots=snapshots)
+                runs[uid].dwell, runs[uid].energy, runs[uid].time = dwell, energy, stamps
+                t += elapsed + 30
+        return cls(runs, latency)
+
+    def search(self, query):
+        time.sleep(self.latency)
+        if isinstance(query, dict):
+            tests = query
+        else:                   # a TimeRange
+            since = getattr(query, 'since', None)
+            until = getattr(query, 'until', None)
+            since = datetime.datetime.fromisoformat(since).timestamp() if isinstance(since, str) else since
+            until = datetime.datetime.fromisoformat(until).timestamp() if isinstance(until, str) else until
+            tests = {'time': {'$gte': since if since is not None else -numpy.inf,
+                              '$lt' : until if until is not None else numpy.inf}}
+        def dig(doc, key):
+            for k in key.split('.'):
+                if not isinstance(doc, dict) or k not in doc:
+                    return None
+                doc = doc[k]
+            return doc
+        def match(start):
+            for key, test in tests.items():
+                value = dig(start, key)
+                if isinstance(test, dict):
+                    if '$in'  in test and value not in test['$in']: return False
+                    if '$gte' in test and (value is None or value <  test['$gte']): return False
+                    if '$lt'  in test and (value is None or value >= test['$lt']):  return False
+                elif value != test:
+                    return False
+            return True
+        return StandInCatalog({u: r for u, r in self.runs.items() if match(r.metadata['start'])}, self.latency)
+
+    def items(self):
+        for i, (u, r) in enumerate(list(self.runs.items())):
+            if i % 100 == 0:    # one request per page of results
+                time.sleep(self.latency)
+            yield u, r
+
+    def __getitem__(self, uid):
+        time.sleep(self.latency)
+        return self.runs[uid]
+
+    def __len__(self):
+        return len(self.runs)
+
+
+class StandInRun():
+    '''One record in a StandInCatalog.'''
+    def __init__(self, metadata, latency):
+        self.metadata = metadata
+        self.latency  = latency
+        self.dwell    = numpy.ones(metadata['start']['num_points'])
+        self.energy   = numpy.arange(metadata['start']['num_points'], dtype=float)
+        self.time     = numpy.cumsum(self.dwell)
+
+    def __getitem__(self, key):
+        time.sleep(self.latency)
+        columns = {'dwti_dwell_time': self.dwell, 'dcm_energy': self.energy, 'time': self.time}
+        if len(key) == 3 and key[:2] == ('primary', 'data') and key[2] in columns:
+            return columns[key[2]]
+        raise KeyError(key)
+
+
+def benchmark(nrecords=2000, latency=0.005, workers=8):
+    '''Build the telemetry store and JSON file from a local stand-in
+    catalog, first one request at a time and then concurrently, and
+    compare the time taken and the results.
+
+      from benchmarks.telemetry import benchmark
+      benchmark(nrecords=3000, latency=0.01)
+
+    '''
+    bc = StandInCatalog.synthetic(nrecords=nrecords, latency=latency)
+    results, times = [], []
+    for label, w, b in (('sequential', 1, False), ('concurrent', workers, True)):
+        folder = tempfile.mkdtemp()
+        try:
+            tele = BMMTelemetry(bc=bc, folder=folder)
+            t0 = time.time()
+            tele.periodic_table(workers=w, batch=b)
+            times.append(time.time() - t0)
+            with open(tele.json, 'r') as fh:
+                results.append(json.load(fh))
+        finally:
+            shutil.rmtree(folder)
+        print(f'{label:12s} {times[-1]:8.2f} seconds')
+    print(f'speedup with {workers} workers: {times[0]/times[1]:.1f}x, results {"agree" if results[0] == results[1] else "DIFFER"}')
+    return times
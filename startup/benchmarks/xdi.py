@@ -0,0 +1,56 @@
+import datetime, numpy, pandas
+
+from BMM.xdi import xdi_data_block
+
+
+def xdi_data_rows(this, template, kind='xafs'):
+    '''The original row-by-row formatting of the XDI data section of
+    BMM.xdi, kept as the reference for benchmark_xdi_data_block.'''
+    text = ''
+    for i in range(0,len(this)):
+        datapoint = list(this.iloc[i])
+        if kind == 'sead':
+            ti = this.iloc[i, 0]
+            st = this.iloc[0, 0]
+            elapsed =  (ti.value - st.value)/10**9
+            datapoint[0] = elapsed
+        text += template % tuple(datapoint)
+    return text
+
+
+def benchmark_xdi_data_block(sizes=(500, 2000, 5000, 20000)):
+    '''Compare the columnar XDI data formatter to the row-by-row
+    formatter on synthetic tables shaped like transmission,
+    fluorescence, xs, xs1, 333, and SEAD data.  The two must produce
+    identical text.
+
+      benchmark_xdi_data_block(sizes=(500, 20000))
+
+    '''
+    f3, f6, f1 = '  %.3f', '  %.6f', '  %.1f'
+    shapes = {'transmission' : ('xafs', f3*3 + f6*4),
+              'fluorescence' : ('xafs', f3*3 + f6*8 + f1*12),
+              'xs'           : ('xafs', f3*3 + f6*8),
+              'xs1'          : ('xafs', f3*3 + f6*5),
+              '333'          : ('333',  f3*3 + f6*8 + f1*12),
+              'sead'         : ('sead', f3   + f6*3),}
+    rng = numpy.random.default_rng()
+    print('      mode        rows     row-by-row   columnar   speedup')
+    for mode, (kind, template) in shapes.items():
+        template = template + '\n'
+        ncol = template.count('%')
+        for npts in sizes:
+            columns = {f'c{i}': rng.uniform(0, 1e5, npts) for i in range(ncol)}
+            if kind == 'sead':
+                columns['c0'] = pandas.Timestamp.now() + pandas.to_timedelta(numpy.arange(npts)*0.537, unit='s')
+            this = pandas.DataFrame(columns)
+            t0 = datetime.datetime.now()
+            old = xdi_data_rows(this, template, kind)
+            t1 = datetime.datetime.now()
+            new = xdi_data_block(this, template, kind)
+            t2 = datetime.datetime.now()
+            if old != new:
+                print(f'      {mode:12s} {npts:6d}   output differs!')
+                continue
+            (slow, fast) = ((t1-t0).total_seconds(), (t2-t1).total_seconds())
+            print(f'      {mode:12s} {npts:6d}   {slow:8.3f} s  {fast:8.3f} s  {slow/max(fast, 1e-6):6.1f}x')
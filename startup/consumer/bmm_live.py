@@ -241,7 +241,7 @@ class LineScan():
         self.initial     = 0
 
     # this helped: https://techoverflow.net/2021/08/20/how-to-autoscale-matplotlib-xy-axis-after-set_data-call/
-    def add(self, **kwargs):
+    def add(self, redraw=True, **kwargs):
 
         if 'dcm_roll' in kwargs['data']:
             return              # this is a baseline event document, dcm_roll is almost never scanned
@@ -282,6 +282,8 @@ class LineScan():
         self.line.set_data(self.xdata, self.ydata)
         if self.numerator == 'Ic0':
             self.line2.set_data(self.xdata, self.y2data)
+        if redraw is False:     # the consumer is behind, a later event will redraw
+            return
         self.axes.relim()
         self.axes.autoscale_view(True,True,True)
         self.figure.canvas.draw()
@@ -465,8 +467,9 @@ class XAFSScan():
         
 
 
-    def add(self, **kwargs):
-        '''Add the most recent event to the current XAFS live plot.
+    def add(self, redraw=True, **kwargs):
+        '''Add the most recent event to the current XAFS live plot.  With
+        redraw=False, the data are added but the figure is not redrawn.
         '''
         if 'dcm_energy' not in kwargs['data']:
             return              # this is a baseline event document
@@ -493,6 +496,8 @@ class XAFSScan():
                 self.fluor.append( (kwargs['data'][self.xs1]+kwargs['data'][self.xs2]+kwargs['data'][self.xs3]+kwargs['data'][self.xs4])/kwargs['data']['I0'])
             self.line_muf.set_data(self.energy, self.fluor)
 
+        if redraw is False:     # the consumer is behind, a later event will redraw
+            return
         ## rescale everything
         for ax in self.axis_list:
             ax.relim()
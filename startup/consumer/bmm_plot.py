@@ -166,11 +166,13 @@ def plot_rectanglescan(bmm_catalog, uid):
     #print(out.fit_report(min_correl=0))
     out.plot(xlabel=motor, ylabel=detector)
 
-def plot_areascan(bmm_catalog, uid):
+def areascan_data(bmm_catalog, uid):
+    '''Fetch and arrange the data for plot_areascan.  This does not
+    touch matplotlib, so it can run on a worker thread.'''
     record = bmm_catalog[uid]
-    if finished(record) is False: return
+    if finished(record) is False: return None
     hint = record.metadata['start']['BMM_kafka']['hint']
-    if checkhint(hint, 'areascan') is False: return
+    if checkhint(hint, 'areascan') is False: return None
     detector, slow, fast, contour, log, energy = hint.split()[1:]
     pngout = record.metadata['start']['BMM_kafka']['pngout']
     nslow, nfast = record.metadata['start']['shape']
@@ -199,6 +201,17 @@ def plot_areascan(bmm_catalog, uid):
     z=z.reshape(nslow, nfast)
     if log == 'True':
         z = numpy.log(z)
+    return {'x': x, 'y': y, 'z': z, 'nfast': nfast, 'detector': detector, 'slow': slow, 'fast': fast,
+            'contour': contour, 'energy': energy, 'pngout': pngout}
+
+def plot_areascan(bmm_catalog, uid, data=None):
+    '''Plot an areascan, data is the output of areascan_data, which
+    is called if data is not given.'''
+    if data is None:
+        data = areascan_data(bmm_catalog, uid)
+    if data is None: return
+    x, y, z, nfast = data['x'], data['y'], data['z'], data['nfast']
+    detector, slow, fast, contour, energy, pngout = [data[k] for k in ('detector', 'slow', 'fast', 'contour', 'energy', 'pngout')]
         
     fig = plt.figure()
     fig.set_facecolor((0.95, 0.95, 0.95))
@@ -1,4 +1,6 @@
-import datetime, signal, pprint, uuid, sys, os
+import datetime, signal, pprint, uuid, sys, os, threading, queue, traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append('/home/xf06bm/.ipython/profile_collection/startup')
 
 #from bluesky_kafka import RemoteDispatcher
@@ -47,166 +49,289 @@ def handler(signal, frame):
 signal.signal(signal.SIGINT, handler)
 
 
+## The Kafka consumer is split in two.  A polling thread takes
+## documents from Kafka and puts them on the inbox queue without
+## looking at them.  The main thread -- which owns matplotlib --
+## turns each document into a Task and runs the tasks in the order
+## in which they arrived, keeping the GUI alive with plt.pause
+## between tasks.
+##
+## Messages from BMM (name == 'bmm') are routed by the handler
+## registry.  Each handler is registered against the key in the
+## message which identifies it.  A handler that needs to do slow,
+## non-graphical work -- reading from Tiled, processing data -- can
+## also register a prepare function, which is run on the worker pool.
+## The handler then gets the result of prepare on the main thread,
+## so the plots stay interactive while the data are fetched.
+##
+## When the consumer falls behind, consecutive event documents are
+## collapsed: every event is added to the live plot, but only the last
+## of a run of events redraws the figure.
+
+inbox   = queue.Queue()
+workers = ThreadPoolExecutor(max_workers=2, thread_name_prefix='consumer')
+HANDLERS = {}
+
+def handles(key, prepare=None, eager=False):
+    '''Register the decorated function as the handler for bmm messages
+    containing key.  The handler is called as handler(message, prepared),
+    where prepared is the return value of prepare(message), or None.
+
+    prepare is run on the worker pool.  By default, it is started when
+    the task reaches the front of the line, so it sees the state left
+    by the messages which came before it.  With eager=True, it is
+    started as soon as the message arrives.
+    '''
+    def register(func):
+        HANDLERS[key] = (func, prepare, eager)
+        return func
+    return register
+
+
+class Task():
+    '''One document from Kafka, waiting to be handled on the main thread.'''
+    def __init__(self, name, message, handler, prepare=None, eager=False):
+        self.name    = name
+        self.message = message
+        self.handler = handler
+        self.prepare = prepare
+        self.future  = None
+        if eager:
+            self.start()
+
+    def start(self):
+        if self.prepare is not None and self.future is None:
+            self.future = workers.submit(self.prepare, self.message)
+
+    @property
+    def ready(self):
+        self.start()
+        return self.future is None or self.future.done()
+
+    def run(self, **kwargs):
+        prepared = None if self.future is None else self.future.result()
+        self.handler(self.message, prepared, **kwargs)
+
+
+##################################################################################
+## bmm messages, in the order of precedence of the original if/elif chain
+
+def prepare_xafs_sequence(message):
+    if message['xafs_sequence'] == 'add':
+        return xafsseq.fetch(message['uid'])
+    return None
+
+@handles('xafs_sequence', prepare=prepare_xafs_sequence)
+def handle_xafs_sequence(message, prepared):
+    if message['xafs_sequence'] == 'start':
+        xafsseq.start(element=message['element'], edge=message['edge'], folder=message['folder'],
+                      repetitions=message['repetitions'], mode=message['mode'])
+    elif message['xafs_sequence'] == 'stop':
+        xafsseq.stop(filename=message['filename'])
+    elif message['xafs_sequence'] == 'add':
+        xafsseq.add(message['uid'], this=prepared)
+
+# @handles('xafs_visualization')
+# def handle_xafs_visualization(message, prepared):
+#     xafs_visualization.gridded_plot(uid=message['xafs_visualization'], element=message['element'],
+#                                     edge=message['edge'], folder=message['folder'],
+#                                     mode=message['mode'], catalog=bmm_catalog)
+
+@handles('glancing_angle')
+def handle_glancing_angle(message, prepared):
+    if message['glancing_angle'] == 'linear':
+        ga.plot_linear(**message)
+    elif message['glancing_angle'] == 'pitch':
+        ga.plot_pitch(**message)
+    elif message['glancing_angle'] == 'fluo':
+        ga.plot_fluo(**message)
+    elif message['glancing_angle'] == 'start':
+        ga.start(**message)
+    elif message['glancing_angle'] == 'stop':
+        ga.stop()
+
+@handles('align_wheel')
+def handle_align_wheel(message, prepared):
+    if message['align_wheel'] == 'start':
+        aw.start(**message)
+    elif message['align_wheel'] == 'stop':
+        aw.stop()
+    else:
+        aw.plot_rectangle(**message)
+
+@handles('wafer')
+def handle_wafer(message, prepared):
+    bmm_plot.wafer_plot(**message)
+
+@handles('mono_calibration')
+def handle_mono_calibration(message, prepared):
+    bmm_plot.mono_calibration_plot(**message)
+
+@handles('xrfat')
+def handle_xrfat(message, prepared):
+    bmm_plot.xrfat(catalog=bmm_catalog, **message)
+
+@handles('xrfplot')
+def handle_xrfplot(message, prepared):
+    bmm_plot.xrfplot(catalog=bmm_catalog, **message)
+
+@handles('linescan')
+def handle_linescan(message, prepared):
+    global doing
+    if message['linescan'] == 'start':
+        ls.start(**message)
+        doing = 'linescan'
+    elif message['linescan'] == 'stop':
+        ls.stop(**message)
+        doing = None
+
+@handles('xafsscan')
+def handle_xafsscan(message, prepared):
+    global doing
+    if message['xafsscan'] == 'start':
+        xs.start(**message)
+        doing = 'xafsscan'
+    elif message['xafsscan'] == 'next':
+        xs.Next(**message)
+    elif message['xafsscan'] == 'stop':
+        xs.stop(**message)
+        doing = None
+
+@handles('timescan')
+def handle_timescan(message, prepared):
+    global doing
+    if message['timescan'] == 'start':
+        ts.motor = None
+        ts.start(**message)
+        doing = 'timescan'
+    elif message['timescan'] == 'stop':
+        ts.stop(**message)
+        doing = None
+
+## todo...
+@handles('areascan')
+def handle_areascan(message, prepared):
+    pass
+
+@handles('close')
+def handle_close(message, prepared):
+    if message['close'] == 'all':
+        plt.close('all')
+    elif message['close'] == 'line':
+        ls.close_all_lineplots()
+    elif message['close'] == 'last':
+        plt.close(ls.plots[-1])
+
+# @handles('resting_state')
+# def handle_resting_state(message, prepared):
+#     global doing
+#     if doing == 'timescan':
+#         ts.stop()
+#     elif doing == 'xafsscan':
+#         xs.stop()
+#     elif doing == 'linescan':
+#         ts.stop()
+#     #elif doing == 'areascan':
+#     doing = None
+
+def handle_bmm(message, prepared, **kwargs):
+    print(f'\n[{datetime.datetime.now().isoformat(timespec="seconds")}]\n{pprint.pformat(message, compact=True)}')
+    for key, (handler, prepare, eager) in HANDLERS.items():
+        if key in message:
+            handler(message, prepared)
+            return
+
+
+##################################################################################
+## event and stop documents
+
+# for live plotting, need to capture and parse event documents. use
+# the global state variable "doing" to keep track of which plotting
+# chore needs to be done.  doing is looked at when the event is
+# handled, not when it arrives, so it reflects the start messages
+# which came before it.
+def handle_event(message, prepared, redraw=True):
+    if doing is None:
+        pass
+    elif doing == 'linescan':
+        ls.add(redraw=redraw, **message)
+    elif doing == 'xafsscan':
+        xs.add(redraw=redraw, **message)
+    elif doing == 'timescan':
+        ts.add(redraw=redraw, **message)
+    elif doing == 'areascan':
+        pass
+
+def prepare_stop(message):
+    '''Read the start document and, for an areascan, the data from Tiled.'''
+    uid = message['run_start']  # stop document is the second item in the doc list
+    record = bmm_catalog[uid]
+    if 'BMM_kafka' not in record.metadata['start']:
+        return None
+    kafka = dict(record.metadata['start']['BMM_kafka'])
+    data = None
+    if kafka['hint'].startswith('areascan'):
+        data = bmm_plot.areascan_data(bmm_catalog, uid)
+    return kafka, data
+
+def handle_stop(message, prepared):
+    if prepared is None:
+        return
+    kafka, data = prepared
+    verbose = False
+    for k in kafka.keys():
+        if k == 'hint':
+            continue
+        print(f"\t\t{k}: {kafka[k]}")
+    if kafka['hint'].startswith('areascan'):
+        if verbose: print('saw a areascan stop doc')
+        print(f"{datetime.datetime.now().isoformat()} document: stop\n")
+        bmm_plot.plot_areascan(bmm_catalog, message['run_start'], data=data)
+
+
+def make_task(doc):
+    '''Turn a (name, message) document into a Task, or None if there is nothing to do.'''
+    name, message = doc
+    if name == 'bmm':
+        prepare, eager = None, False
+        for key, (handler, p, e) in HANDLERS.items():
+            if key in message:
+                prepare, eager = p, e
+                break
+        return Task(name, message, handle_bmm, prepare, eager)
+    elif name == 'event':
+        return Task(name, message, handle_event)
+    elif name == 'stop':
+        return Task(name, message, handle_stop, prepare_stop, eager=True)
+    return None
+
+
+def dispatch(pending):
+    '''Run the tasks at the front of the line until reaching one whose
+    preparation is still underway.'''
+    while len(pending) > 0:
+        task = pending[0]
+        if not task.ready:
+            return
+        pending.popleft()
+        kwargs = {}
+        if task.name == 'event' and len(pending) > 0 and pending[0].name == 'event':
+            kwargs['redraw'] = False   # falling behind, let the next event redraw
+        try:
+            task.run(**kwargs)
+        except Exception:
+            print(f'failed to handle a {task.name} document:')
+            traceback.print_exc()
+
+
 def plot_from_kafka_messages(beamline_acronym):
 
     def examine_message(consumer, doctype, doc):
-        #global xafsviz_window
-        global doing
         # print(
         #     f"\n[{datetime.datetime.now().isoformat(timespec='seconds')}] document topic: {doctype}\n"
         #     f"contents: {pprint.pformat(doc)}\n"
         # )
-        name, message = doc
-
-        if name == 'bmm':
-            print(f'\n[{datetime.datetime.now().isoformat(timespec="seconds")}]\n{pprint.pformat(message, compact=True)}')
-
-            if 'xafs_sequence' in message:
-                if message['xafs_sequence'] == 'start':
-                    xafsseq.start(element=message['element'], edge=message['edge'], folder=message['folder'],
-                                  repetitions=message['repetitions'], mode=message['mode'])
-                elif message['xafs_sequence'] == 'stop':
-                    xafsseq.stop(filename=message['filename'])
-                elif message['xafs_sequence'] == 'add':
-                    xafsseq.add(message['uid'])
-
-            # elif 'xafs_visualization' in message:
-            #     xafs_visualization.gridded_plot(uid=message['xafs_visualization'], element=message['element'],
-            #                                     edge=message['edge'], folder=message['folder'],
-            #                                     mode=message['mode'], catalog=bmm_catalog)
-                    
-            elif 'glancing_angle' in message:
-                if message['glancing_angle'] == 'linear':
-                    ga.plot_linear(**message)
-                elif message['glancing_angle'] == 'pitch':
-                    ga.plot_pitch(**message)
-                elif message['glancing_angle'] == 'fluo':
-                    ga.plot_fluo(**message)
-                elif message['glancing_angle'] == 'start':
-                    ga.start(**message)
-                elif message['glancing_angle'] == 'stop':
-                    ga.stop()
-
-            elif 'align_wheel' in message:
-                if message['align_wheel'] == 'start':
-                    aw.start(**message)
-                elif message['align_wheel'] == 'stop':
-                    aw.stop()
-                else:
-                    aw.plot_rectangle(**message)
-
-            elif 'wafer' in message:
-                bmm_plot.wafer_plot(**message)
-
-            elif 'mono_calibration' in message:
-                bmm_plot.mono_calibration_plot(**message)
-
-            elif 'xrfat' in message:
-                bmm_plot.xrfat(catalog=bmm_catalog, **message)
-
-            elif 'xrfplot' in message:
-                bmm_plot.xrfplot(catalog=bmm_catalog, **message)
-
-            elif 'linescan' in message:
-                if message['linescan'] == 'start':
-                    ls.start(**message)
-                    doing = 'linescan'
-                elif message['linescan'] == 'stop':
-                    ls.stop(**message)
-                    doing = None
-
-            elif 'xafsscan' in message:
-                if message['xafsscan'] == 'start':
-                    xs.start(**message)
-                    doing = 'xafsscan'
-                elif message['xafsscan'] == 'next':
-                    xs.Next(**message)
-                elif message['xafsscan'] == 'stop':
-                    xs.stop(**message)
-                    doing = None
-
-            elif 'timescan' in message:
-                if message['timescan'] == 'start':
-                    ts.motor = None
-                    ts.start(**message)
-                    doing = 'timescan'
-                elif message['timescan'] == 'stop':
-                    ts.stop(**message)
-                    doing = None
-
-            ## todo...
-            elif 'areascan' in message:
-                pass
-
-            elif 'close' in message:
-                if message['close'] == 'all':
-                    plt.close('all')
-                elif message['close'] == 'line':
-                    ls.close_all_lineplots()
-                elif message['close'] == 'last':
-                    plt.close(ls.plots[-1])
-
-            # elif 'resting_state' in message:
-            #     if doing == 'timescan':
-            #         ts.stop()
-            #     elif doing == 'xafsscan':
-            #         xs.stop()
-            #     elif doing == 'linescan':
-            #         ts.stop()
-            #     #elif doing == 'areascan':
-            #     doing = None
-
-        # for live plotting, need to capture and parse event
-        # documents. use the global state variable "doing"
-        # to keep track of which plotting chore needs to be done.
-        elif name == 'event':
-            if doing is None:
-                pass
-            elif doing == 'linescan':
-                ##pprint.pprint(message)
-                ls.add(**message)
-            elif doing == 'xafsscan':
-                xs.add(**message)
-            elif doing == 'timescan':
-                #pprint.pprint(message)
-                ts.add(**message)
-            elif doing == 'areascan':
-                pass
-                
-        if name == 'stop':
-            #print(
-            #    f"{datetime.datetime.now().isoformat()} document: {name}\n"
-            #    f"contents: {pprint.pformat(doc)}\n"
-            #)
-            #return
-            uid = message['run_start']  # stop document is the second item in the doc list
-            record = bmm_catalog[uid]
-            verbose = False
-            if 'BMM_kafka' in record.metadata['start']:
-                hint = record.metadata['start']['BMM_kafka']['hint']
-                #print(f'[{datetime.datetime.now().isoformat(timespec="seconds")}]   {uid}')
-                for k in record.metadata['start']['BMM_kafka'].keys():
-                    if k == 'hint':
-                        continue
-                    print(f"\t\t{k}: {record.metadata['start']['BMM_kafka'][k]}")
-
-                if hint.startswith('areascan'):
-                    if verbose: print('saw a areascan stop doc')
-                    print(f"{datetime.datetime.now().isoformat()} document: {name}\n")
-                    bmm_plot.plot_areascan(bmm_catalog, uid)
-        #         elif hint.startswith('linescan'):
-        #             if verbose: print('saw a linescan stop doc')
-        #             #bmm_plot.plot_linescan(bmm_catalog, uid)
-        #         elif hint.startswith('timescan'):
-        #             if verbose: print('saw a timescan stop doc')
-        #             #bmm_plot.plot_timescan(bmm_catalog, uid)
-        #         elif hint.startswith('rectanglescan'):
-        #             if verbose: print('saw a rectanglescan stop doc')
-        #             #bmm_plot.plot_rectanglescan(bmm_catalog, uid)
-        #         elif hint.startswith('xafs'):
-        #             if verbose: print('saw an xafs stop doc')
-        #             #plt.close('all')
-        #             #bmm_plot.plot_xafs(bmm_catalog, uid)
+        inbox.put(doc)
     ## end of examine_message ##################################################################
     
     kafka_config = nslsii.kafka_utils._read_bluesky_kafka_config_file(config_file_path="/etc/bluesky/kafka.yml")
@@ -223,8 +348,35 @@ def plot_from_kafka_messages(beamline_acronym):
         process_message   = examine_message,
     )
 
+    ## if polling stops, keep the exception so the main loop can report it
+    failure = []
+    def poll():
+        try:
+            kafka_consumer.start_polling()
+        except Exception as E:
+            failure.append(E)
+
+    poller = threading.Thread(target=poll, name='kafka polling', daemon=True)
+    poller.start()
+
+    pending = deque()
     try:
-        kafka_consumer.start_polling(work_during_wait=lambda : plt.pause(.1))
+        while True:
+            polling = poller.is_alive()   # checked before draining, so nothing the poller queued is missed
+            try:
+                while True:
+                    task = make_task(inbox.get_nowait())
+                    if task is not None:
+                        pending.append(task)
+            except queue.Empty:
+                pass
+            dispatch(pending)
+            if not polling:
+                print('Kafka polling has stopped, no more documents will arrive.  Exiting Kafka consumer')
+                for E in failure:
+                    traceback.print_exception(type(E), E, E.__traceback__)
+                sys.exit(1)
+            plt.pause(.1 if len(pending) == 0 else .01)
     except KeyboardInterrupt:
         print('\nExiting Kafka consumer')
         return()
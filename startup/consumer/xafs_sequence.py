@@ -53,16 +53,27 @@ class XAFSSequence():
         #if self.fig is not None:
         #    plt.close(self.fig.number)
         
-    def add(self, uid):
+    def fetch(self, uid):
+        '''Fetch and process one scan of the sequence.  This does not
+        touch matplotlib, so it can run on a worker thread.'''
+        if 'test' in self.mode or self.ongoing is not True:
+            return None
+        this = Pandrosus()
+        this.element, this.edge, this.folder, this.db = self.element, self.edge, self.folder, self.catalog
+        this.fetch(uid, mode=self.mode)
+        return this
+
+    def add(self, uid, this=None):
+        '''Add a scan to the sequence and replot the merge.  this is the
+        output of fetch, which is called if this is not given.'''
         if 'test' in self.mode:
             return
         if self.ongoing is not True:
             print('add called, but no sequence started')
             return
+        if this is None:
+            this = self.fetch(uid)
         self.uidlist.append(uid)
-        this = Pandrosus()
-        this.element, this.edge, this.folder, this.db = self.element, self.edge, self.folder, self.catalog
-        this.fetch(uid, mode=self.mode)
         self.panlist.append(this)
         self.kek.add(this)
         if len(self.uidlist) != self.repetitions:
@@ -0,0 +1,38 @@
+'''Configuration of the tests of the BMM profile.
+
+The tests exercise the parts of the BMM package which do not need the
+beamline.  Importing most BMM modules imports BMM.user_ns, which
+starts the whole profile -- connecting to the hardware, making the
+RunEngine, and so on.  So, before any test module is collected, a bare
+BMM.user_ns is put in its place, holding just what BMM modules read
+when they are imported.  BMM.kafka is replaced the same way, so that
+the tests send no messages.
+
+Run the tests from the startup folder:
+
+   python -m pytest -q tests
+
+'''
+import os, sys, types
+from unittest.mock import MagicMock
+
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BMM
+
+user_ns = types.ModuleType('BMM.user_ns')
+user_ns.__path__ = []           # so that BMM.user_ns.bmm can be imported
+bmm = types.ModuleType('BMM.user_ns.bmm')
+bmm.BMMuser = types.SimpleNamespace(fig=None, ax=None, prev_fig=None, prev_ax=None, tweak_xas_time=0)
+user_ns.bmm, user_ns.BMMuser, user_ns.with_xspress3 = bmm, bmm.BMMuser, False
+for name in ('quadem1', 'vor', 'ic0'):
+    setattr(user_ns, name, MagicMock(name=name))
+
+kafka = types.ModuleType('BMM.kafka')
+kafka.kafka_message = lambda *args, **kwargs: None
+
+sys.modules.update({'BMM.user_ns': user_ns, 'BMM.user_ns.bmm': bmm, 'BMM.kafka': kafka})
+BMM.user_ns, BMM.kafka = user_ns, kafka
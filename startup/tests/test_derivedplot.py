@@ -0,0 +1,41 @@
+import time
+import numpy
+import pytest
+
+pytest.importorskip('bluesky')
+pytest.importorskip('matplotlib.backends.qt_compat', exc_type=ImportError)   # DerivedPlot starts the Qt teleporter when imported
+import matplotlib.pyplot as plt
+
+from BMM.derivedplot import DerivedPlot, GrowingBuffer
+
+
+def run(plot, npoints):
+    plot.start({'uid': 'start', 'scan_id': 1, 'time': time.time()})
+    plot.descriptor({'uid': 'descriptor', 'name': 'primary'})
+    for i in range(npoints):
+        plot.event({'descriptor': 'descriptor', 'seq_num': i+1, 'time': time.time(),
+                    'data': {'energy': 7000.0 + i, 'mu': numpy.sin(i/10)}, 'timestamps': {}})
+    plot.stop({'uid': 'stop', 'exit_status': 'success'})
+
+
+@pytest.mark.parametrize('max_fps', [10, None])
+def test_every_event_is_plotted(max_fps):
+    plot = DerivedPlot(lambda doc: (doc['data']['energy'], doc['data']['mu']), max_fps=max_fps)
+    run(plot, 200)
+    try:
+        assert len(plot.x_data) == 200
+        numpy.testing.assert_array_equal(plot.current_line.get_xdata(), 7000.0 + numpy.arange(200))
+        if max_fps is None:
+            assert plot.redraws['full'] >= 200
+        else:
+            assert sum(plot.redraws.values()) < 200
+    finally:
+        plt.close(plot.ax.figure)
+
+
+def test_growing_buffer():
+    buffer = GrowingBuffer(capacity=4)
+    for i in range(10):
+        buffer.append(i)
+    assert len(buffer) == 10
+    numpy.testing.assert_array_equal(buffer.values, numpy.arange(10))
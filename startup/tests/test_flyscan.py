@@ -0,0 +1,67 @@
+import numpy
+import pytest
+
+pytest.importorskip('ophyd')
+
+from BMM.flyscan import bin_edges, bin_frames, FlyRecorder, SimulatedBragg
+from BMM.functions import e2bragg, bragg2e
+
+D_SPACING = 3.1356
+
+
+def sweep(energies, npoll):
+    '''Readings polled at a steady rate while the Bragg angle moves
+    linearly from the first bin edge to the last.'''
+    edges = bin_edges(energies)
+    bragg = numpy.linspace(e2bragg(edges[0], D_SPACING), e2bragg(edges[-1], D_SPACING), npoll)
+    time  = numpy.arange(npoll) * 0.01
+    return {'time': time, 'bragg': bragg, 'I0': 10 + time}
+
+
+def test_bin_edges():
+    edges = bin_edges([1.0, 2.0, 4.0])
+    numpy.testing.assert_allclose(edges, [0.5, 1.5, 3.0, 5.0])
+
+
+def test_bin_frames():
+    energies = numpy.linspace(7000, 7100, 21)
+    frames = sweep(energies, 2000)
+    table = bin_frames(frames, energies, D_SPACING)
+    numpy.testing.assert_allclose(table['dcm_energy_setpoint'], energies)
+    numpy.testing.assert_allclose(table['dcm_energy'], energies, atol=0.5)
+    assert table['nframes'].sum() == len(frames['time'])
+    assert table['dwti_dwell_time'].sum() == pytest.approx(frames['time'][-1])
+    assert numpy.all(numpy.diff(table['I0']) > 0)
+
+
+def test_bin_frames_down_in_energy():
+    energies = numpy.linspace(7000, 7100, 21)
+    up   = bin_frames(sweep(energies, 2000), energies, D_SPACING)
+    down = bin_frames(sweep(energies[::-1], 2000), energies[::-1], D_SPACING)
+    numpy.testing.assert_allclose(down['dcm_energy'], up['dcm_energy'][::-1], atol=0.01)
+    numpy.testing.assert_array_equal(down['nframes'], up['nframes'][::-1])
+
+
+def test_bin_frames_interpolates_empty_bins():
+    energies = numpy.linspace(7000, 7100, 21)
+    frames = sweep(energies, 2000)
+    energy = bragg2e(frames['bragg'], D_SPACING)
+    keep = numpy.abs(energy - energies[10]) > 2.6
+    table = bin_frames({k: v[keep] for k, v in frames.items()}, energies, D_SPACING)
+    assert table['nframes'][10] == 0
+    assert table['I0'][10] == pytest.approx((table['I0'][9] + table['I0'][11]) / 2)
+
+
+class Broken():
+    name = 'broken'
+    def read(self):
+        raise OSError('detector went away')
+
+
+def test_recorder_surfaces_polling_errors():
+    recorder = FlyRecorder(SimulatedBragg(), [Broken()], period=0.001)
+    recorder.start()
+    recorder._thread.join(timeout=5)
+    with pytest.raises(RuntimeError) as error:
+        recorder.stop()
+    assert isinstance(error.value.__cause__, OSError)
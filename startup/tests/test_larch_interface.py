@@ -0,0 +1,54 @@
+import numpy, pandas
+import pytest
+
+pytest.importorskip('larch')
+
+from BMM.larch_interface import ScanCache
+
+
+class Run():
+    def __init__(self, catalog, uid):
+        self.catalog, self.uid = catalog, uid
+
+    def table(self, fields=None):
+        self.catalog.reads.append((self.uid, tuple(fields)))
+        return pandas.DataFrame({f: numpy.arange(100, dtype=float) for f in fields})
+
+
+class Catalog():
+    '''Just enough of a catalog for ScanCache.read, it counts the reads.'''
+    def __init__(self):
+        self.reads = []
+
+    def __getitem__(self, uid):
+        return Run(self, uid)
+
+
+def test_subset_is_served_from_cache():
+    cache, db = ScanCache(), Catalog()
+    cache.columns(db, 'a', ['dcm_energy', 'I0', 'It', 'Ir'])
+    ref = cache.columns(db, 'a', ['dcm_energy', 'It', 'Ir'])
+    assert len(db.reads) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert sorted(ref) == ['Ir', 'It', 'dcm_energy']
+    assert not ref['It'].flags.writeable
+
+
+def test_eviction_is_least_recently_used():
+    table = 3 * 100 * 8          # three columns of 100 floats
+    cache, db = ScanCache(maxbytes=2*table), Catalog()
+    columns = ['dcm_energy', 'I0', 'It']
+    cache.columns(db, 'a', columns)
+    cache.columns(db, 'b', columns)
+    cache.columns(db, 'a', columns)      # a is now more recent than b
+    cache.columns(db, 'c', columns)      # so b is evicted
+    assert [key[0] for key in cache.tables] == ['a', 'c']
+    assert cache.nbytes == 2*table
+    cache.columns(db, 'b', columns)
+    assert [r[0] for r in db.reads] == ['a', 'b', 'c', 'b']
+
+
+def test_one_table_larger_than_the_bound_is_kept():
+    cache, db = ScanCache(maxbytes=10), Catalog()
+    data = cache.columns(db, 'a', ['dcm_energy'])
+    assert len(cache.tables) == 1 and len(data['dcm_energy']) == 100
@@ -0,0 +1,85 @@
+import numpy
+import pytest
+
+import BMM.xafs_functions as xf
+from BMM.functions import etok, ktoe
+
+
+def regions(bounds, steps, times, e0, ththth=False):
+    '''Build the grids one region at a time with numpy.arange, as
+    conventional_grid used to.'''
+    bounds = sorted(ktoe(float(b[:-1])) if type(b) is str else float(b) for b in bounds)
+    enot, scale = (e0/3.0, 3.0) if ththth else (e0, 1.0)
+    bounds = [b/scale for b in bounds]
+    grid, timegrid = [], []
+    for i, s in enumerate(steps):
+        if type(s) is str:
+            ar = enot + ktoe(numpy.arange(etok(bounds[i]), etok(bounds[i+1]), float(s[:-1])/scale))
+        else:
+            ar = numpy.arange(enot+bounds[i], enot+bounds[i+1], s/scale)
+        grid.extend(ar)
+        if type(times[i]) is str:
+            timegrid.extend(etok(ar-enot)*float(times[i][:-1]))
+        else:
+            timegrid.extend(times[i]*numpy.ones(len(ar)))
+    return numpy.round(grid, decimals=2), numpy.round(timegrid, decimals=2)
+
+
+@pytest.mark.parametrize('bounds, steps, times, e0, ththth', [
+    ((-200, -30, 15.3, '14k'),                    (10, 0.5, '0.05k'),            (0.5, 0.5, '0.25k'),  7112,  False),
+    ((-200.0, -20.0, 30.0, '5k', '14.5k'),        (10.0, 0.5, 2, '0.05k'),       (1, 1, 1, '1k'),      7112,  False),
+    ((-200, -30, -10, 15, 100, 300, 500),         (10, 2, 0.5, '0.05k', '0.05k', '0.05k'), (0.5, 0.5, 0.5, 1, 2, 3), 7112, False),
+    ((-10, 40),                                   (0.25,),                       (0.5,),               7112,  False),
+    ((-200, -30, 15.3, '14k'),                    (10, 0.5, '0.05k'),            (0.5, 0.5, '0.25k'),  24350, True),
+])
+def test_step_grid_matches_regions(bounds, steps, times, e0, ththth):
+    grid, timegrid = xf._step_grid(bounds, steps, times, e0, ththth)
+    expected, expected_times = regions(bounds, steps, times, e0, ththth)
+    assert len(grid) == len(expected)
+    numpy.testing.assert_allclose(grid, expected, atol=0.011)
+    numpy.testing.assert_allclose(timegrid, expected_times, atol=0.011)
+
+
+def test_step_grid_is_memoized_and_read_only():
+    args = ((-200, -30, 15.3, '14k'), (10, 0.5, '0.05k'), (0.5, 0.5, '0.25k'), 7112, False)
+    first, again = xf._step_grid(*args), xf._step_grid(*args)
+    assert first[0] is again[0]
+    with pytest.raises(ValueError):
+        first[0][0] = 0
+
+
+@pytest.fixture
+def overhead(monkeypatch):
+    '''A time estimate of the dwell times plus half a second per point.'''
+    def estimate(grid, timegrid, element=None, mode=None):
+        return ((sum(timegrid) + 0.5*len(timegrid)) / 60, 0)
+    monkeypatch.setattr(xf, 'estimate_scan_time', estimate)
+
+
+def test_adaptive_grid_steps(overhead):
+    grid, timegrid, approximate_time, delta = xf.adaptive_grid(bounds=[-200, '14k'], e0=7112, duration=20, kweight=2)
+    step = numpy.diff(grid)
+    assert grid[0] == 7112 - 200 and grid[-1] <= 7112 + ktoe(14)
+    assert numpy.all(step > 0)
+    assert step[0] == pytest.approx(10, abs=0.5)
+    assert step[numpy.searchsorted(grid, 7112)] == pytest.approx(0.5, abs=0.05)
+    assert numpy.all(step[1:] / step[:-1] < 1.5) and numpy.all(step[:-1] / step[1:] < 1.5)   # no jumps between regions
+
+
+def test_adaptive_grid_dwell_times(overhead):
+    grid, timegrid, approximate_time, delta = xf.adaptive_grid(bounds=[-200, '14k'], e0=7112, duration=20, kweight=2,
+                                                               mindwell=0.5, maxdwell=20)
+    below = timegrid[grid < 7112]
+    assert numpy.all(below == below[0])
+    assert numpy.all(numpy.diff(timegrid) >= 0)
+    assert timegrid.min() >= 0.5 and timegrid.max() <= 20
+    assert approximate_time == pytest.approx(20, rel=0.01)
+
+
+def test_adaptive_grid_too_short(overhead):
+    grid, timegrid, approximate_time, delta = xf.adaptive_grid(bounds=[-200, '14k'], e0=7112, duration=1, mindwell=0.5)
+    assert numpy.all(timegrid == 0.5)
+
+
+def test_adaptive_grid_empty():
+    assert xf.adaptive_grid(bounds=[100, 50], e0=7112) == (None, None, None, None)
@@ -0,0 +1,47 @@
+import numpy, pandas
+import pytest
+
+pytest.importorskip('bluesky')
+
+from BMM.xdi import xdi_data_block
+
+
+def rows(this, template, kind='xafs'):
+    '''Format a table one row at a time, as write_XDI used to.'''
+    text = ''
+    for i in range(len(this)):
+        datapoint = list(this.iloc[i])
+        if kind == 'sead':
+            datapoint[0] = (this.iloc[i, 0].value - this.iloc[0, 0].value) / 10**9
+        text += template % tuple(datapoint)
+    return text
+
+
+def table(ncol, npts, sead=False):
+    rng = numpy.random.default_rng(7)
+    columns = {f'c{i}': rng.uniform(0, 1e5, npts) for i in range(ncol)}
+    if sead:
+        columns['c0'] = pandas.Timestamp('2024-01-01') + pandas.to_timedelta(numpy.arange(npts)*0.537, unit='s')
+    return pandas.DataFrame(columns)
+
+
+@pytest.mark.parametrize('kind, template', [
+    ('xafs', '  %.3f  %.3f  %.3f  %.6f  %.6f  %.6f  %.6f\n'),
+    ('xafs', '  %.3f  %.3f  %.3f' + '  %.6f'*8 + '  %.1f'*12 + '\n'),
+    ('333',  '  %.3f  %.3f  %.3f' + '  %.6f'*5 + '\n'),
+    ('sead', '  %.3f  %.6f  %.6f  %.6f\n'),
+])
+def test_xdi_data_block_matches_rows(kind, template):
+    this = table(template.count('%'), 250, sead=(kind == 'sead'))
+    assert xdi_data_block(this, template, kind) == rows(this, template, kind)
+
+
+def test_xdi_data_block_sead_t0():
+    this = table(4, 5, sead=True)
+    t0 = this.iloc[0, 0].value - 2*10**9
+    first = xdi_data_block(this, '  %.3f  %.6f  %.6f  %.6f\n', 'sead', t0=t0).split('\n')[0]
+    assert first.split()[0] == '2.000'
+
+
+def test_xdi_data_block_empty():
+    assert xdi_data_block(table(7, 0), '  %.3f'*7 + '\n') == ''